@@ -35,6 +35,25 @@ const sortMessages = (messages) => {
   });
 };
 
+// Message from the socket or the REST API in the shape the list renders
+const formatMessage = (msg) => ({
+  id: msg.id || msg._id,
+  content: msg.content,
+  sender_id: msg.sender_id,
+  timestamp: msg.timestamp || msg.sent_at,
+  message_type: msg.message_type || 'text',
+  metadata: msg.metadata || {},
+  read: Boolean(msg.read),
+  sequence: msg.sequence || 0
+});
+
+// Add incoming messages not held yet, by id, keeping the list ordered
+const mergeMessages = (current, incoming) => {
+  const known = new Set(current.map(msg => msg.id));
+  const added = incoming.filter(msg => !known.has(msg.id));
+  return added.length ? sortMessages([...current, ...added]) : current;
+};
+
 const getWsHost = () => {
   // First check localStorage for override
   const localStorageHost = localStorage.getItem('wsHost');
@@ -87,7 +106,6 @@ const ChatContainer = ({
   const [isAtBottom, setIsAtBottom] = useState(true);
   const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [hasMoreMessages, setHasMoreMessages] = useState(true);
-  const [page, setPage] = useState(1);
   const PAGE_SIZE = 30;
 
   // WebSocket refs
@@ -95,6 +113,36 @@ const ChatContainer = ({
   const reconnectTimerRef = useRef(null);
   const pingIntervalRef = useRef(null);
   const hasInitializedRef = useRef(false);
+
+  // Sequences held, for syncing on reconnect and scrolling back
+  const lastSequenceRef = useRef(0);
+  const oldestSequenceRef = useRef(null);
+  const syncTimeRef = useRef(null);
+  // Scroll height when older messages were requested; null when none are loading
+  const olderScrollHeightRef = useRef(null);
+
+  useEffect(() => {
+    const sequences = messages.map(msg => msg.sequence).filter(Boolean);
+    if (sequences.length > 0) {
+      lastSequenceRef.current = Math.max(lastSequenceRef.current, ...sequences);
+      oldestSequenceRef.current = Math.min(...sequences);
+    }
+  }, [messages]);
+
+  // Older messages arrived (or failed to): keep the view on the message that was on top
+  const finishLoadingOlder = useCallback((hasMore) => {
+    const oldScrollHeight = olderScrollHeightRef.current;
+    olderScrollHeightRef.current = null;
+    setHasMoreMessages(hasMore);
+    setIsLoadingMore(false);
+    
+    setTimeout(() => {
+      const container = messageContainerRef.current;
+      if (container && oldScrollHeight !== null) {
+        container.scrollTop = container.scrollHeight - oldScrollHeight;
+      }
+    }, 50);
+  }, []);
   // console.log('currentUser:', currentUser);
 
   // Add this function to scroll to bottom
@@ -143,7 +191,6 @@ const ChatContainer = ({
           return sortMessages([...standardizedMessages, ...pendingMessages]);
         });
         
-        setPage(1);
         setHasMoreMessages(messagesResponse.data.messages.length >= PAGE_SIZE);
       }
     } catch (error) {
@@ -223,7 +270,9 @@ const ChatContainer = ({
     }
     
     // Add user_id as query parameter as backup auth
-    const wsUrl = `${protocol}//${host}${path}?user_id=${currentUser?.user?.id || ''}`;
+    // A reconnect passes the last sequence it holds and is sent only what it missed
+    const wsUrl = `${protocol}//${host}${path}?user_id=${currentUser?.user?.id || ''}` +
+      ChatService.syncQuery(lastSequenceRef.current, syncTimeRef.current);
     console.log(`Connecting to WebSocket: ${wsUrl}`);
     
     // Add extra debugging for protocol decision
@@ -263,8 +312,7 @@ const ChatContainer = ({
           setMessageQueue([]);
         }
         
-        // Refresh messages to ensure we have the latest
-        refreshMessages();
+        // Missed messages arrive as a sync frame (reconnect) or message_history (first connect)
       };
       
       socket.onmessage = (event) => {
@@ -339,6 +387,7 @@ const ChatContainer = ({
                           timestamp: data.timestamp,
                           message_type: data.message_type || 'text',
                           metadata: data.metadata || {},
+                          sequence: data.sequence || 0,
                           pending: false
                         } 
                       : msg
@@ -365,7 +414,8 @@ const ChatContainer = ({
                     sender_id: data.sender_id,
                     timestamp: data.timestamp,
                     message_type: data.message_type || 'text',
-                    metadata: data.metadata || {}
+                    metadata: data.metadata || {},
+                    sequence: data.sequence || 0
                   };
                   
                   return sortMessages([...prevMessages, newMessage]);
@@ -383,7 +433,8 @@ const ChatContainer = ({
                     sender_id: data.sender_id,
                     timestamp: data.timestamp || new Date().toISOString(),
                     message_type: data.message_type || 'text',
-                    metadata: data.metadata || {}
+                    metadata: data.metadata || {},
+                    sequence: data.sequence || 0
                   };
                   
                   setTimeout(scrollToBottom, 50);
@@ -395,25 +446,42 @@ const ChatContainer = ({
           } else if (data.type === 'user_status') {
             setRecipientStatus(data.status);
           } else if (data.type === 'message_history') {
-              // Only process message history if we don't already have messages
-            if (data.messages && Array.isArray(data.messages) && messages.length === 0) {
-
-              
-              const formattedMessages = data.messages.map(msg => ({
-                id: msg._id || msg.id,
-                content: msg.content,
-                sender_id: msg.sender_id,
-                timestamp: msg.timestamp || msg.sent_at,
-                message_type: msg.message_type || 'text',
-                metadata: msg.metadata || {}
-              }));
-              
-              // Add to processed set
+            // The latest page on first connect, or the reply to a load_older frame
+            if (Array.isArray(data.messages)) {
+              const formattedMessages = data.messages.map(formatMessage);
               formattedMessages.forEach(msg => processedMessages.add(msg.id));
+              setMessages(prevMessages => mergeMessages(prevMessages, formattedMessages));
               
-              // Sort by timestamp
-              setMessages(sortMessages(formattedMessages));
-              setTimeout(scrollToBottom, 100);
+              if (olderScrollHeightRef.current !== null) {
+                finishLoadingOlder(Boolean(data.has_more));
+              } else {
+                setTimeout(scrollToBottom, 100);
+              }
+            }
+          } else if (data.type === 'sync') {
+            // Messages missed while disconnected, plus edits and deletions of ones already held
+            const missedMessages = (data.messages || []).map(formatMessage);
+            const changes = new Map((data.changes || []).map(msg => [msg.id, msg]));
+            missedMessages.forEach(msg => processedMessages.add(msg.id));
+            
+            setMessages(prevMessages => mergeMessages(
+              prevMessages.map(msg => {
+                const changed = changes.get(msg.id);
+                return changed ? { ...msg, content: changed.content, read: Boolean(changed.read) } : msg;
+              }),
+              missedMessages
+            ));
+            
+            if (data.has_more) {
+              // Capped reply: ask for the rest from where it stopped
+              socket.send(JSON.stringify(ChatService.syncFrame(data.last_sequence, syncTimeRef.current)));
+            } else {
+              syncTimeRef.current = data.sync_time;
+            }
+          } else if (data.type === 'error') {
+            console.error("Chat server error:", data.message);
+            if (olderScrollHeightRef.current !== null) {
+              finishLoadingOlder(false);
             }
           }
         } catch (error) {
@@ -425,6 +493,11 @@ const ChatContainer = ({
         console.log(`WebSocket closed: ${event.code} ${event.reason || 'No reason'}`);
         setConnectionStatus('disconnected');
         
+        // A load_older request on this socket will not be answered
+        if (olderScrollHeightRef.current !== null) {
+          finishLoadingOlder(true);
+        }
+        
         // Clear the ping interval
         if (pingIntervalRef.current) {
           clearInterval(pingIntervalRef.current);
@@ -479,7 +552,7 @@ const ChatContainer = ({
       console.error("Error initializing WebSocket:", error);
       setConnectionStatus('error');
     }
-  }, [currentUser, conversationType, sessionId, messageQueue, processedMessages, refreshMessages]);
+  }, [currentUser, conversationType, sessionId, messageQueue, processedMessages, refreshMessages, finishLoadingOlder]);
 
   // Send message function
   const sendMessage = useCallback((content, attachments = null) => {
@@ -627,7 +700,6 @@ const ChatContainer = ({
         const sortedMessages = sortMessages(standardizedMessages);
         
         setMessages(sortedMessages);
-        setPage(1);
         
         // Check if there might be more messages
         setHasMoreMessages(messagesResponse.data.messages.length >= PAGE_SIZE);
@@ -915,65 +987,39 @@ const ChatContainer = ({
     return () => container.removeEventListener('scroll', handleScroll);
   }, [isLoadingMore, hasMoreMessages]);
 
-  // Add this function to load older messages
+  // Load the page of messages before the oldest one held
   const loadMoreMessages = useCallback(async () => {
     if (!conversationId || isLoadingMore || !hasMoreMessages) return;
     
+    const beforeSequence = oldestSequenceRef.current;
+    if (!beforeSequence) {
+      setHasMoreMessages(false);
+      return;
+    }
+    
+    setIsLoadingMore(true);
+    olderScrollHeightRef.current = messageContainerRef.current?.scrollHeight || 0;
+    
+    // Over the socket when connected; the reply arrives as a message_history frame
+    if (socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
+      socketRef.current.send(JSON.stringify(ChatService.loadOlderFrame(beforeSequence, PAGE_SIZE)));
+      return;
+    }
+    
     try {
-      setIsLoadingMore(true);
-      const nextPage = page + 1;
-      
-      // Save current scroll position
-      const container = messageContainerRef.current;
-      const oldScrollHeight = container.scrollHeight;
+      const messagesResponse = await ChatService.getMessagesBefore(conversationId, beforeSequence, PAGE_SIZE);
+      const olderMessages = (messagesResponse?.data?.messages || []).map(formatMessage);
       
-      // Load older messages with pagination
-      const messagesResponse = await ChatService.getConversationMessages(
-        conversationId, 
-        nextPage, 
-        PAGE_SIZE
-      );
+      // Add to processed set to avoid duplicates
+      olderMessages.forEach(msg => processedMessages.add(msg.id));
       
-      if (messagesResponse?.data?.messages?.length > 0) {
-        const oldMessages = messagesResponse.data.messages.map(msg => ({
-          id: msg.id || msg._id,
-          content: msg.content,
-          sender_id: msg.sender_id,
-          timestamp: msg.timestamp || msg.sent_at,
-          message_type: msg.message_type || 'text',
-          metadata: msg.metadata || {},
-          read: Boolean(msg.read)
-        }));
-        
-        // Add to processed set to avoid duplicates
-        oldMessages.forEach(msg => {
-          processedMessages.add(msg.id);
-        });
-        
-        // Prepend old messages to current messages
-        setMessages(prevMessages => [...oldMessages, ...prevMessages]);
-        setPage(nextPage);
-        
-        // If we got fewer messages than requested, there are no more
-        if (oldMessages.length < PAGE_SIZE) {
-          setHasMoreMessages(false);
-        }
-        
-        // Restore scroll position after new messages are rendered
-        setTimeout(() => {
-          if (container) {
-            container.scrollTop = container.scrollHeight - oldScrollHeight;
-          }
-        }, 50);
-      } else {
-        setHasMoreMessages(false);
-      }
+      setMessages(prevMessages => mergeMessages(prevMessages, olderMessages));
+      finishLoadingOlder(olderMessages.length >= PAGE_SIZE);
     } catch (error) {
       console.error("Error loading more messages:", error);
-    } finally {
-      setIsLoadingMore(false);
+      finishLoadingOlder(true);
     }
-  }, [conversationId, page, isLoadingMore, hasMoreMessages]);
+  }, [conversationId, isLoadingMore, hasMoreMessages, processedMessages, finishLoadingOlder]);
 
   // Update the effect that handles new messages to auto-scroll only if at bottom
   useEffect(() => {
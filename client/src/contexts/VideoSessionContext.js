@@ -2,6 +2,7 @@ import React, { createContext, useContext, useState, useRef, useCallback, useEff
 import WebSocketManager from '../services/WebSocketManager';
 import { useAuth } from '../contexts/AuthContext';
 import SessionService from '../services/SessionServices';
+import EmotionService from '../services/EmotionServices';
 import { toast as notifications } from 'react-toastify';
 
 // Global connection tracking
@@ -1428,11 +1429,19 @@ export const VideoSessionProvider = ({ children }) => {
       );
       
       if (response.data.success) {
+        // The recording is processed by an analysis job (202); its result carries the recording id
+        let recordingId = response.data.recording_id;
+        if (response.data.job_id) {
+          setRecordingState(prev => ({ ...prev, processingStatus: 'processing' }));
+          const job = await EmotionService.waitForJob(response.data.job_id, { interval: 5000 });
+          recordingId = job.result?.recording_id;
+        }
+        
         setRecordingState(prev => ({
           ...prev,
           isProcessing: false,
           processingStatus: 'completed',
-          recordingId: response.data.recording_id
+          recordingId
         }));
         
         console.log("Recording uploaded and processed successfully:", response.data);
@@ -161,10 +161,31 @@ const MediaAnalysis = () => {
       }, isVideo ? 1000 : 500); // Slower updates for video
   
       // Upload the file
-      const response = await EmotionService.uploadAndAnalyze(formData);
+      let response;
+      try {
+        response = await EmotionService.uploadAndAnalyze(formData);
+      } finally {
+        clearInterval(progressInterval);
+      }
+  
+      // The server queues the analysis as a job (202); follow its real progress
+      if (response.data.job_id) {
+        await EmotionService.waitForJob(response.data.job_id, {
+          onProgress: (job) => {
+            const { percent = 0, stage } = job.progress || {};
+            setUploadProgress((prev) => Math.max(prev, Math.min(percent, 99)));
+            if (job.status === 'queued' || stage === 'retrying') {
+              setUploadPhase('queued');
+            } else if (stage === 'uploading' || stage === 'saving') {
+              setUploadPhase('finalizing');
+            } else if (job.status === 'running') {
+              setUploadPhase(isVideo ? 'analyzing_frames' : 'analyzing');
+            }
+          }
+        });
+      }
   
-      // Clear the interval and set progress to 100%
-      clearInterval(progressInterval);
+      // Set progress to 100%
       setUploadProgress(100);
       setUploadPhase('complete');
   
@@ -182,7 +203,7 @@ const MediaAnalysis = () => {
   
     } catch (err) {
       console.error('Error uploading file:', err);
-      setUploadError(err.response?.data?.error || 'Failed to upload and analyze file');
+      setUploadError(err.response?.data?.error || err.job?.error || 'Failed to upload and analyze file');
       setIsUploading(false);
       setUploadProgress(0);
       setUploadPhase('');
@@ -289,6 +310,7 @@ const MediaAnalysis = () => {
                 <div className="flex justify-between text-sm text-gray-500">
                 <span>
                     {uploadPhase === 'uploading' && 'Uploading media...'}
+                    {uploadPhase === 'queued' && 'Waiting for an analysis worker...'}
                     {uploadPhase === 'preprocessing' && 'Preprocessing...'}
                     {uploadPhase === 'analyzing_frames' && 'Analyzing video frames...'}
                     {uploadPhase === 'analyzing' && 'Analyzing emotions...'}
@@ -41,6 +41,7 @@ const MediaDetail = () => {
   const [error, setError] = useState("");
   const [isDeleting, setIsDeleting] = useState(false);
   const [activeTab, setActiveTab] = useState("emotions");
+  const [charts, setCharts] = useState({});
 
   // Chart references
   const emotionChartRef = useRef(null);
@@ -73,6 +74,27 @@ const MediaDetail = () => {
     }
   }, [analysis, loading, activeTab]);
 
+  // Server-rendered charts are generated on demand, so fetch them separately
+  useEffect(() => {
+    if (!analysis || analysis.media_type !== "video") return;
+
+    let cancelled = false;
+    ["timeline_graph", "emotion_heatmap"].forEach(async (vizType) => {
+      try {
+        const response = await EmotionService.getVisualization(analysisId, vizType, { format: "png" });
+        if (!cancelled) {
+          setCharts((prev) => ({ ...prev, [vizType]: response.data.visualization }));
+        }
+      } catch (err) {
+        // Chart not available for this analysis
+      }
+    });
+
+    return () => {
+      cancelled = true;
+    };
+  }, [analysis, analysisId]);
+
   const initializeCharts = () => {
     // Clean up existing charts
     if (emotionChartRef.current) {
@@ -394,7 +416,7 @@ const MediaDetail = () => {
 
         {/* Content based on active tab */}
         {activeTab === "emotions" ? (
-          <EmotionsTab analysis={analysis} getEmotionColor={getEmotionColor} />
+          <EmotionsTab analysis={analysis} charts={charts} getEmotionColor={getEmotionColor} />
         ) : (
           <DataTab analysis={analysis} />
         )}
@@ -406,7 +428,7 @@ const MediaDetail = () => {
 // Emotions Tab Component
 // Update the EmotionsTab component to better handle video data
 
-const EmotionsTab = ({ analysis, getEmotionColor }) => {
+const EmotionsTab = ({ analysis, charts = {}, getEmotionColor }) => {
   const dominantEmotion =
     analysis.results?.dominant_emotion ||
     analysis.results?.overall?.dominant_emotion ||
@@ -731,10 +753,10 @@ const EmotionsTab = ({ analysis, getEmotionColor }) => {
               </h2>
             </div>
             <div className="p-6">
-              {analysis.results?.timeline_graph ? (
+              {charts.timeline_graph ? (
                 <div className="w-full">
                   <img
-                    src={analysis.results.timeline_graph}
+                    src={charts.timeline_graph}
                     alt="Emotion timeline"
                     className="w-full"
                   />
@@ -804,14 +826,14 @@ const EmotionsTab = ({ analysis, getEmotionColor }) => {
 
         {/* Other sections */}
         {/* Frame-by-frame visualization for videos */}
-        {isVideo && analysis.results?.frames && analysis.results.frames.some(frame => frame.faces?.length > 0) && (
+        {isVideo && analysis.results?.key_frames?.length > 0 && (
           <div className="lg:col-span-3 bg-white rounded-xl shadow-sm">
             <div className="p-6 border-b border-gray-200 flex justify-between items-center">
               <h2 className="text-xl font-semibold text-gray-800">
                 Key Frames Analysis
               </h2>
               <span className="text-sm text-gray-500">
-                {analysis.results.frames.filter(f => f.faces?.length > 0).length} frames with detected faces
+                {analysis.results.frames_with_faces ?? analysis.results.key_frames.length} frames with detected faces
               </span>
             </div>
             <div className="p-6">
@@ -825,11 +847,11 @@ const EmotionsTab = ({ analysis, getEmotionColor }) => {
                 </div>
               ) : (
                 <div className="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-4 gap-4">
-                  {analysis.results.frames
-                    .filter(frame => frame.faces?.length > 0)
-                    .slice(0, 12) // Limit to 12 frames
+                  {analysis.results.key_frames
+                    // Limit to 12 frames, spread over the whole video
+                    .filter((frame, index, all) => index % Math.ceil(all.length / 12) === 0)
                     .map((frame, index) => {
-                      const dominantEmotion = frame.faces[0]?.dominant_emotion || "neutral";
+                      const dominantEmotion = frame.dominant_emotion || "neutral";
                       return (
                         <div key={index} className="relative border rounded overflow-hidden">
                           <div className="absolute top-0 right-0 bg-black/70 text-white text-xs px-2 py-1">
@@ -838,7 +860,7 @@ const EmotionsTab = ({ analysis, getEmotionColor }) => {
                           <div className={`absolute top-0 left-0 w-1.5 h-full bg-${getEmotionColor(dominantEmotion).replace('#', '')}`}></div>
                           <div className="absolute bottom-0 left-0 right-0 bg-black/70 text-white text-xs px-2 py-1 flex justify-between">
                             <span className="capitalize">{dominantEmotion}</span>
-                            <span>{Math.round(frame.faces[0]?.confidence * 100)}%</span>
+                            <span>{Math.round(frame.confidence * 100)}%</span>
                           </div>
                         </div>
                       );
@@ -864,7 +886,7 @@ const EmotionsTab = ({ analysis, getEmotionColor }) => {
         )}
 
         {/* Add Emotion Heatmap */}
-        {analysis.results?.emotion_heatmap && (
+        {charts.emotion_heatmap && (
           <div className="lg:col-span-3 bg-white rounded-xl shadow-sm">
             <div className="p-6 border-b border-gray-200">
               <h2 className="text-xl font-semibold text-gray-800">
@@ -874,7 +896,7 @@ const EmotionsTab = ({ analysis, getEmotionColor }) => {
             <div className="p-6">
               <div className="flex justify-center">
                 <img
-                  src={analysis.results.emotion_heatmap}
+                  src={charts.emotion_heatmap}
                   alt="Emotion intensity heatmap"
                   className="max-w-full"
                 />
@@ -46,6 +46,30 @@ class ChatService {
     });
   }
 
+  // Page of messages before a sequence (scroll-back without a socket)
+  getMessagesBefore(conversationId, beforeSequence, limit = 50) {
+    return api.get(`/messages/conversations/${conversationId}/messages/`, {
+      params: { before_sequence: beforeSequence, limit },
+    });
+  }
+
+  // Websocket sync: a reconnecting socket passes the highest sequence it
+  // holds (and the sync_time of its last sync) to receive only what it missed
+  syncQuery(lastSequence, syncTime = null) {
+    if (!lastSequence) return "";
+    const params = new URLSearchParams({ last_sequence: lastSequence });
+    if (syncTime) params.set("since", syncTime);
+    return `&${params.toString()}`;
+  }
+
+  syncFrame(lastSequence, syncTime = null) {
+    return { type: "sync", last_sequence: lastSequence, since: syncTime };
+  }
+
+  loadOlderFrame(beforeSequence, limit = 50) {
+    return { type: "load_older", before_sequence: beforeSequence, limit };
+  }
+
   markMessagesRead(conversationId, messageIds) {
     return api.post(`/messages/read/${messageIds.join(",")}`, {
       conversation_id: conversationId,
@@ -23,12 +23,38 @@ const EmotionService = {
     });
   },
   
-  getVisualization: (analysisId, vizType) => {
-    return api.get(`/emotions/visualization/${analysisId}/${vizType}/`);
+  getVisualization: (analysisId, vizType, params = {}) => {
+    return api.get(`/emotions/visualization/${analysisId}/${vizType}/`, { params });
   },
   
   deleteAnalysis: (analysisId) => {
     return api.delete(`/emotions/delete/${analysisId}/`);
+  },
+
+  getJob: (jobId) => {
+    return api.get(`/emotions/jobs/${jobId}/`);
+  },
+
+  cancelJob: (jobId) => {
+    return api.post(`/emotions/jobs/${jobId}/cancel/`);
+  },
+
+  // Poll an analysis job until it finishes; resolves with the job once it
+  // succeeded and rejects if it failed or was cancelled.
+  // onProgress receives every status payload ({status, progress: {percent, stage, eta_seconds}})
+  waitForJob: async (jobId, { onProgress, interval = 2000 } = {}) => {
+    for (;;) {
+      const { data: job } = await EmotionService.getJob(jobId);
+      if (onProgress) onProgress(job);
+
+      if (job.status === 'succeeded') return job;
+      if (job.status === 'failed' || job.status === 'cancelled') {
+        const error = new Error(job.error || `Analysis ${job.status}`);
+        error.job = job;
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, interval));
+    }
   }
 };
 
@@ -8,12 +8,20 @@ import os
 from bson import ObjectId
 import logging
 import traceback
+from urllib.parse import parse_qs
 from database import db  # Import MongoDB connection
 
 # Import models
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
-from apps.chat_messages.models import Message, Conversation
+from apps.chat_messages.models import Message, Conversation, allocate_sequence, MAX_SYNC_BATCH
+from apps.chat_messages.read_receipts import ReadReceiptBatcher
+from apps.chat_messages.ephemeral import TypingState, presence_batcher
+from apps.chat_messages.message_cache import message_cache, CHAT_CACHE_MESSAGES
+from apps.chat_messages.write_behind import (
+    chat_persistence, CHAT_WRITE_BEHIND, ACK_DELIVERED, ACK_PERSISTED, ACK_FAILED
+)
 from apps.users.models import User
+from apps.users.presence import presence_registry
 from apps.therapy_sessions.models import TherapySession
 from apps.ai_services.help_assistant import HelpAssistant
 import uuid
@@ -41,6 +49,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         # Initialize room_group_name early to avoid the disconnect issue
         self.room_group_name = None
+        self.read_receipts = ReadReceiptBatcher(self.write_read_receipt)
+        self.typing = TypingState(self.publish_typing)
+        self.presence_registered = False
         
         if not self.user_id:
             print("WebSocket rejected - no user ID in URL")
@@ -106,6 +117,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
+        # Hear about other workers' writes to cached conversations
+        await message_cache.ensure_listener(self.channel_layer)
+        
         # Add user to presence group
         await self.channel_layer.group_add(
             f"presence_{self.user_id}",
@@ -115,6 +129,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Accept the WebSocket connection
         await self.accept()
         
+        # Count this connection towards the user's presence (kept alive by the process heartbeat)
+        await self.register_presence()
+        await presence_registry.ensure_heartbeat()
+        
         # Send connection acknowledgment
         await self.send(text_data=json.dumps({
             'type': 'connection_established',
@@ -128,19 +146,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'recipient_info': self.other_user_info  # Include full recipient info
         }))
         
-        # Send presence status to room
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_online',
-                'user_id': self.user_id,
-                'status': 'online',
-                'timestamp': datetime.utcnow().isoformat()
-            }
-        )
+        # Send presence status to room (batched with the room's other presence changes)
+        presence_batcher.publish(self.channel_layer, self.room_group_name, self.user_id, 'online')
         
-        # Load message history
-        await self.send_message_history()
+        # Reconnecting clients pass the last sequence they hold and only get what they missed
+        query_params = parse_qs(self.scope.get('query_string', b'').decode())
+        last_sequence = query_params.get('last_sequence', [None])[0]
+        if last_sequence is not None:
+            await self.handle_sync({
+                'last_sequence': last_sequence,
+                'since': query_params.get('since', [None])[0]
+            })
+        else:
+            await self.send_message_history()
         
         # Check if other user is online
         other_user_status = await self.get_user_status(self.other_user_id)
@@ -161,16 +179,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 print(f"Disconnect called before room_group_name was set, code: {close_code}")
                 return
                 
-            # Send offline status to room
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_offline',
-                    'user_id': getattr(self, 'user_id', 'unknown'),
-                    'status': 'offline',
-                    'timestamp': datetime.utcnow().isoformat()
-                }
-            )
+            # Write receipts still waiting for their window
+            await self.read_receipts.close()
+            
+            # Send offline status to room, unless the user is still connected elsewhere
+            went_offline = await self.unregister_presence()
+            if self.room_group_name:
+                await self.typing.stop()
+                if went_offline:
+                    presence_batcher.publish(self.channel_layer, self.room_group_name, self.user_id, 'offline')
             
             # Leave room group - with safety checks
             if hasattr(self, 'room_group_name') and self.room_group_name:
@@ -186,10 +203,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     self.channel_name
                 )
             
-            # Update last seen timestamp
-            if hasattr(self, 'user_id') and self.user_id:
-                await self.update_last_seen(self.user_id)
-            
             logger.info(f"Chat WebSocket disconnected: user={getattr(self, 'user_id', 'unknown')}, code={close_code}")
         except Exception as e:
             logger.error(f"Error during WebSocket disconnect: {str(e)}")
@@ -230,45 +243,41 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 if self.session_id:
                     message_data["session_id"] = self.session_id
                 
+                # Sending the message ends the sender's typing state
+                await self.typing.stop()
+                
+                # Echoed in acknowledgements so the client can match them to its pending sends
+                client_message_id = data.get('client_message_id')
+                
+                if CHAT_WRITE_BEHIND:
+                    # Fan out first; the process chat writer stores the message in its next batch
+                    message, persisted = await self.queue_message(message_data)
+                    await self.broadcast_chat_message(message)
+                    await self.send_message_ack(ACK_DELIVERED, message, client_message_id)
+                    asyncio.ensure_future(self.ack_when_persisted(message, persisted, client_message_id))
+                    return
+                
                 # Save to database
                 message_id = await self.save_message(message_data)
                 
                 if message_id:
+                    await self.publish_cache_invalidation()
+                    
                     # Retrieve the saved message to get any additional data
                     saved_message = await self.get_message_by_id(message_id)
-                    server_timestamp = saved_message.get("sent_at").isoformat() if saved_message else datetime.utcnow().isoformat()
-                    
-                    # Broadcast to room - IMPORTANT: use same sender_id consistently
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'chat_message',
-                            'message': message_content,
-                            'sender_id': sender_id,  # Use the authenticated user's ID
-                            'message_id': str(message_id),
-                            'conversation_id': str(self.conversation_id),
-                            'timestamp': server_timestamp,
-                            'message_type': data.get('message_type', 'text'),
-                            'metadata': data.get('metadata', {}),
-                            'sequence': saved_message.get("sequence", 0) if saved_message else 0
-                        }
-                    )
+                    await self.broadcast_chat_message(saved_message)
+                    await self.send_message_ack(ACK_PERSISTED, saved_message, client_message_id)
+                else:
+                    await self.send_message_ack(ACK_FAILED, None, client_message_id)
+            
+            elif message_type == 'sync':
+                await self.handle_sync(data)
+            
+            elif message_type == 'load_older':
+                await self.handle_load_older(data)
             
             elif message_type == 'mark_read':
-                # Add mark read handler for unread messages
-                message_ids = data.get('message_ids', [])
-                if message_ids:
-                    await self.mark_messages_read(message_ids)
-                    
-                    # Notify other clients about read status
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'read_receipt',
-                            'message_ids': message_ids,
-                            'reader_id': self.user_id
-                        }
-                    )
+                await self.handle_read_receipt(data)
             
             
         except Exception as e:
@@ -329,6 +338,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # Save to database
             message_id = await self.save_message(message)
             message["_id"] = message_id
+            await self.publish_cache_invalidation()
             
             # Broadcast to group
             await self.channel_layer.group_send(
@@ -352,10 +362,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
             traceback.print_exc()
     
     async def handle_typing_indicator(self, data):
-        """Handle typing indicator events"""
-        is_typing = data.get('is_typing', True)
-        
-        # Broadcast typing status to the room
+        """Handle typing indicator events; only start/stop transitions reach the room"""
+        await self.typing.update(bool(data.get('is_typing', True)))
+    
+    async def publish_typing(self, is_typing):
+        """Broadcast typing status to the room"""
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -367,21 +378,27 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
     
     async def handle_read_receipt(self, data):
-        """Handle read receipt events"""
+        """Handle read receipt events: "read up to sequence N" and/or ids of unsequenced messages"""
+        up_to_sequence = data.get('up_to_sequence')
         message_ids = data.get('message_ids', [])
         
-        if not message_ids:
+        if not up_to_sequence and not message_ids:
             return
             
-        # Update read status in database
-        await self.mark_messages_read(message_ids)
+        # Coalesced with receipts arriving shortly after; written and broadcast once
+        self.read_receipts.add(up_to_sequence, message_ids)
+    
+    async def write_read_receipt(self, up_to_sequence, message_ids):
+        """Persist one coalesced receipt and tell the room"""
+        await self.mark_messages_read(message_ids, up_to_sequence)
+        await self.publish_cache_invalidation()
         
-        # Send read receipt to room group
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'read_receipt',
                 'reader_id': self.user_id,
+                'up_to_sequence': up_to_sequence,
                 'message_ids': message_ids,
                 'timestamp': datetime.utcnow().isoformat()
             }
@@ -404,6 +421,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': "Cannot add reaction: message not found"
             }))
             return
+        
+        await self.publish_cache_invalidation()
             
         # Send reaction to room group
         await self.channel_layer.group_send(
@@ -434,6 +453,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': "Cannot edit message: not found or not authorized"
             }))
             return
+        
+        await self.publish_cache_invalidation()
             
         # Send edit notification to room group
         await self.channel_layer.group_send(
@@ -463,6 +484,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': "Cannot delete message: not found or not authorized"
             }))
             return
+        
+        await self.publish_cache_invalidation()
             
         # Send delete notification to room group
         await self.channel_layer.group_send(
@@ -475,34 +498,73 @@ class ChatConsumer(AsyncWebsocketConsumer):
             }
         )
     
-    async def send_message_history(self, limit=50):
-        """Load and send message history"""
-        history = await self.get_message_history(limit)
+    async def broadcast_chat_message(self, message):
+        """Send a stored or queued message document to everyone in the room"""
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_message',
+                'message': message['content'],
+                'sender_id': message['sender_id'],  # Use the authenticated user's ID
+                'message_id': str(message['_id']),
+                'conversation_id': str(self.conversation_id),
+                'timestamp': message['sent_at'].isoformat(),
+                'message_type': message.get('message_type', 'text'),
+                'metadata': message.get('metadata', {}),
+                'sequence': message.get('sequence', 0)
+            }
+        )
+    
+    async def send_message_ack(self, status, message=None, client_message_id=None):
+        """
+        Tell the sender what happened to its message: "delivered" (broadcast,
+        not yet stored), "persisted" (stored) or "failed" (resend)
+        """
+        await self.send(text_data=json.dumps({
+            'type': 'message_ack',
+            'status': status,
+            'client_message_id': client_message_id,
+            'message_id': str(message['_id']) if message else None,
+            'sequence': message.get('sequence') if message else None,
+            'timestamp': datetime.utcnow().isoformat()
+        }))
+    
+    async def ack_when_persisted(self, message, persisted, client_message_id):
+        """Second acknowledgement of a write-behind message, once the writer has stored it or given up"""
+        try:
+            stored = await asyncio.wrap_future(persisted)
+            if stored:
+                # Only now can other workers reload the conversation with this message in it
+                await self.publish_cache_invalidation()
+            else:
+                message_cache.invalidate(self.conversation_id)
+            await self.send_message_ack(ACK_PERSISTED if stored else ACK_FAILED, message, client_message_id)
+        except Exception as e:
+            # The socket may have closed in the meantime; the message is stored regardless
+            logger.info(f"Could not send persistence ack for {message['_id']}: {str(e)}")
+    
+    async def publish_cache_invalidation(self):
+        """Let other workers drop their cached copy of this conversation"""
+        await message_cache.publish(self.channel_layer, self.conversation_id)
+    
+    async def send_message_history(self, limit=50, before_sequence=None):
+        """Load and send message history (the latest page, or the page before a sequence)"""
+        history = await self.get_message_history(limit, before_sequence)
         
-        if history:
+        if history or before_sequence is not None:
             await self.send(text_data=json.dumps({
                 'type': 'message_history',
                 'messages': history,
-                'conversation_id': str(self.conversation_id)
+                'conversation_id': str(self.conversation_id),
+                'before_sequence': history[0]['sequence'] if history else None,
+                'has_more': bool(history) and len(history) == limit
             }))
             
-            # Mark messages as read
-            message_ids = [msg['id'] for msg in history 
-                           if msg['sender_id'] != self.user_id and not msg['read']]
-            
-            if message_ids:
-                await self.mark_messages_read(message_ids)
-                
-                # Send read receipt to other users
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'read_receipt',
-                        'reader_id': self.user_id,
-                        'message_ids': message_ids,
-                        'timestamp': datetime.utcnow().isoformat()
-                    }
-                )
+        # Opening the conversation reads everything up to the newest message
+        if history and before_sequence is None:
+            has_unread = any(msg['sender_id'] != self.user_id and not msg['read'] for msg in history)
+            if has_unread:
+                self.read_receipts.add(up_to_sequence=history[-1]['sequence'])
     
     async def handle_system_message(self, data):
         """Handle system-generated messages (help bot, notifications)"""
@@ -598,7 +660,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Send read receipt to WebSocket clients"""
         await self.send(text_data=json.dumps({
             'type': 'read_receipt',
-            'message_ids': event['message_ids'],
+            'message_ids': event.get('message_ids', []),
+            'up_to_sequence': event.get('up_to_sequence'),
             'reader_id': event['reader_id'],
             'timestamp': datetime.utcnow().isoformat()
         }))
@@ -632,6 +695,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'timestamp': event['timestamp']
         }))
     
+    async def presence_update(self, event):
+        """Send a room's batched presence changes to WebSocket, one user_status each"""
+        for user_id, status in event['statuses'].items():
+            await self.send(text_data=json.dumps({
+                'type': 'user_status',
+                'user_id': user_id,
+                'status': status,
+                'timestamp': event['timestamp']
+            }))
+    
     async def user_online(self, event):
         """Send user online status to WebSocket"""
         await self.send(text_data=json.dumps({
@@ -656,166 +729,223 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     @database_sync_to_async
     def get_or_create_conversation(self):
-        """Get or create conversation between users"""
+        """
+        Get or create conversation between users (one upsert); the id is kept
+        for the whole connection so messages never resolve it again
+        """
         participants = [self.user_id, self.other_user_id]
-        conversation_id = Conversation.get_or_create(
+        conversation = Conversation.resolve(
             participants=participants,
             conversation_type=self.conversation_type,
-            session_id=self.session_id
+            session_id=self.session_id,
+            projection={"participants": 1}
         )
         
-        # Log the conversation details for debugging
-        conversation = Conversation.find_by_id(conversation_id)
-        print(f"Using conversation: {conversation_id}, type: {conversation.get('conversation_type')}, session: {conversation.get('session_id')}")
+        print(f"Using conversation: {conversation['_id']}, type: {self.conversation_type}, session: {self.session_id}")
         
-        return conversation_id
+        # Write-behind saves build the unread counter updates from these
+        self.conversation_participants = conversation.get("participants", participants)
+        
+        return str(conversation["_id"])
     
     # Update the save_message method to ensure consistent UTC timestamps
 
+    def build_message(self, content=None, message_type='text', metadata=None, **kwargs):
+        """Message document with its id and sequence allocated"""
+        # Support both direct parameters and message_data dictionary
+        if isinstance(content, dict):
+            # This is a message_data object
+            message_data = content
+            content = message_data.get("content")
+            message_type = message_data.get("message_type", 'text')
+            metadata = message_data.get("metadata")
+            sender_id = message_data.get("sender_id", self.user_id)
+            conversation_id = message_data.get("conversation_id", self.conversation_id)
+            session_id = message_data.get("session_id")
+        else:
+            # Using direct parameters
+            sender_id = kwargs.get("sender_id", self.user_id)
+            conversation_id = kwargs.get("conversation_id", self.conversation_id)
+            session_id = kwargs.get("session_id")
+        
+        # Get current UTC time - this ensures all messages use the same time reference
+        timestamp = datetime.utcnow()
+        
+        # Convert conversation_id to ObjectId if it's a string
+        if isinstance(conversation_id, str):
+            conversation_id = ObjectId(conversation_id)
+        
+        # Create new message with proper fields
+        message = {
+            "_id": ObjectId(),
+            "conversation_id": conversation_id,
+            "sender_id": sender_id,
+            "content": content,
+            "message_type": message_type,
+            "metadata": metadata or {},
+            "sent_at": timestamp,  # Always UTC
+            "read": False,
+            "read_at": None,
+            "sequence": allocate_sequence(conversation_id)  # Reserved atomically
+        }
+        
+        # Add session_id if provided
+        if session_id:
+            message["session_id"] = session_id
+        
+        return message
+    
+    @staticmethod
+    def last_message_data(message):
+        """Conversation last_message entry for a message document"""
+        return {
+            "content": message["content"],
+            "sender_id": message["sender_id"],
+            "sent_at": message["sent_at"],  # Always UTC
+            "message_type": message["message_type"],
+            "sequence": message["sequence"]
+        }
+
     @database_sync_to_async
     def save_message(self, content=None, message_type='text', metadata=None, **kwargs):
         """Save message and update conversation's last_message"""
         try:
-            # Support both direct parameters and message_data dictionary
-            if isinstance(content, dict):
-                # This is a message_data object
-                message_data = content
-                content = message_data.get("content")
-                message_type = message_data.get("message_type", 'text')
-                metadata = message_data.get("metadata")
-                sender_id = message_data.get("sender_id", self.user_id)
-                conversation_id = message_data.get("conversation_id", self.conversation_id)
-                session_id = message_data.get("session_id")
-            else:
-                # Using direct parameters
-                sender_id = kwargs.get("sender_id", self.user_id)
-                conversation_id = kwargs.get("conversation_id", self.conversation_id)
-                session_id = kwargs.get("session_id")
-            
-            # Get current UTC time - this ensures all messages use the same time reference
-            timestamp = datetime.utcnow()
-            
-            # Convert conversation_id to ObjectId if it's a string
-            if isinstance(conversation_id, str):
-                conversation_id = ObjectId(conversation_id)
-            
-            # Get the next sequence number (synchronously)
-            sequence_number = self.get_next_sequence_number_sync(conversation_id)
-            
-            # Create new message with proper fields
-            message = {
-                "_id": ObjectId(),
-                "conversation_id": conversation_id,
-                "sender_id": sender_id,
-                "content": content,
-                "message_type": message_type,
-                "metadata": metadata or {},
-                "sent_at": timestamp,  # Always UTC
-                "read": False,
-                "read_at": None,
-                "sequence": sequence_number  # Add sequence number
-            }
-            
-            # Add session_id if provided
-            if session_id:
-                message["session_id"] = session_id
+            message = self.build_message(content, message_type, metadata, **kwargs)
                 
             # Insert message
             message_id = db.messages.insert_one(message).inserted_id
+            message_cache.add(message)
             
-            # Update conversation's last_message
-            last_message = {
-                "content": content,
-                "sender_id": sender_id,
-                "sent_at": timestamp,  # Always UTC
-                "message_type": message_type
-            }
-            
-            # Make sure we use ObjectId for conversation update
-            db.conversations.update_one(
-                {"_id": conversation_id},
-                {
-                    "$set": {
-                        "last_message": last_message,
-                        "updated_at": timestamp  # Always UTC
-                    }
-                }
-            )
+            # Update conversation's last_message and the other participants' unread counters
+            Conversation.record_message(message["conversation_id"], message["sender_id"],
+                                        self.last_message_data(message))
             
-            print(f"Saved message {message_id} to conversation {conversation_id}")
+            print(f"Saved message {message_id} to conversation {message['conversation_id']}")
             return str(message_id)
         except Exception as e:
             print(f"Error saving message: {str(e)}")
+    
     @database_sync_to_async
-    def get_next_sequence_number(self, conversation_id):
-        """Get the next sequence number for a message in this conversation (async version)"""
-        # Find the highest sequence number so far
-        last_message = db.messages.find_one(
-            {"conversation_id": conversation_id},
-            sort=[("sequence", -1)]
-        )
+    def queue_message(self, content=None, message_type='text', metadata=None, **kwargs):
+        """
+        Write-behind save: the message gets its id and sequence now and is
+        stored by the process chat writer. Returns the message document and a
+        Future resolving to True once it is in MongoDB (False if dropped).
+        """
+        message = self.build_message(content, message_type, metadata, **kwargs)
+        message_cache.add(message)
         
-        # Start from 1 or increment from last
-        if last_message and "sequence" in last_message:
-            return last_message["sequence"] + 1
-        return 1
+        operations = Conversation.message_operations(
+            message["conversation_id"], self.conversation_participants, message["sender_id"],
+            self.last_message_data(message)
+        )
+        return message, chat_persistence.queue(message, operations)
+    
+    @database_sync_to_async
+    def get_next_sequence_number(self, conversation_id):
+        """Allocate the next sequence number for a message in this conversation (async version)"""
+        return allocate_sequence(conversation_id)
         
     def get_next_sequence_number_sync(self, conversation_id):
-        """Get the next sequence number for a message in this conversation (synchronous version)"""
-        # Find the highest sequence number so far
-        last_message = db.messages.find_one(
-            {"conversation_id": conversation_id},
-            sort=[("sequence", -1)]
-        )
+        """Allocate the next sequence number for a message in this conversation (synchronous version)"""
+        return allocate_sequence(conversation_id)
+    
+    async def handle_sync(self, data):
+        """
+        Incremental sync: the client sends the highest sequence it holds (and
+        the sync_time of its previous sync, if any); it receives newer
+        messages plus edits, deletions and reactions to messages it already has
+        """
+        try:
+            last_sequence = int(data.get('last_sequence') or 0)
+            since = datetime.fromisoformat(data['since']) if data.get('since') else None
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': "Invalid sync position"
+            }))
+            return
         
-        # Start from 1 or increment from last
-        if last_message and "sequence" in last_message:
-            return last_message["sequence"] + 1
-        return 1
-        if last_message and "sequence" in last_message:
-            return last_message["sequence"] + 1
-        return 1
+        result = await self.sync_messages(last_sequence, since)
+        await self.send(text_data=json.dumps({
+            'type': 'sync',
+            'conversation_id': str(self.conversation_id),
+            **result
+        }))
     
-    @database_sync_to_async
-    def get_message_history(self, limit=50):
-        """Get conversation history from database"""
-        messages = Message.get_messages_by_conversation(self.conversation_id, limit)
+    async def handle_load_older(self, data):
+        """Scroll-back: the page of history before the oldest sequence the client holds"""
+        try:
+            before_sequence = int(data['before_sequence'])
+            limit = min(max(int(data.get('limit') or 50), 1), MAX_SYNC_BATCH)
+        except (KeyError, TypeError, ValueError):
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': "Invalid history position"
+            }))
+            return
         
-        # Convert to serializable format
-        history = []
-        for msg in messages:
-            history.append({
-                'id': str(msg.get('_id', '')),
-                'sender_id': msg.get('sender_id', ''),
-                'conversation_id': str(msg.get('conversation_id', '')),
-                'content': msg.get('content', ''),
-                'message_type': msg.get('message_type', 'text'),
-                'timestamp': msg.get('sent_at').isoformat() if msg.get('sent_at') else '',
-                'read': msg.get('read', False),
-                'edited': msg.get('edited', False),
-                'reactions': msg.get('reactions', []),
-                'attachment_url': msg.get('attachment_url'),
-                'is_deleted': msg.get('is_deleted', False),
-                'session_id': msg.get('session_id')
-            })
-            
-        return history
+        await self.send_message_history(limit=limit, before_sequence=before_sequence)
+    
+    @staticmethod
+    def serialize_message(msg):
+        """Message document to its websocket representation"""
+        return {
+            'id': str(msg.get('_id', '')),
+            'sender_id': msg.get('sender_id', ''),
+            'conversation_id': str(msg.get('conversation_id', '')),
+            'sequence': msg.get('sequence'),
+            'content': msg.get('content', ''),
+            'message_type': msg.get('message_type', 'text'),
+            'timestamp': msg.get('sent_at').isoformat() if msg.get('sent_at') else '',
+            'read': msg.get('read', False),
+            'edited': msg.get('edited', False),
+            'reactions': [
+                dict(reaction, created_at=reaction['created_at'].isoformat())
+                if isinstance(reaction.get('created_at'), datetime) else reaction
+                for reaction in msg.get('reactions', [])
+            ],
+            'attachment_url': msg.get('attachment_url'),
+            'is_deleted': msg.get('is_deleted', False),
+            'session_id': str(msg['session_id']) if msg.get('session_id') else None
+        }
+    
+    @database_sync_to_async
+    def get_message_history(self, limit=50, before_sequence=None):
+        """Get a page of conversation history, oldest first, from the cache when it covers it"""
+        messages = message_cache.page(self.conversation_id, before_sequence, limit)
+        if messages is None:
+            if before_sequence is None:
+                # Load the whole window so later connects and pages are served from memory
+                fetch = max(limit, CHAT_CACHE_MESSAGES)
+                messages = Message.get_messages_before(self.conversation_id, None, fetch)
+                message_cache.load(self.conversation_id, messages, complete=len(messages) < fetch)
+                messages = messages[-limit:]
+            else:
+                messages = Message.get_messages_before(self.conversation_id, before_sequence, limit)
+        return [self.serialize_message(msg) for msg in messages]
     
     @database_sync_to_async
-    def mark_messages_read(self, message_ids):
-        """Mark multiple messages as read"""
+    def sync_messages(self, last_sequence, since=None):
+        """Messages and changes the client is missing, in serializable form"""
+        result = Message.sync(self.conversation_id, last_sequence, since)
+        return {
+            'messages': [self.serialize_message(msg) for msg in result['messages']],
+            'changes': [self.serialize_message(msg) for msg in result['changes']],
+            'last_sequence': result['last_sequence'],
+            'has_more': result['has_more'],
+            'sync_time': result['sync_time'].isoformat()
+        }
+    
+    @database_sync_to_async
+    def mark_messages_read(self, message_ids, up_to_sequence=None):
+        """Mark messages as read: one update for the watermark, one for explicit ids"""
         try:
-            for msg_id in message_ids:
-                if isinstance(msg_id, str):
-                    msg_id = ObjectId(msg_id)
-                    
-                db.messages.update_one(
-                    {"_id": msg_id},
-                    {"$set": {
-                        "read": True,
-                        "read_at": datetime.utcnow()
-                    }}
-                )
+            if up_to_sequence:
+                Message.mark_read_up_to(self.conversation_id, self.user_id, up_to_sequence)
+            if message_ids:
+                Message.mark_as_read(message_ids, self.user_id)
+            message_cache.mark_read(self.conversation_id, self.user_id, up_to_sequence, message_ids)
             return True
         except Exception as e:
             print(f"Error marking messages as read: {str(e)}")
@@ -824,17 +954,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def save_reaction(self, message_id, user_id, reaction):
         """Save reaction to message"""
-        return Message.add_reaction(message_id, user_id, reaction)
+        success = Message.add_reaction(message_id, user_id, reaction)
+        if success:
+            now = datetime.utcnow()
+            def react(message):
+                message["reactions"] = [r for r in message.get("reactions", []) if r.get("user_id") != user_id]
+                message["reactions"].append({"user_id": user_id, "reaction": reaction, "created_at": now})
+                message["updated_at"] = now
+            message_cache.update(message_id, react)
+        return success
     
     @database_sync_to_async
     def update_message(self, message_id, sender_id, new_content):
         """Update message content"""
-        return Message.update_content(message_id, sender_id, new_content)
+        success = Message.update_content(message_id, sender_id, new_content)
+        if success:
+            now = datetime.utcnow()
+            message_cache.update(message_id, lambda message: message.update(
+                content=new_content, edited=True, edited_at=now, updated_at=now))
+        return success
     
     @database_sync_to_async
     def delete_message(self, message_id, sender_id):
         """Delete a message"""
-        return Message.soft_delete(message_id, sender_id)
+        success = Message.soft_delete(message_id, sender_id)
+        if success:
+            now = datetime.utcnow()
+            message_cache.update(message_id, lambda message: message.update(
+                is_deleted=True, deleted_at=now, updated_at=now, content="[This message was deleted]"))
+        return success
     
     @database_sync_to_async
     def get_user_info(self, user_id):
@@ -852,21 +1000,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }
     
     @database_sync_to_async
-    def update_last_seen(self, user_id):
-        """Update user's last seen timestamp"""
-        return User.update_last_seen(user_id)
+    def register_presence(self):
+        """Register this connection in the presence registry"""
+        presence_registry.connect(self.user_id, self.channel_name)
+        self.presence_registered = True
+    
+    @database_sync_to_async
+    def unregister_presence(self):
+        """
+        Remove this connection from the presence registry; True if it was the
+        user's last (last_seen is then recorded by the registry, in batches)
+        """
+        if not self.presence_registered:
+            return False
+        self.presence_registered = False
+        return presence_registry.disconnect(self.user_id, self.channel_name)
     
     @database_sync_to_async
     def get_user_status(self, user_id):
-        """Check if user is online based on presence channels"""
-        # This is a simple implementation - you might want to use Redis presence for production
-        from channels.layers import get_channel_layer
-        channel_layer = get_channel_layer()
-        
-        # Check if user has any active connections
-        # In a real implementation, you'd query an active connections list in Redis
-        # For now, we'll just return 'offline' as a placeholder
-        return 'offline'
+        """Check if user is online: any live connection in the presence registry"""
+        return presence_registry.get_status([user_id]).get(str(user_id), 'offline')
     
     @database_sync_to_async
     def get_therapist_by_user_id(self, user_id):
@@ -878,6 +1031,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def get_message_by_id(self, message_id):
         """Get a specific message by ID"""
         try:
+            cached = message_cache.get(message_id)
+            if cached is not None:
+                return cached
+            
             if isinstance(message_id, str):
                 message_id = ObjectId(message_id)
             
@@ -1018,8 +1175,11 @@ class HelpChatConsumer(AsyncWebsocketConsumer):
         if data.get('persist', True):
             # Create a help conversation if needed
             try:
-                # Check if the user has a help conversation
-                conversation_id = await database_sync_to_async(self.get_or_create_help_conversation)(self.user_id)
+                # Resolved once per connection
+                if not getattr(self, 'help_conversation_id', None):
+                    self.help_conversation_id = await database_sync_to_async(
+                        self.get_or_create_help_conversation)(self.user_id)
+                conversation_id = self.help_conversation_id
                 
                 # Save user's question
                 await database_sync_to_async(self.save_help_message)(
@@ -1047,26 +1207,13 @@ class HelpChatConsumer(AsyncWebsocketConsumer):
     @staticmethod
     def get_or_create_help_conversation(user_id):
         """Get or create a help conversation for this user"""
-        from apps.chat_messages.models import Conversation, ConversationType
+        from apps.chat_messages.models import Conversation
         
-        # Look for existing help conversation
-        existing = Conversation.find_one({
-            "participants": [user_id, "system"],
-            "conversation_type": "help",
-            "is_active": True
-        })
-        
-        if existing:
-            return str(existing["_id"])
-        
-        # Create a new conversation
-        conversation = Conversation(
+        return Conversation.get_or_create(
             participants=[user_id, "system"],
             conversation_type="help",
             metadata={"source": "help_assistant"}
         )
-        
-        return conversation.save()
     
     @staticmethod
     def save_help_message(conversation_id, sender_id, content, message_type='text', metadata=None):
@@ -0,0 +1,108 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# A typing user who sends no keystroke event for this long is broadcast as stopped
+TYPING_EXPIRY_SECONDS = float(os.environ.get("TYPING_EXPIRY_SECONDS", 5))
+
+# An explicit "stopped typing" is held this long, so pausing between words broadcasts nothing
+TYPING_STOP_DEBOUNCE_SECONDS = float(os.environ.get("TYPING_STOP_DEBOUNCE_SECONDS", 1))
+
+# Presence changes of a room within this window go out as one event
+PRESENCE_WINDOW_SECONDS = float(os.environ.get("PRESENCE_WINDOW_SECONDS", 1))
+
+
+class TypingState:
+    """
+    Typing state of one websocket connection.
+
+    Clients emit an event per keystroke; only transitions are published:
+    `publish(is_typing)` is awaited once when typing starts and once when it
+    stops, either explicitly (after a short debounce) or because no keystroke
+    arrived within the expiry.
+    """
+
+    def __init__(self, publish, expiry=TYPING_EXPIRY_SECONDS, debounce=TYPING_STOP_DEBOUNCE_SECONDS):
+        self._publish = publish
+        self.expiry = expiry
+        self.debounce = debounce
+        self.is_typing = False
+        self._timer = None
+
+    async def update(self, is_typing):
+        if is_typing:
+            self._schedule_stop(self.expiry)
+            if not self.is_typing:
+                self.is_typing = True
+                await self._publish(True)
+        elif self.is_typing:
+            self._schedule_stop(self.debounce)
+
+    async def stop(self):
+        """ Publish "stopped" now if typing, e.g. when the message is sent or the connection closes """
+        self._cancel()
+        if self.is_typing:
+            self.is_typing = False
+            await self._publish(False)
+
+    def _schedule_stop(self, delay):
+        self._cancel()
+        self._timer = asyncio.ensure_future(self._stop_later(delay))
+
+    async def _stop_later(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None  # Past the delay: stop() must not cancel a publish in progress
+        try:
+            await self.stop()
+        except Exception as e:
+            logger.warning(f"Error publishing typing state: {str(e)}")
+
+    def _cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class PresenceBatcher:
+    """
+    Per-process coalescing of the online/offline broadcasts of chat rooms.
+
+    Changes published for a room within the window are sent as a single
+    "presence_update" group event carrying the latest status of each user,
+    so a quick reconnect is one event rather than an offline/online pair.
+    """
+
+    def __init__(self, window=PRESENCE_WINDOW_SECONDS):
+        self.window = window
+        self._pending = {}   # room group -> {user_id: latest status}
+        self._tasks = {}     # room group -> flush task
+
+    def publish(self, channel_layer, room_group, user_id, status):
+        self._pending.setdefault(room_group, {})[user_id] = status
+        if room_group not in self._tasks:
+            self._tasks[room_group] = asyncio.ensure_future(self._flush_later(channel_layer, room_group))
+
+    async def _flush_later(self, channel_layer, room_group):
+        await asyncio.sleep(self.window)
+        self._tasks.pop(room_group, None)
+        try:
+            await self.flush(channel_layer, room_group)
+        except Exception as e:
+            logger.warning(f"Error broadcasting presence for {room_group}: {str(e)}")
+
+    async def flush(self, channel_layer, room_group):
+        statuses = self._pending.pop(room_group, None)
+        if not statuses:
+            return
+
+        await channel_layer.group_send(room_group, {
+            "type": "presence_update",
+            "statuses": statuses,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+
+presence_batcher = PresenceBatcher()
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from apps.chat_messages.models import (
+    conversations_collection, messages_collection, conversation_key, conversation_sequence_key
+)
+
+
+class Command(BaseCommand):
+    help = ('Sets the canonical conversation_key on conversations created before get_or_create '
+            'upserted on it, then creates its unique index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Conversations updated per bulk write')
+        parser.add_argument('--delete-empty-duplicates', action='store_true',
+                            help='Delete duplicate conversations that hold no messages')
+
+    def handle(self, *args, **options):
+        # Conversations that hold messages win their key over empty ones
+        with_messages = set()
+        for row in messages_collection.aggregate([{'$group': {'_id': '$conversation_id'}}], allowDiskUse=True):
+            with_messages.add(conversation_sequence_key(row['_id']))
+
+        # Every conversation grouped by its canonical identity, keyed or not
+        groups = {}
+        for conversation in conversations_collection.find(
+                {}, {'participants': 1, 'conversation_type': 1, 'session_id': 1,
+                     'created_at': 1, 'conversation_key': 1}):
+            key = conversation_key(conversation.get('participants', []),
+                                   conversation.get('conversation_type'), conversation.get('session_id'))
+            groups.setdefault(key, []).append(conversation)
+
+        releases, assignments, empty_duplicates = [], [], []
+        duplicates = 0
+        for key, conversations in groups.items():
+            # The conversation with messages, oldest first, keeps the identity. A duplicate created
+            # after deploy (keyed, empty) gives the key back to the legacy conversation it shadows
+            conversations.sort(key=lambda conv: (conv['_id'] not in with_messages,
+                                                 conv.get('created_at') or datetime.min, conv['_id']))
+            owner, others = conversations[0], conversations[1:]
+            duplicates += len(others)
+
+            for conversation in others:
+                if conversation.get('conversation_key') is not None:
+                    releases.append(UpdateOne({'_id': conversation['_id']}, {'$unset': {'conversation_key': ''}}))
+                if conversation['_id'] not in with_messages:
+                    empty_duplicates.append(conversation['_id'])
+            if owner.get('conversation_key') != key:
+                assignments.append(UpdateOne({'_id': owner['_id']}, {'$set': {'conversation_key': key}}))
+
+        # Keys are released before they are reassigned, or the unique index would reject the move
+        for operations in (releases, assignments):
+            for start in range(0, len(operations), options['batch_size']):
+                conversations_collection.bulk_write(operations[start:start + options['batch_size']], ordered=False)
+
+        deleted = 0
+        if options['delete_empty_duplicates'] and empty_duplicates:
+            deleted = conversations_collection.delete_many({'_id': {'$in': empty_duplicates}}).deleted_count
+
+        conversations_collection.create_index(
+            'conversation_key',
+            unique=True,
+            partialFilterExpression={'conversation_key': {'$exists': True}},
+            name='conversation_key_unique'
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Keyed {len(assignments)} conversations ({len(releases)} keys moved from empty duplicates); '
+            f'{duplicates} duplicates left unkeyed, {len(empty_duplicates)} of them empty, {deleted} deleted'))
@@ -0,0 +1,108 @@
+import time
+import statistics
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat_messages.models import Conversation, conversations_collection
+from apps.chat_messages.views import get_participant_details, participant_card
+from apps.users.models import users_collection
+
+
+def legacy_conversation_cards(participant_ids, limit=20, skip=0):
+    """ The conversation list as get_conversations built it before the aggregation """
+    conversations = []
+    for participant_id in participant_ids:
+        conversations.extend(Conversation.find_by_participant(participant_id=participant_id, limit=limit, skip=skip))
+
+    unique_conversations = {}
+    for conv in conversations:
+        unique_conversations.setdefault(str(conv.get("_id")), conv)
+    conversations = sorted(unique_conversations.values(),
+                           key=lambda conv: conv.get("updated_at", datetime.min), reverse=True)[:limit]
+
+    for conv in conversations:
+        other_user_id = next((p for p in conv.get("participants", []) if p not in participant_ids), None)
+        if other_user_id:
+            conv["recipient"] = get_participant_details(other_user_id)
+    return conversations
+
+
+def aggregated_conversation_cards(participant_ids, limit=20, skip=0):
+    conversations = Conversation.list_cards(participant_ids, limit=limit, skip=skip)
+    for conv in conversations:
+        if conv.get("other_participant_id"):
+            conv["recipient"] = participant_card(conv["other_participant_id"], conv.pop("other_user", None))
+    return conversations
+
+
+class Command(BaseCommand):
+    help = ('Times the conversation list (legacy per-participant queries vs. the single aggregation) '
+            'on temporary seeded conversations, which are removed afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=500,
+                            help='Conversations seeded for the benchmark user')
+        parser.add_argument('--limit', type=int, default=20, help='Page size requested')
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per implementation')
+
+    def handle(self, *args, **options):
+        if options['conversations'] < 1 or options['runs'] < 1:
+            raise CommandError('--conversations and --runs must be at least 1')
+
+        user_id, therapist_id = str(ObjectId()), str(ObjectId())
+        participant_ids = [user_id, therapist_id]
+        user_ids, conversation_ids = self._seed(user_id, therapist_id, options['conversations'])
+
+        try:
+            results = {}
+            for name, implementation in (('legacy', legacy_conversation_cards),
+                                         ('aggregation', aggregated_conversation_cards)):
+                implementation(participant_ids, options['limit'])  # Warm up
+                timings = []
+                for _ in range(options['runs']):
+                    started = time.perf_counter()
+                    implementation(participant_ids, options['limit'])
+                    timings.append((time.perf_counter() - started) * 1000)
+                results[name] = timings
+
+            for name, timings in results.items():
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                self.stdout.write(f'{name:12} median {statistics.median(timings):8.2f} ms   '
+                                  f'p95 {p95:8.2f} ms')
+
+            speedup = statistics.median(results['legacy']) / max(statistics.median(results['aggregation']), 1e-9)
+            self.stdout.write(self.style.SUCCESS(
+                f'Aggregation is {speedup:.1f}x the legacy speed over {options["conversations"]} conversations'))
+        finally:
+            conversations_collection.delete_many({'_id': {'$in': conversation_ids}})
+            users_collection.delete_many({'_id': {'$in': user_ids}})
+
+    def _seed(self, user_id, therapist_id, count):
+        """ Benchmark user with `count` conversations, half addressed by their therapist id """
+        now = datetime.utcnow()
+        users = [{
+            '_id': ObjectId(),
+            'username': f'benchmark user {n}',
+            'first_name': '' if n % 3 else f'Client{n}',
+            'last_name': '' if n % 3 else 'Benchmark',
+            'role': 'user',
+            'status': 'offline'
+        } for n in range(count)]
+        users_collection.insert_many(users)
+
+        conversations = [{
+            '_id': ObjectId(),
+            'participants': sorted([user_id if n % 2 else therapist_id, str(user['_id'])]),
+            'conversation_type': 'therapy_session',
+            'created_at': now - timedelta(minutes=n),
+            'updated_at': now - timedelta(minutes=n),
+            'last_message': {'content': f'message {n}', 'sender_id': str(user['_id']), 'sent_at': now},
+            'unread_counts': {},
+            'metadata': {'benchmark': True}
+        } for n, user in enumerate(users)]
+        conversations_collection.insert_many(conversations)
+
+        return [user['_id'] for user in users], [conv['_id'] for conv in conversations]
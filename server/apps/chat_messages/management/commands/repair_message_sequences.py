@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from apps.chat_messages.models import (
+    messages_collection, sequence_counters_collection, conversation_sequence_key
+)
+
+
+class Command(BaseCommand):
+    help = ('Renumbers conversations whose messages have duplicate or missing sequence numbers, '
+            'resets the sequence counters and creates the unique sequence index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', help='Only repair this conversation id')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Messages updated per bulk write')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the conversations that need renumbering without writing')
+
+    def handle(self, *args, **options):
+        if options['conversation']:
+            conversation_ids = [cid for cid in messages_collection.distinct('conversation_id')
+                                if str(cid) == options['conversation']]
+        else:
+            conversation_ids = messages_collection.distinct('conversation_id')
+
+        renumbered = 0
+        for conversation_id in conversation_ids:
+            messages = list(messages_collection.find(
+                {'conversation_id': conversation_id}, {'sequence': 1}
+            ).sort([('sent_at', 1), ('_id', 1)]))
+            sequences = [message.get('sequence') for message in messages]
+            valid = None not in sequences and len(set(sequences)) == len(sequences)
+
+            if not valid:
+                renumbered += 1
+                self.stdout.write(f'Conversation {conversation_id}: renumbering {len(messages)} messages')
+                if not options['dry_run']:
+                    # Negative placeholders first so the unique index never sees a collision
+                    self._assign(messages, lambda n: -n, options['batch_size'])
+                    self._assign(messages, lambda n: n, options['batch_size'])
+                last = len(messages)
+            else:
+                last = max(sequences) if sequences else 0
+
+            if not options['dry_run']:
+                # $max: string and ObjectId spellings of one id share a counter
+                sequence_counters_collection.update_one(
+                    {'_id': conversation_sequence_key(conversation_id)}, {'$max': {'value': last}}, upsert=True)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{renumbered} conversations need renumbering'))
+            return
+
+        messages_collection.create_index(
+            [('conversation_id', 1), ('sequence', 1)],
+            unique=True,
+            partialFilterExpression={'sequence': {'$exists': True}},
+            name='conversation_sequence_unique'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {len(conversation_ids)} conversations, renumbered {renumbered}'))
+
+    def _assign(self, messages, number, batch_size):
+        operations = []
+        for position, message in enumerate(messages, start=1):
+            operations.append(UpdateOne({'_id': message['_id']}, {'$set': {'sequence': number(position)}}))
+            if len(operations) >= batch_size:
+                messages_collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            messages_collection.bulk_write(operations, ordered=False)
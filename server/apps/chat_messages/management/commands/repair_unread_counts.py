@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from apps.chat_messages.models import (
+    messages_collection, conversations_collection, conversation_sequence_key, participant_id_for
+)
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-participant unread counters of conversations from their messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', help='Only repair this conversation id')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Conversations updated per bulk write')
+
+    def handle(self, *args, **options):
+        query = {}
+        message_query = {'read': False}
+        if options['conversation']:
+            key = conversation_sequence_key(options['conversation'])
+            query['_id'] = key
+            message_query['conversation_id'] = {'$in': [key, str(key)]}
+
+        # Unread messages per (conversation, sender) in one pass
+        unread_by_sender = {}
+        for row in messages_collection.aggregate([
+            {'$match': message_query},
+            {'$group': {'_id': {'conversation_id': '$conversation_id', 'sender_id': '$sender_id'},
+                        'count': {'$sum': 1}}}
+        ], allowDiskUse=True):
+            conversation_id = conversation_sequence_key(row['_id']['conversation_id'])
+            senders = unread_by_sender.setdefault(conversation_id, {})
+            sender_id = str(row['_id'].get('sender_id'))
+            senders[sender_id] = senders.get(sender_id, 0) + row['count']
+
+        operations = []
+        repaired = 0
+        for conversation in conversations_collection.find(query, {'participants': 1, 'unread_counts': 1}):
+            participants = conversation.get('participants', [])
+            # Senders are user ids; therapists may take part under their therapist id
+            senders = {}
+            for sender_id, count in unread_by_sender.get(conversation['_id'], {}).items():
+                participant = participant_id_for(participants, sender_id) or sender_id
+                senders[participant] = senders.get(participant, 0) + count
+            total = sum(senders.values())
+            counts = {str(participant): total - senders.get(str(participant), 0)
+                      for participant in participants}
+            if counts == (conversation.get('unread_counts') or {}):
+                continue
+
+            repaired += 1
+            operations.append(UpdateOne({'_id': conversation['_id']}, {'$set': {'unread_counts': counts}}))
+            if len(operations) >= options['batch_size']:
+                conversations_collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            conversations_collection.bulk_write(operations, ordered=False)
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired unread counters of {repaired} conversations'))
@@ -0,0 +1,202 @@
+import os
+import uuid
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Most recent messages kept per conversation
+CHAT_CACHE_MESSAGES = int(os.environ.get("CHAT_CACHE_MESSAGES", 100))
+
+# Conversations kept per process; the least recently used is evicted beyond this
+CHAT_CACHE_CONVERSATIONS = int(os.environ.get("CHAT_CACHE_CONVERSATIONS", 500))
+
+# Channel layer group every process listens on for writes made elsewhere
+INVALIDATION_GROUP = "chat_message_cache"
+
+# Group memberships expire on some channel layers; the listener re-joins this often
+GROUP_REFRESH_SECONDS = 3600
+
+
+def _key(conversation_id):
+    return str(conversation_id)
+
+
+class _Window:
+    """ The latest messages of one conversation, oldest first """
+
+    def __init__(self, messages, complete):
+        self.messages = OrderedDict((str(message["_id"]), message) for message in messages)
+        # True when the window holds the whole conversation (nothing older exists)
+        self.complete = complete
+
+
+class MessageCache:
+    """
+    Per-process cache of the recent messages of active conversations.
+
+    Each conversation keeps a window of its latest `per_conversation`
+    messages, loaded on first access and updated in place by this process's
+    writes. Windows are evicted least recently used beyond
+    `max_conversations`. Other processes' writes arrive as invalidations on
+    the channel layer (see publish / ensure_listener) and drop the window.
+    """
+
+    def __init__(self, per_conversation=CHAT_CACHE_MESSAGES, max_conversations=CHAT_CACHE_CONVERSATIONS):
+        self.per_conversation = per_conversation
+        self.max_conversations = max_conversations
+        self._windows = OrderedDict()   # conversation key -> _Window, least recently used first
+        self._message_index = {}        # message id -> conversation key
+        self._lock = threading.Lock()
+        self.process_id = uuid.uuid4().hex
+        self._listener = None
+        self._channel_name = None
+        self._joined_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    # -- reads --------------------------------------------------------------
+
+    def page(self, conversation_id, before_sequence=None, limit=50):
+        """
+        Up to `limit` messages before before_sequence (the latest if None),
+        oldest first; None when the window cannot answer the page in full
+        """
+        with self._lock:
+            window = self._windows.get(_key(conversation_id))
+            if window is None:
+                self.misses += 1
+                return None
+            self._windows.move_to_end(_key(conversation_id))
+
+            messages = [message for message in window.messages.values()
+                        if before_sequence is None or message["sequence"] < before_sequence]
+            if len(messages) < limit and not window.complete:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return [dict(message) for message in messages[-limit:]]
+
+    def get(self, message_id):
+        with self._lock:
+            conversation = self._message_index.get(str(message_id))
+            if conversation is None:
+                return None
+            message = self._windows[conversation].messages.get(str(message_id))
+            return dict(message) if message else None
+
+    # -- population and updates ---------------------------------------------
+
+    def load(self, conversation_id, messages, complete):
+        """ Install the window of a conversation from its latest messages (oldest first) """
+        messages = [message for message in messages if message.get("sequence") is not None]
+        with self._lock:
+            self._drop(_key(conversation_id))
+            window = _Window(messages[-self.per_conversation:], complete and len(messages) <= self.per_conversation)
+            self._windows[_key(conversation_id)] = window
+            for message_id in window.messages:
+                self._message_index[message_id] = _key(conversation_id)
+
+            while len(self._windows) > self.max_conversations:
+                self._drop(next(iter(self._windows)))
+
+    def add(self, message):
+        """ A message this process just saved; kept if its conversation is cached """
+        with self._lock:
+            key = _key(message["conversation_id"])
+            window = self._windows.get(key)
+            if window is None:
+                return
+            message_id = str(message["_id"])
+            window.messages[message_id] = dict(message)
+            self._message_index[message_id] = key
+
+            # Out-of-order saves are rare; keep the window sorted by sequence
+            if len(window.messages) > 1 and list(window.messages.values())[-2]["sequence"] > message["sequence"]:
+                window.messages = OrderedDict(sorted(window.messages.items(), key=lambda item: item[1]["sequence"]))
+
+            while len(window.messages) > self.per_conversation:
+                evicted, _ = window.messages.popitem(last=False)
+                self._message_index.pop(evicted, None)
+                window.complete = False
+
+    def update(self, message_id, mutate):
+        """ Apply mutate(message) to a cached message, if present """
+        with self._lock:
+            conversation = self._message_index.get(str(message_id))
+            if conversation is None:
+                return
+            message = self._windows[conversation].messages.get(str(message_id))
+            if message is not None:
+                mutate(message)
+
+    def mark_read(self, conversation_id, reader_id, up_to_sequence=None, message_ids=()):
+        message_ids = {str(message_id) for message_id in message_ids}
+        with self._lock:
+            window = self._windows.get(_key(conversation_id))
+            if window is None:
+                return
+            for message_id, message in window.messages.items():
+                if message.get("sender_id") == reader_id:
+                    continue
+                if (up_to_sequence and message["sequence"] <= up_to_sequence) or message_id in message_ids:
+                    message["read"] = True
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._drop(_key(conversation_id))
+
+    def _drop(self, key):
+        window = self._windows.pop(key, None)
+        if window is not None:
+            for message_id in window.messages:
+                self._message_index.pop(message_id, None)
+
+    # -- cross-process invalidation -----------------------------------------
+
+    async def publish(self, channel_layer, conversation_id):
+        """ Tell the other processes a conversation changed """
+        if channel_layer is None:
+            return
+        try:
+            await channel_layer.group_send(INVALIDATION_GROUP, {
+                "type": "cache.invalidate",
+                "conversation_id": _key(conversation_id),
+                "origin": self.process_id
+            })
+        except Exception as e:
+            logger.warning(f"Could not publish chat cache invalidation: {str(e)}")
+
+    async def ensure_listener(self, channel_layer):
+        """ Start this process's invalidation listener on the running loop, once """
+        if channel_layer is None:
+            return
+        if self._listener is not None and not self._listener.done():
+            if time.monotonic() - self._joined_at > GROUP_REFRESH_SECONDS:
+                self._joined_at = time.monotonic()
+                await channel_layer.group_add(INVALIDATION_GROUP, self._channel_name)
+            return
+
+        self._channel_name = await channel_layer.new_channel("chat-cache.")
+        self._joined_at = time.monotonic()
+        await channel_layer.group_add(INVALIDATION_GROUP, self._channel_name)
+        self._listener = asyncio.ensure_future(self._listen(channel_layer, self._channel_name))
+
+    async def _listen(self, channel_layer, channel_name):
+        while True:
+            try:
+                event = await channel_layer.receive(channel_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Chat cache invalidation listener stopped: {str(e)}")
+                return
+            if event.get("type") == "cache.invalidate" and event.get("origin") != self.process_id:
+                self.invalidate(event["conversation_id"])
+
+
+message_cache = MessageCache()
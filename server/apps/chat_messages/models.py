@@ -1,5 +1,7 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import logging
 import os
 import sys
@@ -15,6 +17,147 @@ logger = logging.getLogger(__name__)
 # Collections
 conversations_collection = db["conversations"]
 messages_collection = db["messages"]
+sequence_counters_collection = db["conversation_sequences"]
+
+try:
+    # Messages written before sequences existed have none; they are not constrained
+    messages_collection.create_index(
+        [("conversation_id", 1), ("sequence", 1)],
+        unique=True,
+        partialFilterExpression={"sequence": {"$exists": True}},
+        name="conversation_sequence_unique"
+    )
+except Exception as e:
+    # Fails while legacy duplicates remain; run the repair_message_sequences command
+    logger.warning(f"Could not create message sequence index: {str(e)}")
+
+try:
+    # Edits, deletions and reactions stamp updated_at; incremental sync reads them back
+    messages_collection.create_index(
+        [("conversation_id", 1), ("updated_at", 1)],
+        partialFilterExpression={"updated_at": {"$exists": True}},
+        name="conversation_updated_at"
+    )
+except Exception as e:
+    logger.warning(f"Could not create message change index: {str(e)}")
+
+try:
+    # Conversation lists and unread badges are per participant
+    conversations_collection.create_index([("participants", 1), ("updated_at", -1)])
+except Exception as e:
+    logger.warning(f"Could not create conversation participant index: {str(e)}")
+
+try:
+    # get_or_create upserts on the canonical key; legacy conversations get theirs from backfill_conversation_keys
+    conversations_collection.create_index(
+        "conversation_key",
+        unique=True,
+        partialFilterExpression={"conversation_key": {"$exists": True}},
+        name="conversation_key_unique"
+    )
+except Exception as e:
+    logger.warning(f"Could not create conversation key index: {str(e)}")
+
+# User fields rendered on a conversation card
+CARD_USER_PROJECTION = {
+    "first_name": 1,
+    "last_name": 1,
+    "username": 1,
+    "profile_picture": 1,
+    "status": 1,
+    "role": 1
+}
+
+# Upper bound on messages returned by one sync or history page
+MAX_SYNC_BATCH = 200
+
+
+def conversation_sequence_key(conversation_id):
+    """Counter key of a conversation; ids stored as strings share the ObjectId's counter"""
+    if isinstance(conversation_id, str):
+        try:
+            return ObjectId(conversation_id)
+        except Exception:
+            return conversation_id
+    return conversation_id
+
+
+def current_max_sequence(conversation_id):
+    """Highest sequence stored on the messages of a conversation (0 if none)"""
+    key = conversation_sequence_key(conversation_id)
+    # Some writers stored the conversation id as a string
+    last_message = messages_collection.find_one(
+        {"conversation_id": {"$in": [key, str(key)]}, "sequence": {"$exists": True}},
+        {"sequence": 1},
+        sort=[("sequence", -1)]
+    )
+    return last_message["sequence"] if last_message else 0
+
+
+def allocate_sequence(conversation_id, count=1):
+    """
+    Reserve the next `count` sequence numbers of a conversation.
+
+    Returns the first number of the block; the block is first..first+count-1.
+    One atomic $inc on the conversation's counter, so concurrent senders never
+    receive the same number. A counter missing for a conversation that already
+    has messages is seeded once from the highest stored sequence.
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+
+    key = conversation_sequence_key(conversation_id)
+    counter = sequence_counters_collection.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"value": count}},
+        return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        try:
+            sequence_counters_collection.insert_one({"_id": key, "value": current_max_sequence(key)})
+        except DuplicateKeyError:
+            pass  # Another sender seeded it first
+        counter = sequence_counters_collection.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"value": count}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    return counter["value"] - count + 1
+
+
+def conversation_key(participants, conversation_type=None, session_id=None):
+    """
+    Canonical identity of a conversation: its type plus the session for
+    session conversations, otherwise its type plus the sorted participants.
+    A session identifies its participants, which callers name inconsistently
+    (user id or therapist id), so it is not keyed on them.
+    """
+    if session_id:
+        return f"{conversation_type or ''}|session:{session_id}"
+    return f"{conversation_type or ''}|" + "|".join(sorted(str(participant) for participant in participants))
+
+
+def participant_id_for(participants, user_id):
+    """
+    The id under which user_id is stored in a conversation's participants:
+    the user id, or for therapists in older conversations their therapist
+    id. None if the user does not take part.
+    """
+    user_id = str(user_id)
+    stored = {str(participant) for participant in participants}
+    if user_id in stored:
+        return user_id
+    if ObjectId.is_valid(user_id):
+        therapist = db.therapists.find_one({"user_id": ObjectId(user_id)}, {"_id": 1})
+        if therapist and str(therapist["_id"]) in stored:
+            return str(therapist["_id"])
+    return None
+
+
+def _conversation_match(conversation_id):
+    key = conversation_sequence_key(conversation_id)
+    return {"$in": [key, str(key)]}
 
 
 class ConversationType(Enum):
@@ -44,6 +187,7 @@ class Conversation:
         self.updated_at = datetime.utcnow()
         self.last_message = None
         self.metadata = metadata or {}
+        self.conversation_key = conversation_key(self.participants, conversation_type, session_id)
         
     def to_dict(self):
         """Convert to dictionary for database storage"""
@@ -55,7 +199,9 @@ class Conversation:
             "created_at": self.created_at,
             "updated_at": self.updated_at,
             "last_message": self.last_message,
-            "metadata": self.metadata
+            "unread_counts": {},  # participant id -> messages they have not read
+            "metadata": self.metadata,
+            "conversation_key": self.conversation_key
         }
     
     def save(self):
@@ -69,43 +215,68 @@ class Conversation:
             return None
     
     @classmethod
-    def get_or_create(cls, participants, conversation_type=None, session_id=None):
-        """Get or create a conversation between participants"""
-        # Sort participants for consistent matching
-        sorted_participants = sorted(participants)
-        
-        # Try to find by session_id first (most specific match)
-        if session_id:
-            existing = conversations_collection.find_one({
-                "session_id": session_id,
-                "conversation_type": "therapy_session"
-            })
-            if existing:
-                print(f"Found conversation by session_id: {existing['_id']}")
-                return str(existing["_id"])
-        
-        # Then try to find by participants and type
-        query = {
-            "participants": {"$all": sorted_participants, "$size": len(sorted_participants)}
-        }
-        
-        if conversation_type:
-            query["conversation_type"] = conversation_type
-            
-        existing = conversations_collection.find_one(query)
-        if existing:
-            print(f"Found conversation by participants: {existing['_id']}")
-            return str(existing["_id"])
-        
-        # Create new conversation if none exists
+    def resolve(cls, participants, conversation_type=None, session_id=None, metadata=None,
+                projection=None):
+        """
+        Get or create a conversation by its canonical key (see
+        conversation_key); a single lookup once the conversation is keyed.
+        Conversations from before the key existed are found the old way and
+        adopt the key, so they are never duplicated. Returns the conversation
+        document, limited to `projection` if given.
+        """
         conversation = cls(
-            participants=sorted_participants,
+            participants=participants,
             conversation_type=conversation_type,
-            session_id=session_id
+            session_id=session_id,
+            metadata=metadata
         )
-        new_id = conversation.save()
-        print(f"Created new conversation: {new_id}")
-        return new_id
+        document = conversation.to_dict()
+        key = document.pop("conversation_key")
+
+        existing = conversations_collection.find_one({"conversation_key": key}, projection)
+        if existing:
+            return existing
+
+        legacy = cls._find_legacy(conversation.participants, conversation_type, session_id)
+        if legacy:
+            try:
+                conversations_collection.update_one({"_id": legacy["_id"]}, {"$set": {"conversation_key": key}})
+                return conversations_collection.find_one({"_id": legacy["_id"]}, projection)
+            except DuplicateKeyError:
+                pass  # Another connection keyed (or created) it first
+
+        try:
+            return conversations_collection.find_one_and_update(
+                {"conversation_key": key},
+                {"$setOnInsert": document},
+                projection=projection,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent upsert inserted it first
+            return conversations_collection.find_one({"conversation_key": key}, projection)
+
+    @staticmethod
+    def _find_legacy(participants, conversation_type=None, session_id=None):
+        """Oldest unkeyed conversation matching the lookups get_or_create used before conversation keys"""
+        query = {"conversation_key": {"$exists": False}}
+        if conversation_type:
+            query["conversation_type"] = conversation_type
+        if session_id:
+            # Session ids were stored both as strings and as ObjectIds
+            query["session_id"] = {"$in": [session_id, str(session_id)] +
+                                          ([ObjectId(session_id)] if ObjectId.is_valid(str(session_id)) else [])}
+        else:
+            query["participants"] = {"$all": participants, "$size": len(participants)}
+
+        return conversations_collection.find_one(query, {"_id": 1}, sort=[("created_at", 1)])
+
+    @classmethod
+    def get_or_create(cls, participants, conversation_type=None, session_id=None, metadata=None):
+        """Get or create a conversation between participants; returns its id as a string"""
+        conversation = cls.resolve(participants, conversation_type, session_id, metadata, projection={"_id": 1})
+        return str(conversation["_id"])
     
     @staticmethod
     def find_by_id(conversation_id):
@@ -128,6 +299,19 @@ class Conversation:
             query
         ).sort("updated_at", -1).skip(skip).limit(limit))
     
+    @staticmethod
+    def advance_read_watermark(conversation_id, reader_id, sequence):
+        """Record that reader_id has read everything up to sequence (never moves back)"""
+        return conversations_collection.update_one(
+            {"_id": conversation_sequence_key(conversation_id)},
+            {"$max": {f"read_up_to.{reader_id}": sequence}}
+        )
+    
+    @staticmethod
+    def get_read_watermark(conversation, reader_id):
+        """Highest sequence reader_id has read in a conversation document (0 if none)"""
+        return (conversation.get("read_up_to") or {}).get(str(reader_id), 0)
+    
     @staticmethod
     def update_last_message(conversation_id, message_data):
         """Update conversation with last message info"""
@@ -144,6 +328,78 @@ class Conversation:
             }
         )
     
+    @staticmethod
+    def message_operations(conversation_id, participants, sender_id, message_data, count=1):
+        """
+        Bulk operations recording `count` new messages from sender_id: last
+        message info plus the unread counter of every other participant
+        """
+        conversation_id = conversation_sequence_key(conversation_id)
+
+        last_message_filter = {"_id": conversation_id}
+        if message_data.get("sequence") is not None:
+            # Batched or concurrent writes can land out of order; never replace a newer last message
+            last_message_filter["$or"] = [
+                {"last_message.sequence": {"$lt": message_data["sequence"]}},
+                {"last_message.sequence": {"$exists": False}}
+            ]
+        operations = [UpdateOne(last_message_filter, {
+            "$set": {
+                "last_message": message_data,
+                "updated_at": datetime.utcnow()
+            }
+        })]
+
+        sender = participant_id_for(participants, sender_id) or str(sender_id)
+        unread = {f"unread_counts.{participant}": count
+                  for participant in participants if str(participant) != sender}
+        if unread:
+            operations.append(UpdateOne({"_id": conversation_id}, {"$inc": unread}))
+        return operations
+    
+    @staticmethod
+    def record_message(conversation_id, sender_id, message_data, count=1):
+        """Update the conversation for `count` new messages from sender_id (see message_operations)"""
+        conversation_id = conversation_sequence_key(conversation_id)
+        conversation = conversations_collection.find_one({"_id": conversation_id}, {"participants": 1})
+        participants = conversation.get("participants", []) if conversation else []
+
+        return conversations_collection.bulk_write(
+            Conversation.message_operations(conversation_id, participants, sender_id, message_data, count),
+            ordered=False
+        )
+    
+    @staticmethod
+    def decrement_unread(conversation_id, reader_id, count):
+        """Take `count` newly read messages off reader_id's unread counter, never below zero"""
+        if count <= 0:
+            return
+        conversation_id = conversation_sequence_key(conversation_id)
+
+        result = conversations_collection.update_one(
+            {"_id": conversation_id, f"unread_counts.{reader_id}": {"$gte": count}},
+            {"$inc": {f"unread_counts.{reader_id}": -count}}
+        )
+        if result.matched_count:
+            return
+
+        # The counter is kept under the stored participant id, which may be a therapist id
+        conversation = conversations_collection.find_one({"_id": conversation_id}, {"participants": 1})
+        participant = participant_id_for(conversation.get("participants", []), reader_id) if conversation else None
+        if participant is None:
+            return
+        field = f"unread_counts.{participant}"
+
+        if participant != str(reader_id):
+            result = conversations_collection.update_one(
+                {"_id": conversation_id, field: {"$gte": count}},
+                {"$inc": {field: -count}}
+            )
+            if result.matched_count:
+                return
+        # Counter drifted below the real number; clamp (repair_unread_counts recomputes it)
+        conversations_collection.update_one({"_id": conversation_id}, {"$set": {field: 0}})
+    
     @staticmethod
     def get_session_conversation(session_id):
         """Get conversation associated with a session"""
@@ -180,6 +436,47 @@ class Conversation:
         print(f"Found {len(results)} conversations for participant {participant_id}")
         return results
 
+    
+    @staticmethod
+    def list_cards(participant_ids, conversation_type="therapy_session", limit=20, skip=0):
+        """
+        One page of a user's conversation list in a single aggregation.
+
+        participant_ids are all ids the user appears under (user id and, for
+        therapists, therapist id). Each conversation carries other_participant_id
+        and other_user, the other participant's user document (projected to
+        CARD_USER_PROJECTION), resolved through the therapists collection when
+        the participant is stored by therapist id.
+        """
+        participant_ids = [str(participant_id) for participant_id in participant_ids]
+        user_lookup = {"from": "users", "foreignField": "_id", "pipeline": [{"$project": CARD_USER_PROJECTION}]}
+
+        pipeline = [
+            {"$match": {"participants": {"$in": participant_ids}, "conversation_type": conversation_type}},
+            {"$sort": {"updated_at": -1}},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$addFields": {"other_participant_id": {"$arrayElemAt": [{"$filter": {
+                "input": "$participants",
+                "cond": {"$not": [{"$in": [{"$toString": "$$this"}, participant_ids]}]}
+            }}, 0]}}},
+            {"$addFields": {"_other_oid": {"$convert": {
+                "input": "$other_participant_id", "to": "objectId", "onError": None, "onNull": None
+            }}}},
+            {"$lookup": dict(user_lookup, localField="_other_oid", **{"as": "_other_user"})},
+            {"$lookup": {
+                "from": "therapists", "localField": "_other_oid", "foreignField": "_id",
+                "pipeline": [{"$project": {"user_id": 1}}], "as": "_other_therapist"
+            }},
+            {"$lookup": dict(user_lookup, localField="_other_therapist.user_id", **{"as": "_therapist_user"})},
+            {"$addFields": {"other_user": {"$ifNull": [
+                {"$arrayElemAt": ["$_other_user", 0]},
+                {"$arrayElemAt": ["$_therapist_user", 0]}
+            ]}}},
+            {"$project": {"_other_oid": 0, "_other_user": 0, "_other_therapist": 0, "_therapist_user": 0}}
+        ]
+        return list(conversations_collection.aggregate(pipeline))
+
 
 class Message:
     """Message model for individual chat messages"""
@@ -215,6 +512,7 @@ class Message:
         self.deleted_at = None
         self.reactions = []
         self.metadata = metadata or {}
+        self.sequence = None  # Allocated on save
         
     def to_dict(self):
         """Convert to dictionary for database storage"""
@@ -234,30 +532,55 @@ class Message:
             "is_deleted": self.is_deleted,
             "deleted_at": self.deleted_at,
             "reactions": self.reactions,
-            "metadata": self.metadata
+            "metadata": self.metadata,
+            "sequence": self.sequence
+        }
+    
+    def _last_message_data(self):
+        return {
+            "content": self.content[:100] if self.content else "",
+            "sender_id": self.sender_id,
+            "sent_at": self.sent_at,
+            "message_type": self.message_type,
+            "sequence": self.sequence
         }
     
     def save(self):
         """Save message to MongoDB and update conversation"""
         try:
+            if self.sequence is None:
+                self.sequence = allocate_sequence(self.conversation_id)
             message_dict = self.to_dict()
             messages_collection.insert_one(message_dict)
             
-            # Update conversation last message info
-            last_message_data = {
-                "content": self.content[:100] if self.content else "",
-                "sender_id": self.sender_id,  # This will now be correct (user_id or therapist_id)
-                "sent_at": self.sent_at,
-                "message_type": self.message_type
-            }
-            
-            Conversation.update_last_message(self.conversation_id, last_message_data)
+            # Update conversation last message info and unread counters
+            Conversation.record_message(self.conversation_id, self.sender_id, self._last_message_data())
             return self.message_id
             
         except Exception as e:
             logger.error(f"Error saving message: {e}")
             return None
     
+    @staticmethod
+    def save_batch(messages):
+        """
+        Save several messages of one conversation with a single sequence
+        allocation and a single insert. Returns the message ids in order.
+        """
+        if not messages:
+            return []
+
+        conversation_id = messages[0].conversation_id
+        first = allocate_sequence(conversation_id, count=len(messages))
+        for offset, message in enumerate(messages):
+            message.sequence = first + offset
+
+        messages_collection.insert_many([message.to_dict() for message in messages], ordered=True)
+        # Unread counters only track the last sender; batches come from a single sender
+        Conversation.record_message(conversation_id, messages[-1].sender_id,
+                                    messages[-1]._last_message_data(), count=len(messages))
+        return [message.message_id for message in messages]
+    
     @staticmethod
     def find_by_id(message_id):
         """Find message by ID"""
@@ -292,6 +615,73 @@ class Message:
             traceback.print_exc()
             return []
     
+    @staticmethod
+    def get_messages_after(conversation_id, after_sequence=0, limit=MAX_SYNC_BATCH):
+        """Messages with a sequence above after_sequence, oldest first"""
+        return list(messages_collection.find({
+            "conversation_id": _conversation_match(conversation_id),
+            "sequence": {"$gt": after_sequence}
+        }).sort("sequence", 1).limit(min(limit, MAX_SYNC_BATCH)))
+    
+    @staticmethod
+    def get_messages_before(conversation_id, before_sequence=None, limit=50):
+        """
+        Keyset page for scrolling back: the `limit` messages preceding
+        before_sequence (the latest ones if None), returned oldest first
+        """
+        query = {"conversation_id": _conversation_match(conversation_id), "sequence": {"$exists": True}}
+        if before_sequence is not None:
+            query["sequence"] = {"$lt": before_sequence}
+
+        messages = list(messages_collection.find(query).sort("sequence", -1).limit(min(limit, MAX_SYNC_BATCH)))
+        messages.reverse()
+        return messages
+    
+    @staticmethod
+    def get_changed_messages(conversation_id, since, max_sequence, limit=MAX_SYNC_BATCH):
+        """Messages up to max_sequence edited, deleted or reacted to at or after `since`"""
+        return list(messages_collection.find({
+            "conversation_id": _conversation_match(conversation_id),
+            "sequence": {"$lte": max_sequence},
+            "updated_at": {"$gte": since}
+        }).sort("updated_at", 1).limit(limit))
+    
+    @staticmethod
+    def sync(conversation_id, last_sequence, since=None, limit=MAX_SYNC_BATCH):
+        """
+        What a client holding messages up to last_sequence is missing.
+
+        Returns newer messages (at most `limit`; has_more tells the client to
+        sync again from the returned last_sequence) and the already-known
+        messages that changed since `since`. Without `since`, changes are
+        looked up from the time the client's last message was sent. The
+        returned sync_time is the `since` to use on the next sync.
+        """
+        sync_time = datetime.utcnow()
+
+        messages = Message.get_messages_after(conversation_id, last_sequence, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        changes = []
+        if last_sequence > 0:
+            if since is None:
+                last_known = messages_collection.find_one(
+                    {"conversation_id": _conversation_match(conversation_id), "sequence": last_sequence},
+                    {"sent_at": 1}
+                )
+                since = last_known.get("sent_at") if last_known else None
+            if since is not None:
+                changes = Message.get_changed_messages(conversation_id, since, last_sequence)
+
+        return {
+            "messages": messages,
+            "changes": changes,
+            "last_sequence": messages[-1]["sequence"] if messages else last_sequence,
+            "has_more": has_more,
+            "sync_time": sync_time
+        }
+    
     @staticmethod
     def get_messages_by_session(session_id, limit=100, skip=0):
         """Get messages for a specific therapy session"""
@@ -309,13 +699,50 @@ class Message:
         # Convert string IDs to ObjectId
         object_ids = [ObjectId(id) if isinstance(id, str) else id for id in message_ids]
         
+        # Which conversations lose unread messages, for their counters
+        unread = list(messages_collection.find(
+            {"_id": {"$in": object_ids}, "read": False, "sender_id": {"$ne": reader_id}},
+            {"conversation_id": 1}
+        ))
+        if not unread:
+            return False
+        
         result = messages_collection.update_many(
-            {"_id": {"$in": object_ids}, "read": False},
+            {"_id": {"$in": [message["_id"] for message in unread]}, "read": False},
             {"$set": {"read": True, "read_at": datetime.utcnow()}}
         )
         
+        per_conversation = {}
+        for message in unread:
+            key = conversation_sequence_key(message["conversation_id"])
+            per_conversation[key] = per_conversation.get(key, 0) + 1
+        if result.modified_count == len(unread):
+            for conversation_id, count in per_conversation.items():
+                Conversation.decrement_unread(conversation_id, reader_id, count)
+        
         return result.modified_count > 0
     
+    @staticmethod
+    def mark_read_up_to(conversation_id, reader_id, sequence):
+        """
+        Mark every message of the conversation up to sequence, not sent by
+        reader_id, as read: one watermark update and one update_many.
+        Returns the number of messages that became read.
+        """
+        Conversation.advance_read_watermark(conversation_id, reader_id, sequence)
+
+        result = messages_collection.update_many(
+            {
+                "conversation_id": _conversation_match(conversation_id),
+                "sequence": {"$lte": sequence},
+                "sender_id": {"$ne": reader_id},
+                "read": False
+            },
+            {"$set": {"read": True, "read_at": datetime.utcnow()}}
+        )
+        Conversation.decrement_unread(conversation_id, reader_id, result.modified_count)
+        return result.modified_count
+    
     @staticmethod
     def add_reaction(message_id, user_id, reaction):
         """Add reaction to a message"""
@@ -329,13 +756,17 @@ class Message:
         )
         
         # Then add the new reaction
+        now = datetime.utcnow()
         result = messages_collection.update_one(
             {"_id": message_id},
-            {"$push": {"reactions": {
-                "user_id": user_id,
-                "reaction": reaction,
-                "created_at": datetime.utcnow()
-            }}}
+            {
+                "$push": {"reactions": {
+                    "user_id": user_id,
+                    "reaction": reaction,
+                    "created_at": now
+                }},
+                "$set": {"updated_at": now}
+            }
         )
         
         return result.modified_count > 0
@@ -347,12 +778,14 @@ class Message:
             message_id = ObjectId(message_id)
             
         # Ensure only sender can edit their message
+        now = datetime.utcnow()
         result = messages_collection.update_one(
             {"_id": message_id, "sender_id": sender_id},
             {"$set": {
                 "content": new_content,
                 "edited": True,
-                "edited_at": datetime.utcnow()
+                "edited_at": now,
+                "updated_at": now
             }}
         )
         
@@ -365,11 +798,13 @@ class Message:
             message_id = ObjectId(message_id)
             
         # Ensure only sender can delete their message
+        now = datetime.utcnow()
         result = messages_collection.update_one(
             {"_id": message_id, "sender_id": sender_id},
             {"$set": {
                 "is_deleted": True,
-                "deleted_at": datetime.utcnow(),
+                "deleted_at": now,
+                "updated_at": now,
                 "content": "[This message was deleted]"
             }}
         )
@@ -377,26 +812,28 @@ class Message:
         return result.modified_count > 0
     
     @staticmethod
-    def get_unread_count(user_id, conversation_id=None):
-        """Get count of unread messages for a user in one or all conversations"""
-        query = {
-            "read": False,
-            "sender_id": {"$ne": user_id}  # Not sent by this user
-        }
+    def get_unread_count(user_ids, conversation_id=None):
+        """
+        Get count of unread messages for a user in one or all conversations.
+        user_ids is one id or every id the user is stored under (user id and,
+        for therapists, therapist id); their counters are summed.
+        """
+        # Reads the maintained per-participant counters, not the messages
+        if not isinstance(user_ids, (list, tuple, set)):
+            user_ids = [user_ids]
+        user_ids = [str(user_id) for user_id in user_ids]
+        fields = [f"unread_counts.{user_id}" for user_id in user_ids]
         
         if conversation_id:
-            if isinstance(conversation_id, str):
-                conversation_id = ObjectId(conversation_id)
-            query["conversation_id"] = conversation_id
-        else:
-            # Get all conversations where user is a participant
-            conversation_ids = [
-                conv["_id"] for conv in 
-                list(conversations_collection.find(
-                    {"participants": user_id},
-                    {"_id": 1}
-                ))
-            ]
-            query["conversation_id"] = {"$in": conversation_ids}
-            
-        return messages_collection.count_documents(query)
\ No newline at end of file
+            conversation = conversations_collection.find_one(
+                {"_id": conversation_sequence_key(conversation_id)}, {field: 1 for field in fields})
+            counts = (conversation or {}).get("unread_counts") or {}
+            return sum(counts.get(user_id, 0) for user_id in user_ids)
+        
+        totals = list(conversations_collection.aggregate([
+            {"$match": {"participants": {"$in": user_ids},
+                        "$or": [{field: {"$gt": 0}} for field in fields]}},
+            {"$group": {"_id": None, "unread": {"$sum": {"$add": [
+                {"$ifNull": [f"${field}", 0]} for field in fields]}}}}
+        ]))
+        return totals[0]["unread"] if totals else 0
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Receipts from one connection within this window are written and broadcast once
+READ_RECEIPT_WINDOW_SECONDS = float(os.environ.get("READ_RECEIPT_WINDOW_SECONDS", 0.5))
+
+
+class ReadReceiptBatcher:
+    """
+    Coalesces the read receipts of one websocket connection.
+
+    Receipts are "read up to sequence N" watermarks, so a burst of them
+    collapses into the highest one. Ids of legacy messages without a sequence
+    are collected alongside. After the window, `flush(up_to_sequence,
+    message_ids)` is awaited once with everything gathered.
+    """
+
+    def __init__(self, flush, window=READ_RECEIPT_WINDOW_SECONDS):
+        self._flush = flush
+        self.window = window
+        self.up_to_sequence = 0
+        self.message_ids = set()
+        self._task = None
+
+    def add(self, up_to_sequence=None, message_ids=()):
+        if up_to_sequence:
+            self.up_to_sequence = max(self.up_to_sequence, int(up_to_sequence))
+        self.message_ids.update(str(message_id) for message_id in message_ids)
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._task = None  # Past the window: close() must not cancel a flush in progress
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error writing read receipts: {str(e)}")
+
+    async def flush(self):
+        up_to_sequence, message_ids = self.up_to_sequence, sorted(self.message_ids)
+        self.up_to_sequence = 0
+        self.message_ids = set()
+        if up_to_sequence or message_ids:
+            await self._flush(up_to_sequence, message_ids)
+
+    async def close(self):
+        """ Write whatever is pending now, e.g. when the connection closes """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
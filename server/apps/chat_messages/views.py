@@ -2,8 +2,10 @@ from apps.therapy_sessions.models import TherapySession
 from apps.utils.db_helper import convert_object_ids
 from apps.utils.auth import get_user_from_request
 from apps.chat_messages.models import Conversation, Message
+from apps.chat_messages.message_cache import message_cache
 from apps.therapists.models import Therapist
 from apps.users.models import User
+from apps.users.presence import presence_registry
 import json
 import traceback
 from django.http import JsonResponse
@@ -13,6 +15,8 @@ from bson import ObjectId
 import sys
 import os
 from datetime import datetime, timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from database import db
 
 # Import models
@@ -165,14 +169,8 @@ def convert_object_ids(obj):
 #         "status": "offline"
 #     }
 
-def get_participant_details(user_id):
-    """Get participant name and profile picture from either user or therapist collection"""
-    # Convert to string if ObjectId
-    if isinstance(user_id, ObjectId):
-        user_id = str(user_id)
-
-    # First try users collection directly
-    user = User.find_by_id(user_id)
+def participant_card(user_id, user):
+    """Name, picture and status of a participant from their user document (or None)"""
     if user:
         # Extract basic user details
         first_name = user.get('first_name', '')
@@ -212,6 +210,15 @@ def get_participant_details(user_id):
         "status": "offline"
     }
 
+
+def get_participant_details(user_id):
+    """Get participant name and profile picture from either user or therapist collection"""
+    # Convert to string if ObjectId
+    if isinstance(user_id, ObjectId):
+        user_id = str(user_id)
+
+    return participant_card(user_id, User.find_by_id(user_id))
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def send_message(request, conversation_id):
@@ -308,6 +315,15 @@ def send_message(request, conversation_id):
         )
 
         message_id = message.save()
+        if not message_id:
+            return JsonResponse({
+                "success": False,
+                "message": "Message could not be saved"
+            }, status=500)
+
+        # Sockets serve history from the message cache; add it here, reload it elsewhere
+        message_cache.add(message.to_dict())
+        publish_conversation_change(conversation_id)
 
         return JsonResponse({
             "success": True,
@@ -324,6 +340,28 @@ def send_message(request, conversation_id):
         }, status=500)
 
 
+def user_participant_ids(current_user):
+    """Ids a user may be stored under in conversation participants: the user id, plus the therapist id of therapists"""
+    user_id = str(current_user.get("_id"))
+    participant_ids = [user_id]  # Start with user_id
+
+    # If user is a therapist, also search for their therapist_id
+    if current_user.get("role", "user") == "therapist":
+        # First check if therapist_id is already in user document
+        therapist_id = current_user.get("therapist_id")
+
+        # If not, look it up in therapists collection
+        if not therapist_id:
+            from apps.therapists.models import Therapist
+            therapist = Therapist.find_by_user_id(user_id)
+            if therapist:
+                therapist_id = str(therapist.get("_id"))
+
+        if therapist_id:
+            participant_ids.append(str(therapist_id))
+    return participant_ids
+
+
 @require_http_methods(["GET"])
 def get_conversations(request):
     """Get all conversations for current user"""
@@ -341,87 +379,30 @@ def get_conversations(request):
         limit = int(request.GET.get('limit', 20))
         skip = int(request.GET.get('skip', 0))
 
-        # Special handling for therapists - they might be referenced by therapist_id
-        user_role = current_user.get("role", "user")
-        participant_ids = [user_id]  # Start with user_id
-
-        # If user is a therapist, also search for their therapist_id
-        if user_role == "therapist":
-            # First check if therapist_id is already in user document
-            therapist_id = current_user.get("therapist_id")
-
-            # If not, look it up in therapists collection
-            if not therapist_id:
-                from apps.therapists.models import Therapist
-                therapist = Therapist.find_by_user_id(user_id)
-                if therapist:
-                    therapist_id = str(therapist.get("_id"))
-
-            # Add therapist_id to search if found
-            if therapist_id:
-                participant_ids.append(str(therapist_id))
-                print(
-                    f"Adding therapist ID {therapist_id} to conversation search")
-
-        # Get conversations where user is a participant (by any ID)
-        conversations = []
-        for participant_id in participant_ids:
-            convs = Conversation.find_by_participant(
-                participant_id=participant_id,
-                limit=limit,
-                skip=skip
-            )
-            conversations.extend(convs)
-
-        # Remove duplicates (in case some conversations were found through both IDs)
-        unique_conversations = {}
-        for conv in conversations:
-            conv_id = str(conv.get("_id"))
-            if conv_id not in unique_conversations:
-                unique_conversations[conv_id] = conv
-
-        conversations = list(unique_conversations.values())
+        # Therapists may be referenced by therapist_id
+        participant_ids = user_participant_ids(current_user)
 
-        # Sort by updated_at
-        conversations.sort(key=lambda x: x.get(
-            "updated_at", datetime.min), reverse=True)
+        # One aggregation: the page of conversations with the other participant joined in
+        conversations = Conversation.list_cards(participant_ids, limit=limit, skip=skip)
 
-        # Truncate to limit if needed
-        if len(conversations) > limit:
-            conversations = conversations[:limit]
+        # Live presence of every other participant on the page, in one registry call.
+        # Connections register under the user id, so therapist ids go through their user
+        presence_ids = {str(conv["_id"]): str((conv.get("other_user") or {}).get("_id") or conv.get("other_participant_id"))
+                        for conv in conversations if conv.get("other_participant_id")}
+        statuses = presence_registry.get_status(list(presence_ids.values()))
 
-        # Add additional data for each conversation
         for conv in conversations:
-            participants = conv.get("participants", [])
-
-            # Find the other participant (not the current user or their therapist ID)
-            other_user_id = None
-            for p in participants:
-                if p not in participant_ids:
-                    other_user_id = p
-                    break
+            unread_counts = conv.pop("unread_counts", None) or {}
+            conv["unread_count"] = sum(unread_counts.get(pid, 0) for pid in participant_ids)
 
+            other_user_id = conv.get("other_participant_id")
+            other_user = conv.pop("other_user", None)
             if other_user_id:
-                # Get complete user details instead of just the name
-                other_user = get_participant_details(other_user_id)
-
-                first_name = other_user.get('first_name', '')
-                last_name = other_user.get('last_name', '')
-
-                # If both first and last name are empty, try username (for therapists)
-                if not first_name and not last_name and other_user.get('username'):
-                    # Already parsed in get_participant_details
-                    pass
-
-                # Add recipient details to conversation
-                conv["recipient_name"] = f"{first_name} {last_name}".strip(
-                ) or other_user.get('username', 'Unknown User')
-                conv["recipient_picture"] = other_user.get(
-                    'profile_picture', '')
-                conv["recipient_status"] = other_user.get('status', 'offline')
-
-                print(
-                    f"Found other participant {other_user_id}: {conv['recipient_name']}")
+                details = participant_card(other_user_id, other_user)
+                conv["recipient_name"] = f"{details['first_name']} {details['last_name']}".strip(
+                ) or details.get('username', 'Unknown User')
+                conv["recipient_picture"] = details.get('profile_picture', '')
+                conv["recipient_status"] = statuses.get(presence_ids.get(str(conv["_id"])), 'offline')
 
         # Convert ObjectIds to strings for JSON serialization
         result = [convert_object_ids(conv) for conv in conversations]
@@ -516,9 +497,19 @@ def get_conversation_history(request, conversation_id):
                 "message": f"Access denied to conversation {conversation_id}. User IDs: {participant_ids}, participants: {conversation_participants}"
             }, status=403)
 
-        # Get messages - rest of the code remains unchanged
-        messages = Message.get_messages_by_conversation(
-            conversation_id, limit, skip)
+        # Keyset page when scrolling back by sequence, legacy skip/limit otherwise
+        before_sequence = request.GET.get("before_sequence")
+        if before_sequence is not None:
+            if not before_sequence.isdigit():
+                return JsonResponse({
+                    "success": False,
+                    "message": "before_sequence must be a positive integer"
+                }, status=400)
+            messages = Message.get_messages_before(
+                conversation_id, int(before_sequence), limit)
+        else:
+            messages = Message.get_messages_by_conversation(
+                conversation_id, limit, skip)
 
         # Standardize message format
         formatted_messages = []
@@ -539,7 +530,9 @@ def get_conversation_history(request, conversation_id):
         return JsonResponse({
             "success": True,
             "messages": formatted_messages,
-            "conversation": convert_object_ids(conversation)
+            "conversation": convert_object_ids(conversation),
+            # Pass as before_sequence to get the preceding page
+            "before_sequence": messages[0].get("sequence") if messages else None
         })
 
     except Exception as e:
@@ -610,10 +603,8 @@ def get_unread_count(request):
                 "message": "Authentication required"
             }, status=401)
 
-        user_id = str(current_user.get("_id"))
-
-        # Get unread count
-        count = Message.get_unread_count(user_id)
+        # Counters are kept under every id the user takes part as, like get_conversations sums them
+        count = Message.get_unread_count(user_participant_ids(current_user))
 
         return JsonResponse({
             "success": True,
@@ -627,6 +618,20 @@ def get_unread_count(request):
         }, status=500)
 
 
+def publish_conversation_change(conversation_id):
+    """Have the other processes drop their cached messages of a conversation changed over REST"""
+    async_to_sync(message_cache.publish)(get_channel_layer(), conversation_id)
+
+
+def sync_read_state(conversation_id, reader_id, message_ids):
+    """
+    Apply messages read over REST to this process's message cache and have
+    the other processes drop their copy, as the websocket read path does
+    """
+    message_cache.mark_read(conversation_id, reader_id, message_ids=message_ids)
+    publish_conversation_change(conversation_id)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def mark_as_read(request, message_id):
@@ -641,7 +646,11 @@ def mark_as_read(request, message_id):
             }, status=401)
 
         # Mark as read
-        Message.mark_as_read(message_id)
+        reader_id = str(current_user.get("_id"))
+        if Message.mark_as_read(message_id, reader_id):
+            message = Message.find_by_id(message_id)
+            if message:
+                sync_read_state(message["conversation_id"], reader_id, [message_id])
 
         return JsonResponse({
             "success": True,
@@ -692,15 +701,19 @@ def delete_message(request, message_id):
 
         user_id = str(current_user.get("_id"))
 
-        # Delete message
-        result = Message.delete_message(message_id, user_id)
-
-        if result.deleted_count == 0:
+        # Soft delete, as over the websocket, so syncing clients see it in their changes
+        message = Message.find_by_id(message_id)
+        if not message or not Message.soft_delete(message_id, user_id):
             return JsonResponse({
                 "success": False,
                 "message": "Message not found or you're not authorized to delete it"
             }, status=404)
 
+        now = datetime.utcnow()
+        message_cache.update(message_id, lambda cached: cached.update(
+            is_deleted=True, deleted_at=now, updated_at=now, content="[This message was deleted]"))
+        publish_conversation_change(message["conversation_id"])
+
         return JsonResponse({
             "success": True,
             "message": "Message deleted successfully"
@@ -765,8 +778,8 @@ def get_plan_messages(request, plan_id):
         # Mark messages as read
         message_ids = [msg["_id"] for msg in messages
                        if msg["sender_id"] != user_id and not msg["read"]]
-        if message_ids:
-            Message.mark_as_read(message_ids, user_id)
+        if message_ids and Message.mark_as_read(message_ids, user_id):
+            sync_read_state(conversation["_id"], user_id, message_ids)
 
         return JsonResponse({
             "success": True,
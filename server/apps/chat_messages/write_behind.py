@@ -0,0 +1,94 @@
+import os
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+from pymongo import InsertOne
+
+from apps.emotions.write_buffer import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+# Broadcast chat messages before they are stored, persisting them in batches
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+
+# Chat batches are small and frequent: delivery is immediate, but "persisted" acks wait for the flush
+CHAT_WRITE_BATCH_SIZE = int(os.environ.get("CHAT_WRITE_BATCH_SIZE", 200))
+CHAT_WRITE_FLUSH_SECONDS = float(os.environ.get("CHAT_WRITE_FLUSH_SECONDS", 0.25))
+CHAT_WRITE_MAX_PENDING = int(os.environ.get("CHAT_WRITE_MAX_PENDING", 50000))
+
+# Acknowledgement states sent to the sender
+ACK_DELIVERED = "delivered"    # Broadcast to the conversation; held in this process's memory only
+ACK_PERSISTED = "persisted"    # Stored in MongoDB
+ACK_FAILED = "failed"          # Could not be stored; the client should resend
+
+
+class ChatPersistence:
+    """
+    Per-process write-behind writer for chat messages.
+
+    Message inserts are queued on a WriteBehindBuffer and written in
+    batches. A message's conversation updates (last message, unread
+    counters) are queued only once its insert has landed, so a dropped
+    message never shows up in badges or previews. queue() returns a Future
+    that resolves to True once the message insert is in MongoDB, or False
+    if it was dropped (buffer full, write rejected).
+    """
+
+    def __init__(self):
+        self._waiting = {}   # id() of a queued InsertOne -> (Future, conversation operations)
+        self._lock = threading.Lock()
+        self.buffer = WriteBehindBuffer(
+            batch_size=CHAT_WRITE_BATCH_SIZE,
+            flush_seconds=CHAT_WRITE_FLUSH_SECONDS,
+            max_pending=CHAT_WRITE_MAX_PENDING,
+            on_written=self._written,
+            on_dropped=self._dropped,
+            name="chat-write-buffer"
+        )
+
+    def queue(self, message, conversation_operations):
+        """ Queue a message document (with _id and sequence set) and its conversation updates """
+        persisted = Future()
+        insert = InsertOne(message)
+        with self._lock:
+            self._waiting[id(insert)] = (persisted, list(conversation_operations))
+
+        self.buffer.write("messages", insert)
+        return persisted
+
+    def _resolve(self, operations, stored):
+        """ Settle the futures of message inserts; returns the conversation updates they carried """
+        with self._lock:
+            waiting = [self._waiting.pop(id(operation), None) for operation in operations]
+        follow_ups = []
+        for entry in waiting:
+            if entry is None:
+                continue
+            future, conversation_operations = entry
+            follow_ups.extend(conversation_operations)
+            if not future.done():
+                future.set_result(stored)
+        return follow_ups
+
+    def _written(self, collection_name, operations):
+        if collection_name == "messages":
+            # The messages exist now; their conversation updates follow in the next batch
+            for operation in self._resolve(operations, True):
+                self.buffer.write("conversations", operation)
+
+    def _dropped(self, collection_name, operations):
+        if collection_name == "messages":
+            logger.error(f"Dropped {len(operations)} chat messages before they were stored")
+            self._resolve(operations, False)
+
+    def flush(self):
+        return self.buffer.flush()
+
+    def pending(self):
+        return self.buffer.pending()
+
+
+chat_persistence = ChatPersistence()
+atexit.register(chat_persistence.buffer.close)
@@ -0,0 +1,106 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the rendered charts (base64 data URIs) kept per process
+CHART_CACHE_MAX_BYTES = int(os.environ.get("CHART_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+class ChartCache:
+    """
+    In-process LRU cache of rendered charts keyed by (analysis id, viz type, size).
+
+    Analyses are immutable once saved, so entries only have to be dropped when
+    an analysis is deleted.
+    """
+
+    def __init__(self, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(analysis_id, viz_type, size=None):
+        return (str(analysis_id), viz_type, tuple(size) if size else None)
+
+    def get(self, key):
+        with self._lock:
+            chart = self._entries.get(key)
+            if chart is not None:
+                self._entries.move_to_end(key)
+            return chart
+
+    def put(self, key, chart):
+        size = len(chart)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self._entries[key] = chart
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def pending(self, key, submit):
+        """
+        Future for a chart being rendered, submitting it if nobody has yet.
+
+        Concurrent requests for the same chart share one render; the result
+        is cached when the future completes.
+        """
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pending[key] = submit()
+
+        def store(done):
+            with self._lock:
+                self._pending.pop(key, None)
+            if not done.cancelled() and done.exception() is None and done.result():
+                self.put(key, done.result())
+
+        future.add_done_callback(store)
+        return future
+
+    def invalidate(self, analysis_id):
+        """ Drop every cached chart of an analysis """
+        analysis_id = str(analysis_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == analysis_id]:
+                self.total_bytes -= len(self._entries.pop(key))
+
+
+chart_cache = ChartCache()
+
+
+def get_or_render_chart(analysis, viz_type, size=None):
+    """ Return the cached chart for an analysis or render it on the chart render pool """
+    from apps.utils.emotion_analysis.visualization_generator import get_chart_spec, get_stored_chart
+    from apps.utils.emotion_analysis.render_pool import submit_chart, wait_for_chart
+
+    key = ChartCache.make_key(analysis["_id"], viz_type, size)
+    chart = chart_cache.get(key)
+    if chart is not None:
+        return chart
+
+    stored = get_stored_chart(analysis, viz_type, size)
+    if stored:
+        return stored
+
+    spec = get_chart_spec(analysis, viz_type, size)
+    if not spec:
+        return None
+
+    chart_name, kwargs = spec
+    future = chart_cache.pending(key, lambda: submit_chart(chart_name, kwargs))
+    # Shared with concurrent requests: a timeout here must not cancel their render
+    return wait_for_chart(future, chart_name, kwargs, cancel_on_timeout=False)
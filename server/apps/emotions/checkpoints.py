@@ -0,0 +1,96 @@
+import os
+import sys
+import logging
+from datetime import datetime
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+logger = logging.getLogger(__name__)
+
+# Analysis Checkpoints Collection
+analysis_checkpoints_collection = db["analysis_checkpoints"]
+
+try:
+    analysis_checkpoints_collection.create_index(
+        [("job_id", 1), ("segment_index", 1)], unique=True
+    )
+except Exception as e:
+    logger.warning(f"Could not create analysis checkpoint indexes: {str(e)}")
+
+
+class AnalysisCheckpoint:
+    """
+    Segment-wise checkpoint store for ``analyze_video``.
+
+    Each segment document holds the frames, timeline points and samples
+    analyzed since the previous segment together with the running counters,
+    so a restarted job can rebuild the partial state and continue after the
+    last processed timestamp.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.next_index = 0
+
+    def load(self, signature):
+        """ Merge all saved segments, or return None if there is nothing to resume """
+        segments = list(analysis_checkpoints_collection.find(
+            {"job_id": self.job_id}
+        ).sort("segment_index", 1))
+
+        if not segments:
+            return None
+
+        # Checkpoints from a different sampling of the video cannot be reused
+        if any(segment.get("signature") != signature for segment in segments):
+            logger.info(f"Discarding stale checkpoints for job {self.job_id}")
+            AnalysisCheckpoint.clear(self.job_id)
+            return None
+
+        merged = {
+            "frames": [],
+            "timeline": {},
+            "emotion_samples": {},
+            "valences": [],
+            "engagements": []
+        }
+        for segment in segments:
+            merged["frames"].extend(segment["frames"])
+            merged["valences"].extend(segment["valences"])
+            merged["engagements"].extend(segment["engagements"])
+            for emotion, points in segment["timeline"].items():
+                merged["timeline"].setdefault(emotion, []).extend(points)
+            for emotion, probs in segment["emotion_samples"].items():
+                merged["emotion_samples"].setdefault(emotion, []).extend(probs)
+
+        # Counters and smoothing state come from the most recent segment
+        last = segments[-1]
+        for key in ("processed", "last_timestamp", "face_count_total",
+                    "frames_with_faces", "recent_emotions"):
+            merged[key] = last[key]
+
+        self.next_index = last["segment_index"] + 1
+        return merged
+
+    def save_segment(self, signature, segment):
+        """ Persist one segment; re-saving an index after a crash overwrites it """
+        document = dict(segment)
+        document.update({
+            "job_id": self.job_id,
+            "signature": signature,
+            "segment_index": self.next_index,
+            "created_at": datetime.utcnow()
+        })
+        analysis_checkpoints_collection.replace_one(
+            {"job_id": self.job_id, "segment_index": self.next_index},
+            document,
+            upsert=True
+        )
+        self.next_index += 1
+
+    @staticmethod
+    def clear(job_id):
+        """ Remove all checkpoints for a job """
+        return analysis_checkpoints_collection.delete_many({"job_id": job_id})
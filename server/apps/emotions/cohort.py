@@ -0,0 +1,195 @@
+import logging
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from apps.emotions.rollups import emotion_rollups_collection, day_start, EMOTION_LABELS
+
+logger = logging.getLogger(__name__)
+
+NEGATIVE_EMOTIONS = ('angry', 'disgust', 'fear', 'sad')
+
+# A day counts towards a negative streak when negative emotions average above this
+NEGATIVE_DAY_THRESHOLD = 0.5
+
+# Daily valence change (per day) treated as a real trend
+VALENCE_SLOPE_THRESHOLD = 0.01
+
+# Clients flagged for attention
+AT_RISK_STREAK_DAYS = 3
+AT_RISK_STABILITY = 0.3
+
+MS_PER_DAY = 24 * 3600 * 1000
+
+
+def _ratio(numerator, denominator):
+    return {"$cond": [{"$gt": [denominator, 0]}, {"$divide": [numerator, denominator]}, 0]}
+
+
+def _daily_stages(start):
+    """ Per-day means and the day index (x) used by the regression """
+    negative_sum = {"$add": [{"$ifNull": [f"$emotions.{emotion}.sum", 0]} for emotion in NEGATIVE_EMOTIONS]}
+    return [
+        {"$addFields": {
+            "x": {"$divide": [{"$subtract": ["$day", start]}, MS_PER_DAY]},
+            "y": _ratio("$valence.sum", "$count"),
+            "negative": _ratio(negative_sum, "$count")
+        }},
+        {"$sort": {"user_id": 1, "day": 1}}
+    ]
+
+
+def _client_group():
+    group = {
+        "_id": "$user_id",
+        "analyses": {"$sum": "$count"},
+        "active_days": {"$sum": 1},
+        "last_active": {"$max": "$day"},
+        "valence_sum": {"$sum": "$valence.sum"},
+        "valence_min": {"$min": "$valence.min"},
+        "valence_max": {"$max": "$valence.max"},
+        "engagement_sum": {"$sum": "$engagement.sum"},
+        # Sums for the least-squares slope and the spread of daily valence
+        "sx": {"$sum": "$x"},
+        "sy": {"$sum": "$y"},
+        "sxx": {"$sum": {"$multiply": ["$x", "$x"]}},
+        "sxy": {"$sum": {"$multiply": ["$x", "$y"]}},
+        "syy": {"$sum": {"$multiply": ["$y", "$y"]}},
+        # Ordered by day thanks to the preceding $sort
+        "days": {"$push": {"x": "$x", "negative": {"$gt": ["$negative", NEGATIVE_DAY_THRESHOLD]}}}
+    }
+    group.update({f"emotion_{emotion}": {"$sum": f"$emotions.{emotion}.sum"} for emotion in EMOTION_LABELS})
+    return group
+
+
+def _streaks():
+    """ Longest and latest runs of consecutive negative days """
+    return {"$reduce": {
+        "input": "$days",
+        "initialValue": {"current": 0, "longest": 0, "last_x": None},
+        "in": {"$let": {
+            "vars": {"current": {"$cond": [
+                "$$this.negative",
+                {"$cond": [{"$eq": ["$$value.last_x", {"$subtract": ["$$this.x", 1]}]},
+                           {"$add": ["$$value.current", 1]}, 1]},
+                0
+            ]}},
+            "in": {
+                "current": "$$current",
+                "longest": {"$max": ["$$value.longest", "$$current"]},
+                "last_x": "$$this.x"
+            }
+        }}
+    }}
+
+
+def _client_projection():
+    n = "$active_days"
+    slope_denominator = {"$subtract": [{"$multiply": [n, "$sxx"]}, {"$multiply": ["$sx", "$sx"]}]}
+    variance = {"$max": [0, {"$subtract": [_ratio("$syy", n), {"$pow": [_ratio("$sy", n), 2]}]}]}
+
+    projection = {
+        "_id": 0,
+        "user_id": "$_id",
+        "analyses": 1,
+        "active_days": 1,
+        "last_active": 1,
+        "avg_valence": _ratio("$valence_sum", "$analyses"),
+        "min_valence": "$valence_min",
+        "max_valence": "$valence_max",
+        "avg_engagement": _ratio("$engagement_sum", "$analyses"),
+        "emotions": {emotion: _ratio(f"$emotion_{emotion}", "$analyses") for emotion in EMOTION_LABELS},
+        "valence_slope": {"$cond": [
+            {"$and": [{"$gt": [n, 1]}, {"$ne": [slope_denominator, 0]}]},
+            {"$divide": [{"$subtract": [{"$multiply": [n, "$sxy"]}, {"$multiply": ["$sx", "$sy"]}]},
+                         slope_denominator]},
+            0
+        ]},
+        # Same scale as EmotionTrendAnalyzer: 1 - 2 * std of (daily) valence
+        "stability": {"$max": [0, {"$min": [1, {"$subtract": [1, {"$multiply": [2, {"$sqrt": variance}]}]}]}]},
+        "negative_days": {"$size": {"$filter": {"input": "$days", "cond": "$$this.negative"}}},
+        "streaks": _streaks()
+    }
+    return projection
+
+
+def cohort_pipeline(client_ids, start):
+    """
+    One aggregation over the daily rollups: per-client statistics plus the
+    cohort summary, via $facet
+    """
+    client_stats = [
+        {"$group": _client_group()},
+        {"$project": _client_projection()},
+        {"$addFields": {
+            "longest_negative_streak": "$streaks.longest",
+            "current_negative_streak": "$streaks.current"
+        }},
+        {"$project": {"streaks": 0}}
+    ]
+
+    cohort_summary = {
+        "_id": None,
+        "clients": {"$sum": 1},
+        "analyses": {"$sum": "$analyses"},
+        "avg_valence": {"$avg": "$avg_valence"},
+        "avg_engagement": {"$avg": "$avg_engagement"},
+        "avg_stability": {"$avg": "$stability"},
+        "avg_valence_slope": {"$avg": "$valence_slope"},
+        "improving": {"$sum": {"$cond": [{"$gt": ["$valence_slope", VALENCE_SLOPE_THRESHOLD]}, 1, 0]}},
+        "declining": {"$sum": {"$cond": [{"$lt": ["$valence_slope", -VALENCE_SLOPE_THRESHOLD]}, 1, 0]}},
+        "at_risk": {"$sum": {"$cond": [{"$or": [
+            {"$gte": ["$current_negative_streak", AT_RISK_STREAK_DAYS]},
+            {"$lt": ["$stability", AT_RISK_STABILITY]}
+        ]}, 1, 0]}}
+    }
+    cohort_summary.update({emotion: {"$avg": f"$emotions.{emotion}"} for emotion in EMOTION_LABELS})
+
+    return [
+        {"$match": {
+            "user_id": {"$in": client_ids},
+            "session_id": None,
+            "day": {"$gte": start}
+        }},
+        *_daily_stages(start),
+        *client_stats,
+        {"$facet": {
+            "clients": [{"$sort": {"avg_valence": 1}}],
+            "cohort": [{"$group": cohort_summary}, {"$project": {"_id": 0}}]
+        }}
+    ]
+
+
+def _trend_label(slope):
+    if slope > VALENCE_SLOPE_THRESHOLD:
+        return "improving"
+    if slope < -VALENCE_SLOPE_THRESHOLD:
+        return "declining"
+    return "stable"
+
+
+def compute_cohort_analytics(client_ids, days=90):
+    """
+    Emotion statistics for a therapist's caseload over the last N days.
+
+    Returns {"clients": [...], "cohort": {...}}; clients are sorted by
+    average valence, lowest first, and carry a "valence_trend" label.
+    """
+    client_ids = [ObjectId(client_id) if isinstance(client_id, str) else client_id
+                  for client_id in client_ids]
+    start = day_start(datetime.utcnow() - timedelta(days=days))
+
+    empty_cohort = {"clients": 0, "analyses": 0}
+    if not client_ids:
+        return {"clients": [], "cohort": empty_cohort}
+
+    result = next(emotion_rollups_collection.aggregate(cohort_pipeline(client_ids, start), allowDiskUse=True),
+                  {"clients": [], "cohort": []})
+
+    clients = result["clients"]
+    for client in clients:
+        client["valence_trend"] = _trend_label(client["valence_slope"])
+
+    cohort = result["cohort"][0] if result["cohort"] else empty_cohort
+    cohort["inactive_clients"] = len(client_ids) - len(clients)
+    return {"clients": clients, "cohort": cohort}
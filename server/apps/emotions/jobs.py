@@ -0,0 +1,576 @@
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+logger = logging.getLogger(__name__)
+
+# Analysis Jobs Collection
+analysis_jobs_collection = db["analysis_jobs"]
+
+# Job handlers are imported lazily by the worker so the web tier never loads them
+JOB_HANDLERS = {
+    "emotion_analysis": "apps.emotions.tasks.process_media_upload",
+    "session_recording": "apps.therapy_sessions.tasks.process_session_recording",
+}
+
+# Directory where uploaded files wait for a worker to pick them up
+SPOOL_DIR = os.environ.get(
+    "ANALYSIS_JOB_SPOOL_DIR",
+    os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")), "job_spool")
+)
+
+LEASE_SECONDS = 120           # A running job whose lease lapses is considered orphaned
+LEASE_RENEW_SECONDS = 30      # The worker running a job renews its lease this often
+PROGRESS_WRITE_INTERVAL = 2.0  # Seconds between progress writes to Mongo
+RETRY_BACKOFF_SECONDS = [10, 60, 300]
+INPUT_RETENTION_HOURS = 24     # Failed/cancelled jobs stay retryable this long
+PURGE_INTERVAL_SECONDS = 600
+
+try:
+    analysis_jobs_collection.create_index([("status", 1), ("run_after", 1), ("created_at", 1)])
+    analysis_jobs_collection.create_index([("user_id", 1), ("created_at", -1)])
+except Exception as e:
+    logger.warning(f"Could not create analysis job indexes: {str(e)}")
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a handler when the job has been cancelled by the user.
+
+    Derives from BaseException so the broad ``except Exception`` blocks in the
+    analysis pipeline let it through instead of turning it into an error result.
+    """
+    pass
+
+
+class JobLeaseLost(BaseException):
+    """
+    Raised inside a handler when another worker has taken the job over
+    (this worker's lease lapsed); the new owner's state must not be touched.
+    """
+    pass
+
+
+def _owned(job_id, worker_id):
+    """ Filter matching a job only while `worker_id` still runs it """
+    return {"_id": job_id, "status": JobStatus.RUNNING, "worker_id": worker_id}
+
+
+class AnalysisJob:
+    def __init__(self, job_type, user_id, payload=None, max_attempts=3):
+        self.job_type = job_type  # key into JOB_HANDLERS
+        self.user_id = user_id
+        self.payload = payload or {}  # handler arguments (spooled file path, ids, ...)
+        self.status = JobStatus.QUEUED
+        self.progress = {
+            "percent": 0,
+            "stage": "queued",
+            "eta_seconds": None
+        }
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.cancel_requested = False
+        self.result = None
+        self.error = None
+        self.worker_id = None
+        self.lease_expires_at = None
+        self.created_at = datetime.utcnow()
+        self.run_after = self.created_at
+        self.started_at = None
+        self.finished_at = None
+        self.updated_at = self.created_at
+
+    def save(self):
+        """ Save job to MongoDB """
+        job_data = self.__dict__
+        result = analysis_jobs_collection.insert_one(job_data)
+        return result.inserted_id
+
+    @staticmethod
+    def find_by_id(job_id):
+        """ Find job by ID """
+        from bson.objectid import ObjectId
+        if isinstance(job_id, str):
+            job_id = ObjectId(job_id)
+        return analysis_jobs_collection.find_one({"_id": job_id})
+
+    @staticmethod
+    def request_cancel(job_id, user_id=None):
+        """ Cancel a queued job immediately, or flag a running job for cancellation """
+        from bson.objectid import ObjectId
+        if isinstance(job_id, str):
+            job_id = ObjectId(job_id)
+
+        query = {"_id": job_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+
+        now = datetime.utcnow()
+        # Queued jobs can be cancelled without involving a worker
+        job = analysis_jobs_collection.find_one_and_update(
+            dict(query, status=JobStatus.QUEUED),
+            {"$set": {
+                "status": JobStatus.CANCELLED,
+                "cancel_requested": True,
+                "finished_at": now,
+                "updated_at": now,
+                "progress.stage": "cancelled"
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            return job
+
+        # Running jobs notice the flag on their next progress report
+        return analysis_jobs_collection.find_one_and_update(
+            dict(query, status=JobStatus.RUNNING),
+            {"$set": {"cancel_requested": True, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    def retry(job_id, user_id=None):
+        """ Put a failed or cancelled job back on the queue, resuming from any checkpoints """
+        from bson.objectid import ObjectId
+        if isinstance(job_id, str):
+            job_id = ObjectId(job_id)
+
+        query = {
+            "_id": job_id,
+            "status": {"$in": [JobStatus.FAILED, JobStatus.CANCELLED]},
+            "inputs_purged": {"$ne": True}
+        }
+        if user_id is not None:
+            query["user_id"] = user_id
+
+        job = analysis_jobs_collection.find_one(query)
+        if not job:
+            return None
+
+        # The input has to still be on disk for a retry to make sense
+        spooled = job.get("payload", {}).get("file_path")
+        if spooled and not os.path.exists(spooled):
+            return None
+
+        now = datetime.utcnow()
+        return analysis_jobs_collection.find_one_and_update(
+            query,
+            {"$set": {
+                "status": JobStatus.QUEUED,
+                "cancel_requested": False,
+                "error": None,
+                "run_after": now,
+                "updated_at": now,
+                "finished_at": None,
+                "progress": {"percent": 0, "stage": "queued", "eta_seconds": None}
+            },
+             "$inc": {"max_attempts": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    def claim_next(worker_id):
+        """
+        Atomically claim the oldest runnable job, including jobs orphaned by a
+        dead worker while they have attempts left
+        """
+        now = datetime.utcnow()
+        return analysis_jobs_collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": JobStatus.QUEUED, "run_after": {"$lte": now}},
+                    {"status": JobStatus.RUNNING, "lease_expires_at": {"$lt": now},
+                     "$expr": {"$lt": ["$attempts", "$max_attempts"]}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": JobStatus.RUNNING,
+                    "worker_id": worker_id,
+                    "started_at": now,
+                    "updated_at": now,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+                    "progress.stage": "starting"
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    def fail_exhausted_orphans():
+        """
+        Fail orphaned jobs that used up their attempts, e.g. a job that keeps
+        killing its worker; claim_next no longer picks them up
+        """
+        now = datetime.utcnow()
+        result = analysis_jobs_collection.update_many(
+            {
+                "status": JobStatus.RUNNING,
+                "lease_expires_at": {"$lt": now},
+                "$expr": {"$gte": ["$attempts", "$max_attempts"]}
+            },
+            {"$set": {
+                "status": JobStatus.FAILED,
+                "error": "The worker running this job stopped responding on every attempt",
+                "finished_at": now,
+                "updated_at": now,
+                "lease_expires_at": None,
+                "progress.stage": "failed",
+                "progress.eta_seconds": None
+            }}
+        )
+        return result.modified_count
+
+    @staticmethod
+    def renew_lease(job_id, worker_id):
+        """ Extend the lease of a running job; False if the worker no longer owns it """
+        result = analysis_jobs_collection.update_one(
+            _owned(job_id, worker_id),
+            {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)}}
+        )
+        return result.matched_count > 0
+
+    @staticmethod
+    def mark_succeeded(job_id, result, worker_id):
+        now = datetime.utcnow()
+        return analysis_jobs_collection.update_one(
+            _owned(job_id, worker_id),
+            {"$set": {
+                "status": JobStatus.SUCCEEDED,
+                "result": result,
+                "finished_at": now,
+                "updated_at": now,
+                "lease_expires_at": None,
+                "progress": {"percent": 100, "stage": "done", "eta_seconds": 0}
+            }}
+        ).matched_count > 0
+
+    @staticmethod
+    def mark_cancelled(job_id, worker_id):
+        now = datetime.utcnow()
+        analysis_jobs_collection.update_one(
+            _owned(job_id, worker_id),
+            {"$set": {
+                "status": JobStatus.CANCELLED,
+                "finished_at": now,
+                "updated_at": now,
+                "lease_expires_at": None,
+                "progress.stage": "cancelled",
+                "progress.eta_seconds": None
+            }}
+        )
+
+    @staticmethod
+    def mark_failed(job, error):
+        """ Requeue with backoff while attempts remain, otherwise fail permanently """
+        now = datetime.utcnow()
+        if job.get("attempts", 0) < job.get("max_attempts", 1):
+            backoff_index = min(job.get("attempts", 1) - 1, len(RETRY_BACKOFF_SECONDS) - 1)
+            analysis_jobs_collection.update_one(
+                _owned(job["_id"], job["worker_id"]),
+                {"$set": {
+                    "status": JobStatus.QUEUED,
+                    "error": error,
+                    "run_after": now + timedelta(seconds=RETRY_BACKOFF_SECONDS[backoff_index]),
+                    "updated_at": now,
+                    "lease_expires_at": None,
+                    "progress.stage": "retrying",
+                    "progress.eta_seconds": None
+                }}
+            )
+            return False
+
+        analysis_jobs_collection.update_one(
+            _owned(job["_id"], job["worker_id"]),
+            {"$set": {
+                "status": JobStatus.FAILED,
+                "error": error,
+                "finished_at": now,
+                "updated_at": now,
+                "lease_expires_at": None,
+                "progress.stage": "failed",
+                "progress.eta_seconds": None
+            }}
+        )
+        return True
+
+
+class JobProgress:
+    """
+    Progress reporter handed to job handlers.
+
+    Handlers call ``update(percent, stage)``; writes to Mongo are throttled,
+    the lease is renewed on every write, and a pending cancellation request
+    surfaces as ``JobCancelled`` so handlers stop at the next checkpoint.
+    A job taken over by another worker surfaces as ``JobLeaseLost``.
+    """
+
+    def __init__(self, job):
+        self.job_id = job["_id"]
+        self.worker_id = job["worker_id"]
+        self.job = job
+        self.started = time.monotonic()
+        self._last_write = 0.0
+        self._percent = 0
+
+    def update(self, percent, stage=None, force=False):
+        self._percent = max(self._percent, min(100, int(percent)))
+
+        now_mono = time.monotonic()
+        if not force and now_mono - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now_mono
+
+        # Estimate time remaining from the average pace so far
+        elapsed = now_mono - self.started
+        eta = None
+        if 0 < self._percent < 100:
+            eta = round(elapsed * (100 - self._percent) / self._percent, 1)
+
+        now = datetime.utcnow()
+        update = {
+            "progress.percent": self._percent,
+            "progress.eta_seconds": eta,
+            "updated_at": now,
+            "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS)
+        }
+        if stage:
+            update["progress.stage"] = stage
+
+        job = analysis_jobs_collection.find_one_and_update(
+            _owned(self.job_id, self.worker_id),
+            {"$set": update},
+            projection={"cancel_requested": 1}
+        )
+        if job is None:
+            raise JobLeaseLost()
+        if job.get("cancel_requested"):
+            raise JobCancelled()
+
+    def stage(self, stage, percent=None):
+        """ Record a stage transition immediately """
+        self.update(self._percent if percent is None else percent, stage=stage, force=True)
+
+    def check_cancelled(self):
+        self.update(self._percent)
+
+    def scaled(self, start, end):
+        """ Callback mapping a sub-task's (done, total) onto a slice of overall progress """
+        def callback(done, total):
+            if total:
+                self.update(start + (end - start) * done / total)
+        return callback
+
+
+def enqueue_job(job_type, user_id, payload, max_attempts=3):
+    """ Create a queued job and return its id """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    job = AnalysisJob(job_type, user_id, payload=payload, max_attempts=max_attempts)
+    return job.save()
+
+
+def spool_upload(uploaded_file, suffix=""):
+    """
+    Stream an uploaded file into the spool directory so a worker process can read it.
+
+    Returns (path, content_hash); the SHA-256 is computed while the chunks are
+    written and keys the analysis result cache.
+    """
+    import uuid
+    import hashlib
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}{suffix}")
+    digest = hashlib.sha256()
+    with open(path, "wb") as spool_file:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            spool_file.write(chunk)
+    return path, digest.hexdigest()
+
+
+def serialize_job(job, include_result=True):
+    """ Convert a job document into a JSON-friendly status payload """
+    from apps.utils.db_helper import convert_object_ids
+    data = {
+        "job_id": str(job["_id"]),
+        "job_type": job.get("job_type"),
+        "status": job.get("status"),
+        "progress": job.get("progress", {}),
+        "attempts": job.get("attempts", 0),
+        "max_attempts": job.get("max_attempts", 0),
+        "cancel_requested": job.get("cancel_requested", False),
+        "error": job.get("error"),
+        "created_at": job["created_at"].isoformat() if job.get("created_at") else None,
+        "started_at": job["started_at"].isoformat() if job.get("started_at") else None,
+        "finished_at": job["finished_at"].isoformat() if job.get("finished_at") else None,
+    }
+    if include_result and job.get("status") == JobStatus.SUCCEEDED:
+        data["result"] = convert_object_ids(job.get("result") or {})
+    return data
+
+
+def _discard_spooled_file(job):
+    from apps.emotions.checkpoints import AnalysisCheckpoint
+    # Checkpoints are only useful while the job can still run again
+    AnalysisCheckpoint.clear(job["_id"])
+
+    path = (job.get("payload") or {}).get("file_path")
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class LeaseHeartbeat:
+    """
+    Renews the lease of a running job from a background thread, so steps that
+    block without reporting progress (uploads, transcodes, a single large
+    image) do not let the lease lapse and hand the job to a second worker
+    """
+
+    def __init__(self, job, interval=LEASE_RENEW_SECONDS):
+        self.job_id = job["_id"]
+        self.worker_id = job["worker_id"]
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.job_id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not AnalysisJob.renew_lease(self.job_id, self.worker_id):
+                    self.lost = True
+                    logger.warning(f"Job {self.job_id} was taken over by another worker")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of job {self.job_id}: {str(e)}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(job):
+    """ Execute a claimed job with its registered handler """
+    from django.utils.module_loading import import_string
+
+    progress = JobProgress(job)
+    try:
+        with LeaseHeartbeat(job):
+            if job.get("cancel_requested"):
+                raise JobCancelled()
+
+            handler = import_string(JOB_HANDLERS[job["job_type"]])
+            result = handler(job, progress)
+
+        if not AnalysisJob.mark_succeeded(job["_id"], result, job["worker_id"]):
+            raise JobLeaseLost()
+        _discard_spooled_file(job)
+        logger.info(f"Job {job['_id']} ({job['job_type']}) succeeded")
+
+    except JobLeaseLost:
+        # Another worker owns the job now; its state is theirs to write
+        logger.warning(f"Job {job['_id']} lost its lease; leaving it to the new owner")
+
+    except JobCancelled:
+        # Input and checkpoints are kept so a retry can pick up where this stopped
+        AnalysisJob.mark_cancelled(job["_id"], job["worker_id"])
+        logger.info(f"Job {job['_id']} cancelled")
+
+    except Exception as e:
+        logger.error(f"Job {job['_id']} failed: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        AnalysisJob.mark_failed(job, str(e))
+
+
+def purge_stale_inputs(max_age_hours=INPUT_RETENTION_HOURS):
+    """ Drop spooled files and checkpoints of jobs that failed or were cancelled long ago """
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    stale_jobs = analysis_jobs_collection.find(
+        {
+            "status": {"$in": [JobStatus.FAILED, JobStatus.CANCELLED]},
+            "finished_at": {"$lt": cutoff},
+            "inputs_purged": {"$ne": True}
+        },
+        projection={"payload.file_path": 1}
+    )
+    purged = 0
+    for job in stale_jobs:
+        _discard_spooled_file(job)
+        analysis_jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"inputs_purged": True}})
+        purged += 1
+    return purged
+
+
+def run_worker(poll_interval=2.0, stop_event=None):
+    """ Claim and run jobs until stopped """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Analysis worker {worker_id} started")
+    last_purge = 0.0
+
+    while stop_event is None or not stop_event.is_set():
+        if time.monotonic() - last_purge > PURGE_INTERVAL_SECONDS:
+            last_purge = time.monotonic()
+            try:
+                purge_stale_inputs()
+            except Exception as e:
+                logger.warning(f"Worker {worker_id} could not purge stale inputs: {str(e)}")
+
+        try:
+            job = AnalysisJob.claim_next(worker_id)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} could not claim a job: {str(e)}")
+            job = None
+
+        if job is None:
+            try:
+                AnalysisJob.fail_exhausted_orphans()
+            except Exception as e:
+                logger.warning(f"Worker {worker_id} could not fail exhausted jobs: {str(e)}")
+            time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+
+    logger.info(f"Analysis worker {worker_id} stopped")
+
+
+def worker_process_main(poll_interval=2.0):
+    """ Entry point for spawned worker processes """
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
+    django.setup()
+    try:
+        run_worker(poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
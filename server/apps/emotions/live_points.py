@@ -0,0 +1,159 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+logger = logging.getLogger(__name__)
+
+LIVE_POINTS_COLLECTION = "emotion_live_points"
+
+# Points older than this are dropped by MongoDB (0 keeps them forever)
+LIVE_POINTS_RETENTION_DAYS = int(os.environ.get("LIVE_POINTS_RETENTION_DAYS", 0))
+
+EMOTION_LABELS = ('angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise')
+
+# Where a point came from: server-side frame analysis or the client's own detector
+SOURCE_FRAME = "frame"
+SOURCE_CLIENT = "client"
+
+
+def _create_collection():
+    """
+    Time-series collection bucketed by (session, user, source). MongoDB stores
+    each bucket's points column-compressed, so a point costs a few dozen bytes
+    instead of a full analysis document.
+    """
+    options = {
+        "timeseries": {"timeField": "ts", "metaField": "meta", "granularity": "seconds"}
+    }
+    if LIVE_POINTS_RETENTION_DAYS:
+        options["expireAfterSeconds"] = LIVE_POINTS_RETENTION_DAYS * 24 * 3600
+
+    try:
+        db.create_collection(LIVE_POINTS_COLLECTION, **options)
+        logger.info(f"Created time-series collection {LIVE_POINTS_COLLECTION}")
+    except CollectionInvalid:
+        pass  # Already exists
+    except OperationFailure as e:
+        # Servers before 5.0 have no time-series collections; a plain one still works
+        logger.warning(f"Could not create time-series collection {LIVE_POINTS_COLLECTION}: {str(e)}")
+
+    collection = db[LIVE_POINTS_COLLECTION]
+    try:
+        collection.create_index([("meta.session_id", 1), ("ts", 1)])
+        collection.create_index([("meta.user_id", 1), ("ts", 1)])
+    except Exception as e:
+        logger.warning(f"Could not create live point indexes: {str(e)}")
+    return collection
+
+
+emotion_live_points_collection = _create_collection()
+
+
+def _object_id(value):
+    return ObjectId(value) if isinstance(value, str) else value
+
+
+def make_point(session_id, user_id, emotions, valence=0, engagement=0,
+               ts=None, offset=None, source=SOURCE_FRAME):
+    """
+    One live emotion point.
+
+    Args:
+        ts: Wall-clock time of the reading (defaults to now, UTC)
+        offset: Seconds since the session started, if known
+    """
+    point = {
+        "ts": ts or datetime.utcnow(),
+        "meta": {
+            "session_id": _object_id(session_id),
+            "user_id": _object_id(user_id),
+            "source": source
+        },
+        "emotions": {emotion: float((emotions or {}).get(emotion, 0)) for emotion in EMOTION_LABELS},
+        "valence": float(valence or 0),
+        "engagement": float(engagement or 0)
+    }
+    if offset is not None:
+        point["offset"] = round(float(offset), 3)
+    return point
+
+
+def queue_point(point):
+    """ Hand a point to the process write-behind buffer """
+    from apps.emotions.write_buffer import emotion_write_buffer
+    return emotion_write_buffer.insert(LIVE_POINTS_COLLECTION, point)
+
+
+# ---------------------------------------------------------------------------
+# Windowed reads
+# ---------------------------------------------------------------------------
+
+POINT_PROJECTION = {"_id": 0, "ts": 1, "offset": 1, "emotions": 1, "valence": 1, "engagement": 1,
+                    "meta.source": 1}
+
+
+def _point_query(session_id=None, user_id=None, start=None, end=None, source=None):
+    query = {}
+    if session_id is not None:
+        query["meta.session_id"] = _object_id(session_id)
+    if user_id is not None:
+        query["meta.user_id"] = _object_id(user_id)
+    if source:
+        query["meta.source"] = source
+    if start or end:
+        query["ts"] = {}
+        if start:
+            query["ts"]["$gte"] = start
+        if end:
+            query["ts"]["$lt"] = end
+    return query
+
+
+def get_session_points(session_id, start=None, end=None, user_id=None, source=None, limit=0):
+    """ Points of a session between start and end, oldest first """
+    return list(emotion_live_points_collection.find(
+        _point_query(session_id, user_id, start, end, source), POINT_PROJECTION
+    ).sort("ts", 1).limit(limit))
+
+
+def get_recent_points(session_id, seconds=60, user_id=None, source=None, now=None):
+    """ Points of the last N seconds of a session """
+    now = now or datetime.utcnow()
+    return get_session_points(session_id, now - timedelta(seconds=seconds), None, user_id, source)
+
+
+def get_session_series(session_id, bucket_seconds=10, start=None, end=None, user_id=None, source=None):
+    """
+    Session averages per time bucket, computed by MongoDB.
+
+    Returns [{"ts", "count", "emotions": {...}, "valence", "engagement"}] oldest first.
+    """
+    group = {
+        "_id": {"$dateTrunc": {"date": "$ts", "unit": "second", "binSize": int(bucket_seconds)}},
+        "count": {"$sum": 1},
+        "valence": {"$avg": "$valence"},
+        "engagement": {"$avg": "$engagement"}
+    }
+    group.update({emotion: {"$avg": f"$emotions.{emotion}"} for emotion in EMOTION_LABELS})
+
+    pipeline = [
+        {"$match": _point_query(session_id, user_id, start, end, source)},
+        {"$group": group},
+        {"$sort": {"_id": 1}}
+    ]
+
+    return [{
+        "ts": bucket["_id"],
+        "count": bucket["count"],
+        "emotions": {emotion: bucket[emotion] for emotion in EMOTION_LABELS},
+        "valence": bucket["valence"],
+        "engagement": bucket["engagement"]
+    } for bucket in emotion_live_points_collection.aggregate(pipeline)]
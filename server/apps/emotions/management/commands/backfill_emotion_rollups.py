@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.emotions.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily emotion rollups from stored analyses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild rollups of this user id')
+        parser.add_argument('--days', type=int,
+                            help='Only rebuild the last N days (default: all history)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Analyses fetched and rollups written per batch')
+
+    def handle(self, *args, **options):
+        start = end = None
+        if options['days'] is not None:
+            if options['days'] < 1:
+                raise CommandError('--days must be at least 1')
+            end = datetime.utcnow()
+            start = end - timedelta(days=options['days'])
+
+        scope = f"user {options['user']}" if options['user'] else 'all users'
+        period = f"the last {options['days']} days" if start else 'all history'
+        self.stdout.write(f'Rebuilding emotion rollups for {scope} over {period}')
+
+        written = rebuild_rollups(options['user'], start, end, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup documents'))
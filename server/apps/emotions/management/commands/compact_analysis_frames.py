@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from apps.emotions.models import emotion_analyses_collection
+from apps.emotions.rollups import EMOTION_LABELS
+from apps.utils.emotion_analysis.timeline import (
+    compact_timeline, decimate_timeline, key_frames, TIMELINE_DISPLAY_POINTS
+)
+
+
+class Command(BaseCommand):
+    help = ('Replaces the per-frame results stored on video analyses with key frames '
+            'and the columnar timeline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Documents fetched per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the analyses that would be compacted')
+
+    def handle(self, *args, **options):
+        query = {"results.frames": {"$exists": True}}
+        if options['dry_run']:
+            self.stdout.write(f"{emotion_analyses_collection.count_documents(query)} analyses store per-frame results")
+            return
+
+        compacted = 0
+        last_id = None
+        while True:
+            # Walk by _id so updated documents are not revisited
+            batch_query = dict(query, _id={"$gt": last_id}) if last_id else query
+            batch = list(emotion_analyses_collection.find(
+                batch_query, {"results.frames": 1, "results.emotion_timeline_full": 1}
+            ).sort("_id", 1).limit(options['batch_size']))
+            if not batch:
+                break
+
+            for document in batch:
+                last_id = document["_id"]
+                frames = document["results"].get("frames") or []
+                updates = {
+                    "results.frames_analyzed": len(frames),
+                    "results.frames_with_faces": sum(1 for frame in frames if frame.get("faces")),
+                    "results.key_frames": key_frames(frames)
+                }
+                if not document["results"].get("emotion_timeline_full") and updates["results.frames_with_faces"]:
+                    full = compact_timeline(frames, EMOTION_LABELS)
+                    updates["results.emotion_timeline_full"] = full
+                    updates["results.overall.emotion_timeline"] = decimate_timeline(full, TIMELINE_DISPLAY_POINTS)
+
+                emotion_analyses_collection.update_one(
+                    {"_id": document["_id"]},
+                    {"$set": updates, "$unset": {"results.frames": ""}}
+                )
+                compacted += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Compacted {compacted} analyses'))
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+
+from database import db
+from apps.utils.artifact_store import ARTIFACT_RESULT_FIELDS, externalize_artifacts
+
+VISUALIZATION_FIELDS = ("analyzed_image", "emotion_graph", "timeline_graph")
+
+
+def _inline_filter(containers):
+    """Documents where any of <prefix>.<field> still holds an inline data URI"""
+    return {"$or": [{f"{prefix}.{field}": {"$regex": "^data:"}}
+                    for prefix, fields in containers.items() for field in fields]}
+
+
+class Command(BaseCommand):
+    help = 'Moves base64 images embedded in analysis and recording documents into the artifact store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Documents fetched per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the documents that would be migrated')
+
+    def handle(self, *args, **options):
+        analysis_containers = {"results": ARTIFACT_RESULT_FIELDS, "visualizations": VISUALIZATION_FIELDS}
+        recording_containers = {"analysis_results": ARTIFACT_RESULT_FIELDS}
+
+        if options['dry_run']:
+            self.stdout.write(
+                f"{db.emotion_analyses.count_documents(_inline_filter(analysis_containers))} analyses and "
+                f"{db.session_recordings.count_documents(_inline_filter(recording_containers))} "
+                f"recordings hold inline images"
+            )
+            return
+
+        migrated, artifacts = self._migrate(db.emotion_analyses, analysis_containers, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Migrated {migrated} analyses ({artifacts} artifacts)'))
+
+        migrated, artifacts = self._migrate(db.session_recordings, recording_containers, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Migrated {migrated} recordings ({artifacts} artifacts)'))
+
+    def _migrate(self, collection, containers, batch_size):
+        query = _inline_filter(containers)
+        projection = {f"{prefix}.{field}": 1 for prefix, fields in containers.items() for field in fields}
+        migrated = artifacts = 0
+        last_id = None
+
+        while True:
+            # Walk by _id so updated documents are not revisited
+            batch_query = dict(query, _id={"$gt": last_id}) if last_id else query
+            batch = list(collection.find(batch_query, projection).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+
+            for document in batch:
+                last_id = document["_id"]
+                updates = {}
+                for prefix, fields in containers.items():
+                    container = document.get(prefix) or {}
+                    written = externalize_artifacts(container, fields)
+                    if written:
+                        artifacts += written
+                        updates.update({f"{prefix}.{field}": container[field]
+                                        for field in fields if field in container})
+                if updates:
+                    collection.update_one({"_id": document["_id"]}, {"$set": updates})
+                    migrated += 1
+
+            self.stdout.write(f'{collection.name}: {migrated} documents migrated so far')
+
+        return migrated, artifacts
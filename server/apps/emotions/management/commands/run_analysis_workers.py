@@ -0,0 +1,53 @@
+import time
+import signal
+import multiprocessing
+from django.core.management.base import BaseCommand
+
+from apps.emotions.jobs import worker_process_main
+
+
+class Command(BaseCommand):
+    help = 'Runs worker processes that execute queued emotion analysis jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Number of worker processes to start')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty')
+
+    def handle(self, *args, **options):
+        # Spawn rather than fork so each worker opens its own MongoDB connection
+        context = multiprocessing.get_context('spawn')
+        workers = []
+
+        for _ in range(max(1, options['workers'])):
+            process = context.Process(target=worker_process_main,
+                                      args=(options['poll_interval'],))
+            process.start()
+            workers.append(process)
+
+        self.stdout.write(self.style.SUCCESS(f'Started {len(workers)} analysis workers'))
+
+        # `kill` (SIGTERM, as start_dev.sh does) stops the pool like Ctrl-C instead of orphaning the workers
+        def stop(signum, frame):
+            raise KeyboardInterrupt()
+        signal.signal(signal.SIGTERM, stop)
+
+        try:
+            # Restart workers that die so the pool keeps its size
+            while True:
+                for i, process in enumerate(workers):
+                    if not process.is_alive():
+                        self.stderr.write(self.style.WARNING(
+                            f'Worker {process.pid} exited with code {process.exitcode}, restarting'))
+                        replacement = context.Process(target=worker_process_main,
+                                                      args=(options['poll_interval'],))
+                        replacement.start()
+                        workers[i] = replacement
+                time.sleep(5)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping analysis workers...')
+            for process in workers:
+                process.terminate()
+            for process in workers:
+                process.join()
@@ -1,14 +1,34 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import os
+import logging
 
 # Ensure we can import database.py
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 from database import db  # Import MongoDB connection
+from apps.utils.pagination import keyset_page, ensure_keyset_index
+from apps.emotions.rollups import (
+    EMOTION_LABELS, ROLLUPS_COLLECTION, record_analysis, rollup_operations, rebuild_rollups,
+    get_daily_rollups, rollup_averages
+)
+
+logger = logging.getLogger(__name__)
 
 # Emotion Analysis Collection
 emotion_analyses_collection = db["emotion_analyses"]
 
+ensure_keyset_index(emotion_analyses_collection, "user_id")
+
+# Fields needed to render an analysis in a history list (no per-frame results)
+ANALYSIS_SUMMARY_PROJECTION = {
+    "media_url": 1,
+    "media_type": 1,
+    "created_at": 1,
+    "results.dominant_emotion": 1,
+    "results.overall.dominant_emotion": 1,
+    "visualizations.analyzed_image": 1
+}
+
 class EmotionAnalysis:
     def __init__(self, user_id, media_url, media_type, session_id=None,
                  results=None, media_metadata=None):
@@ -70,7 +90,25 @@ class EmotionAnalysis:
         """ Save emotion analysis to MongoDB """
         analysis_data = self.__dict__
         result = emotion_analyses_collection.insert_one(analysis_data)
+        
+        # Keep the daily rollups that back trend views current
+        try:
+            record_analysis(self.user_id, self.created_at, self.results, self.session_id)
+        except Exception as e:
+            logger.error(f"Could not update emotion rollups for {result.inserted_id}: {str(e)}")
+        
         return result.inserted_id
+
+    def queue_save(self):
+        """
+        Save through the write-behind buffer (high-volume live snapshots).
+        The document and its rollup updates are written by the next flush.
+        """
+        from apps.emotions.write_buffer import emotion_write_buffer
+        analysis_id = emotion_write_buffer.insert("emotion_analyses", self.__dict__)
+        for operation in rollup_operations(self.user_id, self.created_at, self.results, self.session_id):
+            emotion_write_buffer.write(ROLLUPS_COLLECTION, operation)
+        return analysis_id
     
     def update(self):
         """ Update existing analysis record """
@@ -88,15 +126,25 @@ class EmotionAnalysis:
         return emotion_analyses_collection.find_one({"_id": ObjectId(analysis_id)})
         
     @staticmethod
-    def find_by_user(user_id, limit=10, skip=0):
+    def find_by_user(user_id, limit=10, skip=0, projection=None):
         """ Find analyses for a specific user """
         from bson.objectid import ObjectId
         if isinstance(user_id, str):
             user_id = ObjectId(user_id)
             
         return list(emotion_analyses_collection.find(
-            {"user_id": user_id}
+            {"user_id": user_id}, projection
         ).sort("created_at", -1).skip(skip).limit(limit))
+
+    @staticmethod
+    def list_by_user(user_id, limit=10, cursor=None):
+        """ Page of analysis summaries for a user, newest first; returns (analyses, next_cursor) """
+        from bson.objectid import ObjectId
+        if isinstance(user_id, str):
+            user_id = ObjectId(user_id)
+
+        return keyset_page(emotion_analyses_collection, {"user_id": user_id},
+                           ANALYSIS_SUMMARY_PROJECTION, limit, cursor)
         
     @staticmethod
     def find_by_session(session_id):
@@ -139,55 +187,34 @@ class EmotionAnalysis:
         }).sort(query_field, -1).limit(limit))
         
     @staticmethod
-    def get_emotion_trends(user_id, days=30):
-        """ Get emotion trends over time for a user """
-        from bson.objectid import ObjectId
-        if isinstance(user_id, str):
-            user_id = ObjectId(user_id)
-            
-        # Calculate date range (last N days)
-        end_date = datetime.utcnow()
-        start_date = end_date - datetime.timedelta(days=days)
+    def get_emotion_trends(user_id, days=30, rollups=None):
+        """ Get daily emotion trends for a user, read from the daily rollups (or the ones given) """
+        if rollups is None:
+            rollups = EmotionAnalysis.find_daily_rollups(user_id, days=days)
         
-        # Get all analyses in date range
-        analyses = list(emotion_analyses_collection.find({
-            "user_id": user_id,
-            "created_at": {
-                "$gte": start_date,
-                "$lte": end_date
-            }
-        }).sort("created_at", 1))
-        
-        # Extract emotion trends
+        # One rollup document per day with analyses
         trend_data = {
             "dates": [],
-            "emotions": {
-                "angry": [],
-                "disgust": [],
-                "fear": [],
-                "happy": [],
-                "neutral": [],
-                "sad": [],
-                "surprise": []
-            },
+            "emotions": {emotion: [] for emotion in EMOTION_LABELS},
             "valence": [],
             "engagement": []
         }
         
-        for analysis in analyses:
-            trend_data["dates"].append(analysis["created_at"].strftime("%Y-%m-%d"))
-            
-            for emotion, value in analysis["results"]["emotions"].items():
-                if emotion in trend_data["emotions"]:
-                    trend_data["emotions"][emotion].append(value)
-            
-            if "valence" in analysis["results"]:
-                trend_data["valence"].append(analysis["results"]["valence"])
-                
-            if "engagement" in analysis["results"]:
-                trend_data["engagement"].append(analysis["results"]["engagement"])
+        for rollup in rollups:
+            daily = rollup_averages(rollup)
+            trend_data["dates"].append(daily["date"])
+            for emotion, value in daily["emotions"].items():
+                trend_data["emotions"][emotion].append(value)
+            trend_data["valence"].append(daily["valence"])
+            trend_data["engagement"].append(daily["engagement"])
         
         return trend_data
+
+    @staticmethod
+    def find_daily_rollups(user_id, days=30, session_id=None):
+        """ Raw daily rollups of a user (or one session) over the last N days """
+        end_date = datetime.utcnow()
+        return get_daily_rollups(user_id, end_date - timedelta(days=days), end_date, session_id)
     
     @staticmethod
     def delete_analysis(analysis_id, user_id=None):
@@ -202,4 +229,14 @@ class EmotionAnalysis:
                 user_id = ObjectId(user_id)
             query["user_id"] = user_id
             
-        return emotion_analyses_collection.delete_one(query)
\ No newline at end of file
+        analysis = emotion_analyses_collection.find_one(query, {"user_id": 1, "created_at": 1})
+        result = emotion_analyses_collection.delete_one(query)
+        
+        # Sums can be decremented but min/max cannot, so recompute that day
+        if result.deleted_count and analysis and analysis.get("created_at"):
+            try:
+                rebuild_rollups(analysis["user_id"], analysis["created_at"], analysis["created_at"])
+            except Exception as e:
+                logger.error(f"Could not rebuild emotion rollups after deleting {analysis_id}: {str(e)}")
+        
+        return result
\ No newline at end of file
@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+
+import bson
+from pymongo.errors import DocumentTooLarge, DuplicateKeyError
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+logger = logging.getLogger(__name__)
+
+# Analysis Result Cache Collection
+analysis_cache_collection = db["analysis_result_cache"]
+
+# Total size (results + cached annotated videos) kept before LRU eviction kicks in
+CACHE_MAX_BYTES = int(os.environ.get("ANALYSIS_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+# Local directory holding annotated videos of cached video analyses
+CACHE_DIR = os.environ.get(
+    "ANALYSIS_CACHE_DIR",
+    os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")), "analysis_cache")
+)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+try:
+    analysis_cache_collection.create_index([("cache_key", 1)], unique=True)
+    analysis_cache_collection.create_index([("last_accessed", 1)])
+except Exception as e:
+    logger.warning(f"Could not create analysis cache indexes: {str(e)}")
+
+
+def hash_file(path):
+    """ Stream a file through SHA-256 """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisResultCache:
+    """
+    Content-addressed cache of emotion analysis results.
+
+    Entries are keyed by the SHA-256 of the media bytes, the fingerprint of
+    the model artifact and the analysis parameters, so replacing the model
+    file makes every older entry unreachable; those are evicted by the
+    size-based LRU sweep.
+    """
+
+    @staticmethod
+    def make_key(content_hash, params):
+        from apps.utils.emotion_analysis import get_model_version
+        material = json.dumps({
+            "content": content_hash,
+            "model": get_model_version(),
+            "params": params
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get(cache_key, with_video=True):
+        """ Return cached results (with a private copy of any annotated video) or None """
+        entry = analysis_cache_collection.find_one_and_update(
+            {"cache_key": cache_key},
+            {"$set": {"last_accessed": datetime.utcnow()}, "$inc": {"hits": 1}}
+        )
+        if not entry:
+            return None
+
+        results = entry["results"]
+        artifact = entry.get("annotated_video_file")
+        if artifact and with_video:
+            if os.path.exists(artifact):
+                # Callers delete the annotated video after uploading it
+                fd, copy_path = tempfile.mkstemp(suffix=os.path.splitext(artifact)[1])
+                os.close(fd)
+                shutil.copyfile(artifact, copy_path)
+                results["annotated_video_path"] = copy_path
+            else:
+                logger.info(f"Cached annotated video missing for {cache_key}, serving results only")
+
+        logger.info(f"Analysis cache hit for {cache_key}")
+        return results
+
+    @staticmethod
+    def put(cache_key, results):
+        """ Store results; the annotated video (if any) is copied into the cache directory """
+        cached_results = dict(results)
+        annotated_video_path = cached_results.pop("annotated_video_path", None)
+
+        entry = {
+            "cache_key": cache_key,
+            "results": cached_results,
+            "annotated_video_file": None,
+            "hits": 0,
+            "created_at": datetime.utcnow(),
+            "last_accessed": datetime.utcnow()
+        }
+
+        try:
+            size_bytes = len(bson.encode(entry))
+        except Exception as e:
+            logger.warning(f"Analysis results not cacheable: {str(e)}")
+            return False
+
+        if annotated_video_path and os.path.exists(annotated_video_path):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            artifact = os.path.join(CACHE_DIR, f"{cache_key}{os.path.splitext(annotated_video_path)[1]}")
+            shutil.copyfile(annotated_video_path, artifact)
+            entry["annotated_video_file"] = artifact
+            size_bytes += os.path.getsize(artifact)
+
+        entry["size_bytes"] = size_bytes
+
+        try:
+            analysis_cache_collection.insert_one(entry)
+        except DuplicateKeyError:
+            # Another worker cached the same analysis first
+            return True
+        except DocumentTooLarge:
+            logger.warning(f"Analysis results for {cache_key} exceed the document size limit, not cached")
+            if entry["annotated_video_file"]:
+                os.unlink(entry["annotated_video_file"])
+            return False
+
+        AnalysisResultCache.evict()
+        return True
+
+    @staticmethod
+    def evict(max_bytes=CACHE_MAX_BYTES):
+        """ Remove least recently used entries until the cache fits in max_bytes """
+        totals = list(analysis_cache_collection.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$size_bytes"}}}
+        ]))
+        total = totals[0]["total"] if totals else 0
+        if total <= max_bytes:
+            return 0
+
+        evicted = 0
+        oldest = analysis_cache_collection.find(
+            {}, projection={"size_bytes": 1, "annotated_video_file": 1}
+        ).sort("last_accessed", 1)
+        for entry in oldest:
+            if total <= max_bytes:
+                break
+            analysis_cache_collection.delete_one({"_id": entry["_id"]})
+            artifact = entry.get("annotated_video_file")
+            if artifact and os.path.exists(artifact):
+                os.unlink(artifact)
+            total -= entry.get("size_bytes", 0)
+            evicted += 1
+
+        logger.info(f"Evicted {evicted} analysis cache entries")
+        return evicted
+
+
+def video_analysis_params(render_video):
+    """
+    Cache params of analyze_video with its default adaptive sampling. Uploads
+    and session recordings both analyze with these, so they share entries
+    """
+    from apps.utils.emotion_analysis.video_processor import ADAPTIVE_FRAMES_PER_MINUTE
+    return {"media_type": "video", "sample_rate": None,
+            "frames_per_minute": ADAPTIVE_FRAMES_PER_MINUTE, "render_video": render_video}
+
+
+def cached_analysis(content_hash, params, compute):
+    """
+    Return cached results for (content, model, params) or run ``compute`` and
+    cache its output. Results with an error are never cached.
+    """
+    if not content_hash:
+        return compute()
+
+    try:
+        cache_key = AnalysisResultCache.make_key(content_hash, params)
+        results = AnalysisResultCache.get(cache_key)
+        if results is None and params.get("render_video") is False:
+            # A rendered analysis of the same video holds the same results; its video is not needed
+            rendered_key = AnalysisResultCache.make_key(content_hash, dict(params, render_video=True))
+            results = AnalysisResultCache.get(rendered_key, with_video=False)
+        if results is not None:
+            return results
+    except Exception as e:
+        logger.warning(f"Analysis cache lookup failed: {str(e)}")
+        return compute()
+
+    results = compute()
+
+    if not results.get("error"):
+        try:
+            AnalysisResultCache.put(cache_key, results)
+        except Exception as e:
+            logger.warning(f"Could not cache analysis results: {str(e)}")
+
+    return results
@@ -0,0 +1,332 @@
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne, InsertOne, DeleteOne
+from pymongo.errors import BulkWriteError
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+logger = logging.getLogger(__name__)
+
+# Emotion Daily Rollups Collection
+ROLLUPS_COLLECTION = "emotion_daily_rollups"
+emotion_rollups_collection = db[ROLLUPS_COLLECTION]
+
+EMOTION_LABELS = ('angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise')
+
+# Fields read from analyses when rebuilding rollups
+ROLLUP_SOURCE_PROJECTION = {
+    "user_id": 1,
+    "session_id": 1,
+    "created_at": 1,
+    "results.emotions": 1,
+    "results.valence": 1,
+    "results.engagement": 1,
+    "results.overall.emotions": 1,
+    "results.overall.avg_valence": 1,
+    "results.overall.avg_engagement": 1,
+    "results.faces.emotions": 1,
+    "results.faces.valence": 1,
+    "results.faces.engagement": 1
+}
+
+# A rebuild recomputes one user's rollups this many days at a time
+REBUILD_CHUNK_DAYS = 31
+
+# Times a chunk is recomputed when live analyses changed it during the rebuild
+REBUILD_RETRIES = 3
+
+try:
+    # session_id is None on the per-user daily total
+    emotion_rollups_collection.create_index([("user_id", 1), ("session_id", 1), ("day", 1)], unique=True)
+except Exception as e:
+    logger.warning(f"Could not create emotion rollup indexes: {str(e)}")
+
+
+def day_start(moment):
+    """ UTC midnight of the day a datetime falls on """
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def summarize_results(results):
+    """
+    (emotions, valence, engagement) of one analysis, or None if it found no face.
+
+    Videos carry averaged top-level values; images only carry per-face values,
+    which are averaged here.
+    """
+    results = results or {}
+    overall = results.get("overall") or {}
+    faces = [face for face in results.get("faces") or [] if face.get("emotions")]
+
+    emotions = results.get("emotions") or overall.get("emotions")
+    if not emotions and faces:
+        emotions = {emotion: sum(face["emotions"].get(emotion, 0) for face in faces) / len(faces)
+                    for emotion in EMOTION_LABELS}
+    if not emotions:
+        return None
+
+    def scalar(key, overall_key):
+        if results.get(key) is not None:
+            return results[key]
+        if faces:
+            return sum(face.get(key, 0) for face in faces) / len(faces)
+        return overall.get(overall_key, 0)
+
+    return ({emotion: float(emotions.get(emotion, 0)) for emotion in EMOTION_LABELS},
+            float(scalar("valence", "avg_valence")),
+            float(scalar("engagement", "avg_engagement")))
+
+
+def _metric_values(summary):
+    emotions, valence, engagement = summary
+    values = {f"emotions.{emotion}": value for emotion, value in emotions.items()}
+    values["valence"] = valence
+    values["engagement"] = engagement
+    return values
+
+
+def _rollup_keys(user_id, created_at, session_id):
+    day = day_start(created_at)
+    keys = [{"user_id": user_id, "session_id": None, "day": day}]
+    if session_id:
+        keys.append({"user_id": user_id, "session_id": session_id, "day": day})
+    return keys
+
+
+def rollup_operations(user_id, created_at, results, session_id=None):
+    """
+    Upserts folding one analysis into its user's daily rollup (and the
+    session's, if any); empty when the analysis found no face
+    """
+    summary = summarize_results(results)
+    if summary is None:
+        return []
+
+    if isinstance(user_id, str):
+        user_id = ObjectId(user_id)
+    if isinstance(session_id, str):
+        session_id = ObjectId(session_id)
+
+    values = _metric_values(summary)
+    update = {
+        # version tells a concurrent rebuild that the rollup changed under it
+        "$inc": dict({f"{field}.sum": value for field, value in values.items()}, count=1, version=1),
+        "$min": {f"{field}.min": value for field, value in values.items()},
+        "$max": {f"{field}.max": value for field, value in values.items()},
+        "$set": {"updated_at": datetime.utcnow()}
+    }
+    return [UpdateOne(key, update, upsert=True) for key in _rollup_keys(user_id, created_at, session_id)]
+
+
+def record_analysis(user_id, created_at, results, session_id=None):
+    """ Fold one new analysis into the rollups right away """
+    operations = rollup_operations(user_id, created_at, results, session_id)
+    if not operations:
+        return
+
+    try:
+        emotion_rollups_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Two first writes of the day raced on the upsert; the document exists now
+        if not is_duplicate_key_only(e):
+            raise
+        emotion_rollups_collection.bulk_write(
+            [operations[error["index"]] for error in e.details["writeErrors"]], ordered=False)
+
+
+def is_duplicate_key_only(error):
+    """ True if every failed write of a BulkWriteError was a duplicate key """
+    write_errors = error.details.get("writeErrors", [])
+    return bool(write_errors) and all(e.get("code") == 11000 for e in write_errors)
+
+
+def _empty_rollup():
+    return {"count": 0, "metrics": {}}
+
+
+def _accumulate(rollup, summary):
+    rollup["count"] += 1
+    for field, value in _metric_values(summary).items():
+        metric = rollup["metrics"].get(field)
+        if metric is None:
+            rollup["metrics"][field] = {"sum": value, "min": value, "max": value}
+        else:
+            metric["sum"] += value
+            metric["min"] = min(metric["min"], value)
+            metric["max"] = max(metric["max"], value)
+
+
+def _rollup_document(key, rollup, now):
+    document = dict(key, count=rollup["count"], updated_at=now, emotions={})
+    for field, metric in rollup["metrics"].items():
+        if field.startswith("emotions."):
+            document["emotions"][field.split(".", 1)[1]] = metric
+        else:
+            document[field] = metric
+    return document
+
+
+def _rebuild_chunk(user_id, start, end, batch_size):
+    """
+    Recompute one user's rollups for the days in [start, end). Returns the
+    number of rollups written, or None if a live analysis changed one of
+    them meanwhile (nothing of that rollup is overwritten; retry the chunk).
+    """
+    from apps.emotions.models import emotion_analyses_collection
+
+    # Versions first: any increment after this point makes the writes below miss
+    versions = {
+        (rollup["session_id"], rollup["day"]): rollup.get("version")
+        for rollup in emotion_rollups_collection.find(
+            {"user_id": user_id, "day": {"$gte": start, "$lt": end}},
+            {"session_id": 1, "day": 1, "version": 1}
+        )
+    }
+
+    rollups = {}
+    cursor = emotion_analyses_collection.find(
+        {"user_id": user_id, "created_at": {"$gte": start, "$lt": end}}, ROLLUP_SOURCE_PROJECTION
+    ).batch_size(batch_size)
+    for analysis in cursor:
+        if "created_at" not in analysis:
+            continue
+        summary = summarize_results(analysis.get("results"))
+        if summary is None:
+            continue
+        for key in _rollup_keys(user_id, analysis["created_at"], analysis.get("session_id")):
+            _accumulate(rollups.setdefault((key["session_id"], key["day"]), _empty_rollup()), summary)
+
+    def unchanged(key, version):
+        return dict(key, version=version if version is not None else {"$exists": False})
+
+    now = datetime.utcnow()
+    operations = []
+    for (session_id, day), rollup in rollups.items():
+        key = {"user_id": user_id, "session_id": session_id, "day": day}
+        document = _rollup_document(key, rollup, now)
+        if (session_id, day) in versions:
+            version = versions[(session_id, day)]
+            document["version"] = (version or 0) + 1
+            operations.append(ReplaceOne(unchanged(key, version), document))
+        else:
+            # Fails on the unique index if a live analysis created it meanwhile
+            document["version"] = 1
+            operations.append(InsertOne(document))
+    # Days whose analyses were all deleted must not keep a stale rollup
+    for (session_id, day), version in versions.items():
+        if (session_id, day) not in rollups:
+            operations.append(DeleteOne(unchanged({"user_id": user_id, "session_id": session_id, "day": day}, version)))
+
+    if not operations:
+        return 0
+    try:
+        result = emotion_rollups_collection.bulk_write(operations, ordered=False)
+        applied = result.matched_count + result.inserted_count + result.deleted_count
+    except BulkWriteError as e:
+        if not is_duplicate_key_only(e):
+            raise
+        return None
+    if applied < len(operations):
+        return None
+    return len(rollups)
+
+
+def rebuild_rollups(user_id=None, start=None, end=None, batch_size=500):
+    """
+    Recompute rollups from the analyses themselves.
+
+    Used by the backfill command and after deletions (min/max cannot be
+    decremented). Rebuilds whole days: start/end are widened to day bounds.
+    Works through one user and REBUILD_CHUNK_DAYS days at a time, replacing
+    rollups in place, so trend views keep their data and increments from
+    live analyses are never overwritten. Returns the number of rollup
+    documents written.
+    """
+    from apps.emotions.models import emotion_analyses_collection
+
+    if isinstance(user_id, str):
+        user_id = ObjectId(user_id)
+    start = day_start(start) if start else None
+    end = day_start(end) + timedelta(days=1) if end else None
+
+    def in_range(field):
+        bounds = {}
+        if start:
+            bounds["$gte"] = start
+        if end:
+            bounds["$lt"] = end
+        return {field: bounds} if bounds else {}
+
+    if user_id is not None:
+        user_ids = [user_id]
+    else:
+        # Users with analyses or rollups in the range; stale rollups need removing too
+        user_ids = set()
+        for collection, field in ((emotion_analyses_collection, "created_at"), (emotion_rollups_collection, "day")):
+            for row in collection.aggregate([{"$match": in_range(field)}, {"$group": {"_id": "$user_id"}}],
+                                            allowDiskUse=True):
+                if row["_id"] is not None:
+                    user_ids.add(row["_id"])
+
+    written = 0
+    for user in user_ids:
+        # Day span of this user's data within the range
+        bounds = []
+        for collection, field in ((emotion_analyses_collection, "created_at"), (emotion_rollups_collection, "day")):
+            query = dict(in_range(field), user_id=user)
+            for direction in (1, -1):
+                document = collection.find_one(query, {field: 1}, sort=[(field, direction)])
+                if document and document.get(field):
+                    bounds.append(day_start(document[field]))
+        if not bounds:
+            continue
+
+        chunk_start, last_day = start or min(bounds), max(bounds)
+        while chunk_start <= last_day and (end is None or chunk_start < end):
+            chunk_end = chunk_start + timedelta(days=REBUILD_CHUNK_DAYS)
+            if end is not None:
+                chunk_end = min(chunk_end, end)
+            for attempt in range(REBUILD_RETRIES):
+                count = _rebuild_chunk(user, chunk_start, chunk_end, batch_size)
+                if count is not None:
+                    written += count
+                    break
+            else:
+                logger.warning(f"Rollups of {user} from {chunk_start:%Y-%m-%d} kept changing during the rebuild, "
+                               f"left as they are")
+            chunk_start = chunk_end
+
+    return written
+
+
+def get_daily_rollups(user_id, start, end, session_id=None):
+    """ Rollup documents of a user (or one of their sessions) from start to end, oldest first """
+    if isinstance(user_id, str):
+        user_id = ObjectId(user_id)
+    if isinstance(session_id, str):
+        session_id = ObjectId(session_id)
+
+    return list(emotion_rollups_collection.find({
+        "user_id": user_id,
+        "session_id": session_id,
+        "day": {"$gte": day_start(start), "$lte": end}
+    }, {"_id": 0, "updated_at": 0}).sort("day", 1))
+
+
+def rollup_averages(rollup):
+    """ Daily means of a rollup document """
+    count = rollup.get("count") or 1
+    return {
+        "date": rollup["day"].strftime("%Y-%m-%d"),
+        "count": rollup.get("count", 0),
+        "emotions": {emotion: rollup.get("emotions", {}).get(emotion, {}).get("sum", 0) / count
+                     for emotion in EMOTION_LABELS},
+        "valence": rollup.get("valence", {}).get("sum", 0) / count,
+        "engagement": rollup.get("engagement", {}).get("sum", 0) / count
+    }
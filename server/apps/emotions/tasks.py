@@ -0,0 +1,217 @@
+import os
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+
+from apps.utils.cloudinary_helper import upload_file_to_cloudinary
+from apps.utils.artifact_store import ARTIFACT_RESULT_FIELDS, externalize_artifacts
+from apps.utils.emotion_analysis import analyze_image, analyze_video
+from apps.emotions.models import EmotionAnalysis
+from apps.emotions.checkpoints import AnalysisCheckpoint
+from apps.emotions.result_cache import cached_analysis, video_analysis_params
+
+logger = logging.getLogger(__name__)
+
+
+def _failed_video_results(error):
+    """Minimal results stored when a video could not be analyzed"""
+    return {
+        "error": error,
+        "overall": {
+            "dominant_emotion": "unknown",
+            "avg_valence": 0,
+            "avg_engagement": 0
+        },
+        "face_count": 0,
+        "face_detected": False
+    }
+
+
+def _analyze_uploaded_video(temp_path, progress_callback=None, checkpoint=None, render_video=True):
+    """Run video analysis, retrying through an MP4 transcode for problematic WebM files"""
+    try:
+        # Adaptive sampling, like session recordings, so both share cached results;
+        # analyze_video falls back to fixed-rate extraction when OpenCV cannot seek
+        analysis_results = analyze_video(temp_path,
+                                         progress_callback=progress_callback,
+                                         checkpoint=checkpoint,
+                                         render_video=render_video)
+
+        # If analysis fails with no frames, try again with different method
+        if analysis_results.get("error") == "No frames could be extracted from video":
+            logger.warning("First analysis attempt failed, retrying with alternative method")
+            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_mp4:
+                temp_mp4_path = temp_mp4.name
+
+            # Convert WebM to MP4 using FFmpeg
+            try:
+                subprocess.run([
+                    'ffmpeg', '-y', '-i', temp_path, '-c:v', 'libx264', '-crf', '23',
+                    '-preset', 'veryfast', '-c:a', 'aac', temp_mp4_path
+                ], check=True, capture_output=True)
+
+                analysis_results = analyze_video(temp_mp4_path,
+                                                 progress_callback=progress_callback,
+                                                 checkpoint=checkpoint,
+                                                 render_video=render_video)
+            except Exception as conv_err:
+                logger.error(f"Conversion failed: {str(conv_err)}")
+            finally:
+                if os.path.exists(temp_mp4_path):
+                    os.unlink(temp_mp4_path)
+
+        if analysis_results.get("error"):
+            logger.warning(f"Video analysis failed: {analysis_results.get('error')}")
+            annotated_video_path = analysis_results.get("annotated_video_path")
+            if annotated_video_path and os.path.exists(annotated_video_path):
+                os.unlink(annotated_video_path)
+            return _failed_video_results(analysis_results.get("error"))
+
+        return analysis_results
+
+    except Exception as analysis_error:
+        logger.error(f"Error during video analysis: {str(analysis_error)}")
+        return _failed_video_results(f"Analysis error: {str(analysis_error)}")
+
+
+def process_media_upload(job, progress):
+    """
+    Job handler for /api/emotions/upload/.
+
+    The Cloudinary upload of the source file and the emotion analysis run
+    concurrently; for videos the annotated render (streamed out during
+    analysis unless the client passed render_video=false) is uploaded once
+    analysis finishes and becomes the main media URL.
+    """
+    from apps.emotions.views import generate_therapeutic_insights
+
+    payload = job["payload"]
+    temp_path = payload["file_path"]
+    media_type = payload["media_type"]
+    user_id = payload["user_id"]
+    filename = payload["filename"]
+    session_id = payload.get("session_id")
+    content_hash = payload.get("content_hash")
+    render_video = payload.get("render_video", True)
+    folder = f"emotion_analysis/{user_id}"
+
+    progress.stage("processing", 5)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        if media_type == 'image':
+            upload_future = executor.submit(
+                upload_file_to_cloudinary, temp_path, folder=folder, public_id=filename
+            )
+            analysis_results = cached_analysis(
+                content_hash,
+                {"media_type": "image", "return_visualization": True},
+                lambda: analyze_image(temp_path, return_visualization=True)
+            )
+            progress.update(60)
+            cloudinary_response = upload_future.result()
+            if not cloudinary_response:
+                raise Exception("Failed to upload media to Cloudinary")
+
+            media_url = cloudinary_response.get("secure_url")
+            media_metadata = {
+                "public_id": cloudinary_response.get("public_id"),
+                "format": cloudinary_response.get("format"),
+                "width": cloudinary_response.get("width"),
+                "height": cloudinary_response.get("height"),
+                "resource_type": cloudinary_response.get("resource_type")
+            }
+
+        else:  # video
+            import cv2
+            cap = cv2.VideoCapture(temp_path)
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            duration = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps) if fps > 0 else 0
+            cap.release()
+
+            media_metadata = {
+                "format": payload.get("file_ext", "").lstrip('.'),
+                "width": width,
+                "height": height,
+                "duration": duration,
+                "resource_type": "video"
+            }
+
+            # Source upload overlaps with analysis
+            source_future = executor.submit(
+                upload_file_to_cloudinary, temp_path, folder=folder,
+                public_id=f"{filename}_source", resource_type="video"
+            )
+            analysis_results = cached_analysis(
+                content_hash,
+                video_analysis_params(render_video),
+                lambda: _analyze_uploaded_video(temp_path, progress.scaled(5, 80),
+                                                checkpoint=AnalysisCheckpoint(job["_id"]),
+                                                render_video=render_video)
+            )
+            progress.stage("uploading", 80)
+
+            source_response = source_future.result()
+            if not source_response:
+                raise Exception("Failed to upload video to Cloudinary")
+            media_metadata["source_public_id"] = source_response.get("public_id")
+            media_url = source_response.get("secure_url")
+            media_metadata["public_id"] = source_response.get("public_id")
+
+            annotated_video_path = analysis_results.pop("annotated_video_path", None)
+            if annotated_video_path:
+                try:
+                    progress.check_cancelled()
+                    annotated_response = upload_file_to_cloudinary(
+                        annotated_video_path,
+                        folder=folder,
+                        public_id=filename,
+                        resource_type="video"
+                    )
+                    if annotated_response:
+                        media_url = annotated_response.get("secure_url")
+                        media_metadata["public_id"] = annotated_response.get("public_id")
+                finally:
+                    if os.path.exists(annotated_video_path):
+                        os.unlink(annotated_video_path)
+            elif render_video:
+                logger.error("No annotated video was created during analysis")
+
+    progress.stage("saving", 95)
+
+    analysis = EmotionAnalysis(
+        user_id=ObjectId(user_id),
+        media_url=media_url,
+        media_type=media_type,
+        session_id=ObjectId(session_id) if session_id else None,
+        results=analysis_results,
+        media_metadata=media_metadata
+    )
+
+    # Rendered images go to the artifact store; the document keeps references
+    externalize_artifacts(analysis_results, ARTIFACT_RESULT_FIELDS)
+    
+    # Save the annotated image; charts are rendered on demand via get_visualization
+    if 'visualization' in analysis_results:
+        analysis.visualizations["analyzed_image"] = analysis_results["visualization"]
+
+    generate_therapeutic_insights(analysis)
+    analysis_id = analysis.save()
+
+    return {
+        "analysis_id": str(analysis_id),
+        "media_url": media_url,
+        "media_type": media_type,
+        "results_summary": {
+            "dominant_emotion": analysis_results.get("overall", {}).get("dominant_emotion") or
+                                analysis_results.get("dominant_emotion"),
+            "valence": analysis_results.get("overall", {}).get("avg_valence") or
+                       analysis_results.get("valence", 0),
+            "engagement": analysis_results.get("overall", {}).get("avg_engagement") or
+                          analysis_results.get("engagement", 0),
+            "face_count": analysis_results.get("face_count", 0)
+        }
+    }
@@ -3,10 +3,15 @@ from . import views
 
 urlpatterns = [
     path('upload/', views.upload_and_analyze, name='upload_and_analyze'),
+    path('jobs/<str:job_id>/', views.get_job_status, name='get_job_status'),
+    path('jobs/<str:job_id>/cancel/', views.cancel_job, name='cancel_job'),
+    path('jobs/<str:job_id>/retry/', views.retry_job, name='retry_job'),
     path('analysis/<str:analysis_id>/', views.get_analysis_details, name='get_analysis_details'),
     path('history/', views.get_user_analyses, name='get_user_analyses'),
     path('trends/', views.get_emotion_trends, name='get_emotion_trends'),
+    path('cohort/', views.get_cohort_analytics, name='get_cohort_analytics'),
     path('visualization/<str:analysis_id>/<str:viz_type>/', views.get_visualization, name='get_visualization'),
     path('delete/<str:analysis_id>/', views.delete_analysis, name='delete_analysis'),
+    path('artifacts/<str:artifact_id>/', views.get_artifact, name='get_artifact'),
     path('test-live/', views.test_live_emotion, name='test_live_emotion'),
 ]
\ No newline at end of file
@@ -1,12 +1,12 @@
 import os
 import json
+import time
 import uuid
-import tempfile
 import logging
 from datetime import datetime
 from bson import ObjectId
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseNotModified
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
@@ -23,11 +23,43 @@ from django.template.loader import render_to_string
 from apps.utils.cloudinary_helper import upload_file_to_cloudinary, delete_from_cloudinary
 from apps.utils.emotion_analysis import analyze_image, analyze_video
 # from apps.utils.auth import get_user_from_token
-from apps.emotions.models import EmotionAnalysis
+from apps.emotions.models import EmotionAnalysis, ANALYSIS_SUMMARY_PROJECTION
+from apps.emotions.jobs import AnalysisJob, JobStatus, enqueue_job, spool_upload, serialize_job
+from apps.emotions.chart_cache import chart_cache, get_or_render_chart
+from apps.emotions.cohort import compute_cohort_analytics
+from apps.utils.artifact_store import (
+    ARTIFACT_RESULT_FIELDS, artifact_url, collect_artifact_ids, delete_artifacts,
+    get_artifact_store, is_artifact_ref, resolve_artifact_urls, verify_artifact_signature
+)
+from apps.utils.emotion_analysis.visualization_generator import (
+    VISUALIZATION_TYPES, generate_visualization, generate_trend_chart
+)
+from apps.utils.emotion_analysis.timeline import (
+    TIMELINE_DISPLAY_POINTS, TIMELINE_VIEW_POINTS, get_timeline_view, key_frames
+)
+from apps.utils.emotion_analysis.trend_analyzer import EmotionTrendAnalyzer
 from apps.utils.auth import get_user_from_request
+from apps.utils.pagination import InvalidCursor
 
 logger = logging.getLogger(__name__)
 
+# Bounds for requested chart dimensions (pixels)
+MIN_CHART_SIZE = 200
+MAX_CHART_SIZE = 2000
+
+# Read size when streaming artifacts
+ARTIFACT_CHUNK_SIZE = 64 * 1024
+
+# Chart output formats: compact series for client-side rendering, or server-rendered PNG
+CHART_FORMATS = ('data', 'png')
+
+# Pre-rendered chart images older analyses carry inside their documents
+LEGACY_RESULT_CHARTS = ('graph', 'timeline_graph', 'frame_visualization', 'emotion_heatmap')
+LEGACY_VISUALIZATIONS = ('emotion_graph', 'timeline_graph')
+
+# Longest history the cohort analytics endpoint aggregates
+MAX_COHORT_DAYS = 730
+
 
 @csrf_exempt
 def test_live_emotion(request):
@@ -166,7 +198,7 @@ def _enhance_frame_for_detection(frame):
 @csrf_exempt
 @require_http_methods(["POST"])
 def upload_and_analyze(request):
-    """Upload an image or video for emotion analysis"""
+    """Queue an uploaded image or video for emotion analysis and return the job id"""
     try:
         # Check authentication
         user = get_user_from_request(request)
@@ -179,6 +211,8 @@ def upload_and_analyze(request):
         
         file = request.FILES['file']
         session_id = request.POST.get('session_id')
+        # API clients that only need the numbers can skip the annotated video
+        render_video = request.POST.get('render_video', 'true').lower() not in ('false', '0', 'no')
         
         # Validate file type
         allowed_image_types = ['image/jpeg', 'image/png', 'image/gif']
@@ -194,198 +228,102 @@ def upload_and_analyze(request):
         # Prepare unique filename
         filename = f"{user['_id']}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         file_ext = os.path.splitext(file.name)[1]
-        temp_path = None
         
-        # Create temporary file for processing
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            for chunk in file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        # Hand the file over to a worker process through the spool directory
+        spooled_path, content_hash = spool_upload(file, suffix=file_ext)
+        job_id = enqueue_job("emotion_analysis", ObjectId(user['_id']), {
+            "file_path": spooled_path,
+            "content_hash": content_hash,
+            "file_ext": file_ext,
+            "media_type": media_type,
+            "filename": filename,
+            "user_id": str(user['_id']),
+            "session_id": session_id,
+            "render_video": render_video
+        })
         
-        try:
-            # For images, upload to Cloudinary normally
-            if media_type == 'image':
-                # Upload to Cloudinary
-                cloudinary_response = upload_file_to_cloudinary(
-                    temp_path, 
-                    folder=f"emotion_analysis/{user['_id']}", 
-                    public_id=filename
-                )
-                
-                # Extract media metadata
-                media_metadata = {
-                    "public_id": cloudinary_response.get("public_id"),
-                    "format": cloudinary_response.get("format"),
-                    "width": cloudinary_response.get("width"),
-                    "height": cloudinary_response.get("height"),
-                    "resource_type": cloudinary_response.get("resource_type")
-                }
-                
-                # Run emotion analysis
-                analysis_results = analyze_image(temp_path, return_visualization=True)
-                media_url = cloudinary_response.get("secure_url")
-            
-            # For videos, analyze first then upload the annotated version only
-            else:  # video
-                # Extract metadata first without uploading
-                import cv2
-                cap = cv2.VideoCapture(temp_path)
-                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                duration = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS))
-                cap.release()
-                
-                # Store metadata without Cloudinary ID yet
-                media_metadata = {
-                    "format": os.path.splitext(file.name)[1].lstrip('.'),
-                    "width": width,
-                    "height": height,
-                    "duration": duration,
-                    "resource_type": "video"
-                }
-                
-                # CRITICAL FIX: Add more robust error handling for video analysis
-                try:
-                    # Run video analysis with improved parameters for WebM compatibility
-                    sample_rate = 1.0  # Use higher sample rate for problematic videos
-                    analysis_results = analyze_video(temp_path, sample_rate=sample_rate)
-                    
-                    # If analysis fails with no frames, try again with different method
-                    if analysis_results.get("error") == "No frames could be extracted from video":
-                        logger.warning("First analysis attempt failed, retrying with alternative method")
-                        # Try creating a temporary copy with a different container format
-                        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_mp4:
-                            temp_mp4_path = temp_mp4.name
-                        
-                        # Convert WebM to MP4 using FFmpeg
-                        try:
-                            subprocess.run([
-                                'ffmpeg', '-i', temp_path, '-c:v', 'libx264', '-crf', '23',
-                                '-preset', 'veryfast', '-c:a', 'aac', temp_mp4_path
-                            ], check=True, capture_output=True)
-                            
-                            # Try analysis again with converted file
-                            analysis_results = analyze_video(temp_mp4_path, sample_rate=sample_rate)
-                            
-                            # Clean up temporary file
-                            try:
-                                os.unlink(temp_mp4_path)
-                            except:
-                                pass
-                        except Exception as conv_err:
-                            logger.error(f"Conversion failed: {str(conv_err)}")
-                            # Continue with original error results
-                    
-                    # If still failing, create minimal analysis results
-                    if analysis_results.get("error"):
-                        logger.warning(f"Video analysis failed: {analysis_results.get('error')}")
-                        analysis_results = {
-                            "error": analysis_results.get("error"),
-                            "overall": {
-                                "dominant_emotion": "unknown",
-                                "avg_valence": 0,
-                                "avg_engagement": 0
-                            },
-                            "face_count": 0,
-                            "face_detected": False
-                        }
-                except Exception as analysis_error:
-                    logger.error(f"Error during video analysis: {str(analysis_error)}")
-                    analysis_results = {
-                        "error": f"Analysis error: {str(analysis_error)}",
-                        "overall": {
-                            "dominant_emotion": "unknown",
-                            "avg_valence": 0,
-                            "avg_engagement": 0
-                        },
-                        "face_count": 0,
-                        "face_detected": False
-                    }
-                
-                # Check if we have an annotated video
-                if not analysis_results.get("annotated_video_path"):
-                    logger.error("No annotated video was created during analysis")
-                    # Fallback to original video if no annotated video
-                    cloudinary_response = upload_file_to_cloudinary(
-                        temp_path, 
-                        folder=f"emotion_analysis/{user['_id']}", 
-                        public_id=filename,
-                        resource_type="video"
-                    )
-                    media_url = cloudinary_response.get("secure_url")
-                    media_metadata["public_id"] = cloudinary_response.get("public_id")
-                else:
-                    # Upload the annotated video to Cloudinary as the main media
-                    annotated_video_path = analysis_results.get("annotated_video_path")
-                    cloudinary_response = upload_file_to_cloudinary(
-                        annotated_video_path,
-                        folder=f"emotion_analysis/{user['_id']}",
-                        public_id=filename,  # Use the main filename (no _annotated suffix)
-                        resource_type="video"
-                    )
-                    
-                    # Store the URL as the main media URL
-                    media_url = cloudinary_response.get("secure_url")
-                    media_metadata["public_id"] = cloudinary_response.get("public_id")
-                    
-                    # We don't need a separate annotated_video field anymore
-                    if "annotated_video_path" in analysis_results:
-                        del analysis_results["annotated_video_path"]
-                        
-                    # Clean up the temporary annotated file
-                    if os.path.exists(annotated_video_path):
-                        os.unlink(annotated_video_path)
-            
-            # Create and save analysis document
-            analysis = EmotionAnalysis(
-                user_id=ObjectId(user['_id']),
-                media_url=media_url,  # Now using the annotated video URL for videos
-                media_type=media_type,
-                session_id=ObjectId(session_id) if session_id else None,
-                results=analysis_results,
-                media_metadata=media_metadata
-            )
-            
-            # Save visualization images if available
-            if 'visualization' in analysis_results:
-                analysis.visualizations["analyzed_image"] = analysis_results["visualization"]
-            if 'graph' in analysis_results:
-                analysis.visualizations["emotion_graph"] = analysis_results["graph"]
-            if 'timeline_graph' in analysis_results:
-                analysis.visualizations["timeline_graph"] = analysis_results["timeline_graph"]
-                
-            # Generate therapeutic insights
-            generate_therapeutic_insights(analysis)
-                
-            # Save to database
-            analysis_id = analysis.save()
-            
-            # Return success with results
-            return JsonResponse({
-                "success": True,
-                "analysis_id": str(analysis_id),
-                "media_url": media_url,
-                "media_type": media_type,
-                "results_summary": {
-                    "dominant_emotion": analysis_results.get("overall", {}).get("dominant_emotion") or 
-                                       analysis_results.get("dominant_emotion"),
-                    "valence": analysis_results.get("overall", {}).get("avg_valence") or 
-                              analysis_results.get("valence", 0),
-                    "engagement": analysis_results.get("overall", {}).get("avg_engagement") or 
-                                analysis_results.get("engagement", 0),
-                    "face_count": analysis_results.get("face_count", 0)
-                }
-            })
-            
-        finally:
-            # Clean up temporary file
-            if temp_path and os.path.exists(temp_path):
-                os.unlink(temp_path)
+        return JsonResponse({
+            "success": True,
+            "job_id": str(job_id),
+            "status": JobStatus.QUEUED,
+            "media_type": media_type,
+            "status_url": f"/api/emotions/jobs/{job_id}/"
+        }, status=202)
     
     except Exception as e:
         logger.error(f"Error in upload_and_analyze: {str(e)}")
         return JsonResponse({"error": f"Analysis failed: {str(e)}"}, status=500)
 
+def _get_owned_job(request, job_id):
+    """Return (job, error_response) for a job belonging to the requesting user"""
+    user = get_user_from_request(request)
+    if not user:
+        return None, JsonResponse({"error": "Authentication required"}, status=401)
+    
+    if not ObjectId.is_valid(job_id):
+        return None, JsonResponse({"error": "Job not found"}, status=404)
+    
+    job = AnalysisJob.find_by_id(job_id)
+    if not job:
+        return None, JsonResponse({"error": "Job not found"}, status=404)
+    
+    if str(job.get('user_id')) != str(user['_id']):
+        return None, JsonResponse({"error": "Access denied"}, status=403)
+    
+    return job, None
+
+@require_http_methods(["GET"])
+def get_job_status(request, job_id):
+    """Get progress, ETA and (once finished) the result of an analysis job"""
+    try:
+        job, error_response = _get_owned_job(request, job_id)
+        if error_response:
+            return error_response
+        
+        return JsonResponse(serialize_job(job))
+    
+    except Exception as e:
+        logger.error(f"Error in get_job_status: {str(e)}")
+        return JsonResponse({"error": f"Failed to retrieve job: {str(e)}"}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def cancel_job(request, job_id):
+    """Cancel a queued or running analysis job"""
+    try:
+        job, error_response = _get_owned_job(request, job_id)
+        if error_response:
+            return error_response
+        
+        updated = AnalysisJob.request_cancel(job['_id'], user_id=job.get('user_id'))
+        if not updated:
+            return JsonResponse({"error": f"Job is already {job.get('status')}"}, status=409)
+        
+        return JsonResponse(serialize_job(updated, include_result=False))
+    
+    except Exception as e:
+        logger.error(f"Error in cancel_job: {str(e)}")
+        return JsonResponse({"error": f"Failed to cancel job: {str(e)}"}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def retry_job(request, job_id):
+    """Requeue a failed or cancelled analysis job"""
+    try:
+        job, error_response = _get_owned_job(request, job_id)
+        if error_response:
+            return error_response
+        
+        updated = AnalysisJob.retry(job['_id'], user_id=job.get('user_id'))
+        if not updated:
+            return JsonResponse({"error": "Job cannot be retried"}, status=409)
+        
+        return JsonResponse(serialize_job(updated, include_result=False), status=202)
+    
+    except Exception as e:
+        logger.error(f"Error in retry_job: {str(e)}")
+        return JsonResponse({"error": f"Failed to retry job: {str(e)}"}, status=500)
+
 @require_http_methods(["GET"])
 def get_analysis_details(request, analysis_id):
     """Get detailed analysis results"""
@@ -409,14 +347,46 @@ def get_analysis_details(request, analysis_id):
         if str(analysis.get('user_id')) != str(user['_id']):
             return JsonResponse({"error": "Access denied"}, status=403)
         
+        chart_format = request.GET.get('format', 'data')
+        if chart_format not in CHART_FORMATS:
+            return JsonResponse({"error": f"format must be one of {', '.join(CHART_FORMATS)}"}, status=400)
+        
+        results = dict(analysis['results'])
+        visualizations = analysis.get('visualizations', {})
+        charts = None
+        
+        # Analyses stored before key frames carry every frame's results; send key frames only
+        if 'frames' in results:
+            frames = results.pop('frames') or []
+            results.setdefault('frames_with_faces', sum(1 for frame in frames if frame.get('faces')))
+            results.setdefault('key_frames', key_frames(frames))
+        
+        # Full-resolution timeline only on request; otherwise a fixed-size LTTB view
+        timeline = request.GET.get('timeline', str(TIMELINE_DISPLAY_POINTS))
+        if timeline != 'full':
+            if not timeline.isdigit() or int(timeline) not in TIMELINE_VIEW_POINTS:
+                return JsonResponse({"error": f"timeline must be 'full' or one of {TIMELINE_VIEW_POINTS}"}, status=400)
+            if int(timeline) != TIMELINE_DISPLAY_POINTS and results.get('emotion_timeline_full'):
+                results['overall'] = dict(results.get('overall', {}),
+                                          emotion_timeline=get_timeline_view(results, int(timeline)))
+            results.pop('emotion_timeline_full', None)
+        if chart_format == 'data':
+            # Ship chart data instead of the PNGs older analyses stored inline
+            results = {key: value for key, value in results.items() if key not in LEGACY_RESULT_CHARTS}
+            visualizations = {key: value for key, value in visualizations.items()
+                              if key not in LEGACY_VISUALIZATIONS}
+            viz_types = ('timeline', 'emotion_heatmap') if analysis['media_type'] == 'video' else ('emotion_graph',)
+            charts = {viz_type: generate_visualization(analysis, viz_type, format='data') for viz_type in viz_types}
+        
         # Return detailed results
         return JsonResponse({
             "analysis_id": str(analysis['_id']),
             "media_url": analysis['media_url'],
             "media_type": analysis['media_type'],
             "created_at": analysis['created_at'].isoformat(),
-            "results": analysis['results'],
-            "visualizations": analysis.get('visualizations', {}),
+            "results": resolve_artifact_urls(results, request, ARTIFACT_RESULT_FIELDS),
+            "visualizations": resolve_artifact_urls(visualizations, request),
+            "charts": charts,
             "therapeutic_context": analysis.get('therapeutic_context', {})
         })
     
@@ -436,9 +406,18 @@ def get_user_analyses(request):
         # Get pagination parameters
         limit = min(int(request.GET.get('limit', 10)), 50)  # Cap at 50
         skip = max(int(request.GET.get('skip', 0)), 0)
+        next_cursor = None
         
-        # Get analyses
-        analyses = EmotionAnalysis.find_by_user(user['_id'], limit=limit, skip=skip)
+        # Get analyses; skip is kept for old clients, cursors page in constant time
+        if 'skip' in request.GET:
+            analyses = EmotionAnalysis.find_by_user(user['_id'], limit=limit, skip=skip,
+                                                    projection=ANALYSIS_SUMMARY_PROJECTION)
+        else:
+            try:
+                analyses, next_cursor = EmotionAnalysis.list_by_user(
+                    user['_id'], limit=limit, cursor=request.GET.get('cursor'))
+            except InvalidCursor as e:
+                return JsonResponse({"error": str(e)}, status=400)
         
         # Format for response
         results = []
@@ -450,14 +429,15 @@ def get_user_analyses(request):
                 "created_at": analysis['created_at'].isoformat(),
                 "dominant_emotion": analysis.get('results', {}).get('overall', {}).get('dominant_emotion') or 
                                     analysis.get('results', {}).get('dominant_emotion', 'unknown'),
-                "thumbnail": analysis.get('visualizations', {}).get('analyzed_image')
+                "thumbnail": resolve_artifact_urls(analysis.get('visualizations', {}), request).get('analyzed_image')
             })
         
         return JsonResponse({
             "analyses": results,
             "count": len(results),
             "skip": skip,
-            "limit": limit
+            "limit": limit,
+            "next_cursor": next_cursor
         })
     
     except Exception as e:
@@ -537,15 +517,30 @@ def get_emotion_trends(request):
         # Get time range (default to last 30 days)
         days = int(request.GET.get('days', 30))
         
-        # Get trends from model
-        trends = EmotionAnalysis.get_emotion_trends(user['_id'], days=days)
+        chart_format = request.GET.get('format', 'data')
+        if chart_format not in CHART_FORMATS:
+            return JsonResponse({"error": f"format must be one of {', '.join(CHART_FORMATS)}"}, status=400)
         
-        # Generate visualization
-        from apps.utils.emotion_analysis.visualization_generator import generate_trend_chart
-        chart_image = generate_trend_chart(trends)
+        # Trends and their long-term analysis both come from the same daily rollups
+        rollups = EmotionAnalysis.find_daily_rollups(user['_id'], days=days)
+        trends = EmotionAnalysis.get_emotion_trends(user['_id'], days=days, rollups=rollups)
+        long_term = EmotionTrendAnalyzer().analyze_long_term_trends(rollups, days=days)
+        
+        if chart_format == 'data':
+            return JsonResponse({
+                "trends": trends,
+                "analysis": long_term,
+                "chart": generate_trend_chart(trends, format='data') if trends.get('dates') else None,
+                "timespan": f"{days} days"
+            })
+        
+        # Generate visualization on the chart render pool
+        from apps.utils.emotion_analysis.render_pool import render_chart_async
+        chart_image = render_chart_async('trend_chart', {"trend_data": trends})
         
         return JsonResponse({
             "trends": trends,
+            "analysis": long_term,
             "visualization": chart_image,
             "timespan": f"{days} days"
         })
@@ -554,6 +549,52 @@ def get_emotion_trends(request):
         logger.error(f"Error in get_emotion_trends: {str(e)}")
         return JsonResponse({"error": f"Failed to retrieve trends: {str(e)}"}, status=500)
 
+@require_http_methods(["GET"])
+def get_cohort_analytics(request):
+    """Emotion statistics across all clients of the requesting therapist"""
+    try:
+        # Check authentication
+        user = get_user_from_request(request)
+        if not user:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        if user.get('role') != 'therapist':
+            return JsonResponse({"error": "Only therapists can view cohort analytics"}, status=403)
+        
+        therapist_id = user.get('therapist_id')
+        if not therapist_id:
+            from apps.therapists.models import Therapist
+            therapist = Therapist.find_by_user_id(str(user['_id']))
+            therapist_id = therapist.get('_id') if therapist else None
+        if not therapist_id:
+            return JsonResponse({"error": "Therapist profile not found"}, status=404)
+        
+        days = min(max(int(request.GET.get('days', 90)), 1), MAX_COHORT_DAYS)
+        
+        from apps.therapy_sessions.models import TherapySession
+        client_ids = TherapySession.find_client_ids(therapist_id)
+        analytics = compute_cohort_analytics(client_ids, days=days)
+        
+        # Names for the clients that have data, in one query
+        from apps.users.models import users_collection
+        names = {u['_id']: u.get('username') for u in users_collection.find(
+            {"_id": {"$in": [client['user_id'] for client in analytics['clients']]}}, {"username": 1})}
+        for client in analytics['clients']:
+            client['username'] = names.get(client['user_id'])
+            client['user_id'] = str(client['user_id'])
+            client['last_active'] = client['last_active'].strftime("%Y-%m-%d")
+        
+        return JsonResponse({
+            "clients": analytics['clients'],
+            "cohort": analytics['cohort'],
+            "timespan": f"{days} days"
+        })
+    
+    except ValueError:
+        return JsonResponse({"error": "days must be an integer"}, status=400)
+    except Exception as e:
+        logger.error(f"Error in get_cohort_analytics: {str(e)}")
+        return JsonResponse({"error": f"Failed to compute cohort analytics: {str(e)}"}, status=500)
+
 @require_http_methods(["GET"])
 def get_visualization(request, analysis_id, viz_type):
     """Get specific visualization for an analysis"""
@@ -572,17 +613,48 @@ def get_visualization(request, analysis_id, viz_type):
         if str(analysis.get('user_id')) != user['_id']:
             return JsonResponse({"error": "Access denied"}, status=403)
         
-        # Generate requested visualization
-        from apps.utils.emotion_analysis.visualization_generator import generate_visualization
+        if viz_type not in VISUALIZATION_TYPES:
+            return JsonResponse({"error": f"Visualization type '{viz_type}' not supported"}, status=400)
+        
+        chart_format = request.GET.get('format', 'data')
+        if chart_format not in CHART_FORMATS:
+            return JsonResponse({"error": f"format must be one of {', '.join(CHART_FORMATS)}"}, status=400)
         
-        visualization = generate_visualization(analysis, viz_type)
+        # Optional ?width=&height= in pixels
+        size = None
+        if request.GET.get('width') or request.GET.get('height'):
+            try:
+                width = int(request.GET.get('width', 800))
+                height = int(request.GET.get('height', 500))
+            except ValueError:
+                return JsonResponse({"error": "width and height must be integers"}, status=400)
+            size = (min(max(width, MIN_CHART_SIZE), MAX_CHART_SIZE),
+                    min(max(height, MIN_CHART_SIZE), MAX_CHART_SIZE))
+        
+        if chart_format == 'data':
+            chart = generate_visualization(analysis, viz_type, size, format='data')
+            if not chart:
+                return JsonResponse({"error": f"Visualization '{viz_type}' not available for this analysis"}, status=404)
+            
+            return JsonResponse({
+                "chart": chart,
+                "analysis_id": analysis_id,
+                "viz_type": viz_type,
+                "format": chart_format
+            })
+        
+        # PNGs are rendered on first request and served from the chart cache after that
+        visualization = get_or_render_chart(analysis, viz_type, size)
         if not visualization:
-            return JsonResponse({"error": f"Visualization type '{viz_type}' not supported"}, status=400)
+            return JsonResponse({"error": f"Visualization '{viz_type}' not available for this analysis"}, status=404)
+        if is_artifact_ref(visualization):
+            visualization = artifact_url(visualization, request)
         
         return JsonResponse({
             "visualization": visualization,
             "analysis_id": analysis_id,
-            "viz_type": viz_type
+            "viz_type": viz_type,
+            "format": chart_format
         })
         
     except Exception as e:
@@ -614,9 +686,18 @@ def delete_analysis(request, analysis_id):
                 analysis['media_metadata']['public_id'],
                 resource_type=analysis['media_metadata'].get('resource_type', 'image')
             )
-        
+
+        # Videos also keep the unannotated source upload
+        if analysis.get('media_metadata') and analysis['media_metadata'].get('source_public_id'):
+            delete_from_cloudinary(
+                analysis['media_metadata']['source_public_id'],
+                resource_type='video'
+            )
+
         # Delete from database
         result = EmotionAnalysis.delete_analysis(analysis_id, user['_id'])
+        chart_cache.invalidate(analysis_id)
+        delete_artifacts(collect_artifact_ids(analysis.get('visualizations'), analysis.get('results')))
         
         return JsonResponse({
             "success": True,
@@ -627,4 +708,37 @@ def delete_analysis(request, analysis_id):
         logger.error(f"Error in delete_analysis: {str(e)}")
         return JsonResponse({"error": f"Failed to delete analysis: {str(e)}"}, status=500)
 
+def _stream_artifact(artifact):
+    """Yield an artifact in chunks, closing it once the response is done"""
+    try:
+        for chunk in iter(lambda: artifact.stream.read(ARTIFACT_CHUNK_SIZE), b""):
+            yield chunk
+    finally:
+        artifact.stream.close()
 
+@require_http_methods(["GET"])
+def get_artifact(request, artifact_id):
+    """Stream a stored image artifact; access is granted by the signed URL"""
+    expires = request.GET.get('expires')
+    if not verify_artifact_signature(artifact_id, expires, request.GET.get('sig')):
+        return JsonResponse({"error": "Invalid or expired artifact link"}, status=403)
+    
+    # Artifacts never change, so the content hash is a stable validator
+    artifact = get_artifact_store().open(artifact_id)
+    if artifact is None:
+        return JsonResponse({"error": "Artifact not found"}, status=404)
+    
+    etag = f'"{artifact.etag}"'
+    max_age = max(0, int(expires) - int(time.time()))
+    cache_control = f"private, max-age={max_age}, immutable"
+    
+    if request.headers.get('If-None-Match') == etag:
+        artifact.stream.close()
+        response = HttpResponseNotModified()
+    else:
+        response = StreamingHttpResponse(_stream_artifact(artifact), content_type=artifact.content_type)
+        response['Content-Length'] = str(artifact.length)
+    
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,269 @@
+import os
+import sys
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+logger = logging.getLogger(__name__)
+
+# A collection is flushed once this many writes are pending...
+EMOTION_WRITE_BATCH_SIZE = int(os.environ.get("EMOTION_WRITE_BATCH_SIZE", 500))
+
+# ...or its oldest pending write is this many seconds old
+EMOTION_WRITE_FLUSH_SECONDS = float(os.environ.get("EMOTION_WRITE_FLUSH_SECONDS", 5))
+
+# Writes held in memory per collection; the oldest are dropped beyond this
+EMOTION_WRITE_MAX_PENDING = int(os.environ.get("EMOTION_WRITE_MAX_PENDING", 20000))
+
+# Attempts per batch on connection errors before it is put back for the next cycle
+EMOTION_WRITE_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
+DUPLICATE_KEY = 11000
+
+
+def _duplicate_id(error):
+    """ Whether a duplicate key write error is on _id rather than another unique index """
+    key_value = error.get("keyValue")
+    if key_value is not None:
+        return set(key_value) == {"_id"}
+    # Servers before 4.2 only name the index in the message
+    return "index: _id_ " in error.get("errmsg", "")
+
+
+class WriteBehindBuffer:
+    """
+    Per-process write-behind buffer for high-volume emotion writes.
+
+    Callers queue writes without touching the database; a background thread
+    sends each collection's pending writes as one unordered bulk_write when
+    the batch is full or old enough. Memory is bounded per collection, batches
+    are retried on connection errors, and whatever is left is flushed when the
+    process exits.
+
+    on_written(collection_name, operations) and on_dropped(collection_name,
+    operations), if given, are called from the flushing thread once writes
+    land in MongoDB or are given up on.
+    """
+
+    def __init__(self, batch_size=EMOTION_WRITE_BATCH_SIZE, flush_seconds=EMOTION_WRITE_FLUSH_SECONDS,
+                 max_pending=EMOTION_WRITE_MAX_PENDING, on_written=None, on_dropped=None, name="emotion-write-buffer"):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.on_written = on_written
+        self.on_dropped = on_dropped
+        self.name = name
+        self._pending = {}   # collection name -> deque of write operations
+        self._oldest = {}    # collection name -> monotonic time of the oldest pending write
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.dropped = 0
+
+    # -- producer side ------------------------------------------------------
+
+    def insert(self, collection_name, document):
+        """ Queue an insert; returns the document's _id (assigned now so retries stay idempotent) """
+        document.setdefault("_id", ObjectId())
+        self._queue(collection_name, InsertOne(document))
+        return document["_id"]
+
+    def write(self, collection_name, operation):
+        """ Queue any pymongo bulk operation (UpdateOne, ReplaceOne, ...) """
+        self._queue(collection_name, operation)
+
+    def _queue(self, collection_name, operation):
+        with self._lock:
+            queue = self._pending.setdefault(collection_name, deque())
+            if not queue:
+                self._oldest[collection_name] = time.monotonic()
+            queue.append(operation)
+            dropped = None
+            if len(queue) > self.max_pending:
+                dropped = queue.popleft()
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"Write buffer for {collection_name} is full, dropped {self.dropped} writes so far")
+            full = len(queue) >= self.batch_size
+
+        if dropped is not None:
+            self._notify(self.on_dropped, collection_name, [dropped])
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    # -- flushing -----------------------------------------------------------
+
+    def _take(self, collection_name, limit=None):
+        with self._lock:
+            queue = self._pending.get(collection_name)
+            if not queue:
+                return []
+            count = len(queue) if limit is None else min(limit, len(queue))
+            operations = [queue.popleft() for _ in range(count)]
+            if queue:
+                self._oldest[collection_name] = time.monotonic()
+            return operations
+
+    def _requeue(self, collection_name, operations):
+        """ Put a failed batch back at the front, within the memory bound """
+        with self._lock:
+            queue = self._pending.setdefault(collection_name, deque())
+            room = max(0, self.max_pending - len(queue))
+            if room < len(operations):
+                self.dropped += len(operations) - room
+                logger.error(f"Dropped {len(operations) - room} writes to {collection_name} after failed flushes")
+            if not queue:
+                self._oldest[collection_name] = time.monotonic()
+            queue.extendleft(reversed(operations[:room]))
+        if room < len(operations):
+            self._notify(self.on_dropped, collection_name, operations[room:])
+
+    def _notify(self, callback, collection_name, operations):
+        if callback is None or not operations:
+            return
+        try:
+            callback(collection_name, operations)
+        except Exception as e:
+            logger.error(f"Write buffer callback failed for {collection_name}: {str(e)}")
+
+    def _write_batch(self, collection_name, operations):
+        """ bulk_write with retries; returns the operations that still need writing """
+        collection = db[collection_name]
+        for attempt in range(EMOTION_WRITE_RETRIES):
+            try:
+                collection.bulk_write(operations, ordered=False)
+                self._notify(self.on_written, collection_name, operations)
+                return []
+            except BulkWriteError as e:
+                retry = []
+                dropped = []
+                for error in e.details.get("writeErrors", []):
+                    operation = operations[error["index"]]
+                    if error.get("code") == DUPLICATE_KEY and isinstance(operation, InsertOne):
+                        # Only a duplicate _id means the insert already landed on an earlier attempt;
+                        # a clash on any other unique index is a write that never happened
+                        if not _duplicate_id(error):
+                            logger.error(f"Dropping write to {collection_name}: {error.get('errmsg')}")
+                            dropped.append(operation)
+                    elif error.get("code") == DUPLICATE_KEY:
+                        # An upsert raced another writer; the retry matches the document it inserted
+                        retry.append(operation)
+                    else:
+                        logger.error(f"Dropping write to {collection_name}: {error.get('errmsg')}")
+                        dropped.append(operation)
+                failed = {id(operation) for operation in retry + dropped}
+                self._notify(self.on_written, collection_name,
+                             [operation for operation in operations if id(operation) not in failed])
+                self._notify(self.on_dropped, collection_name, dropped)
+                if not retry:
+                    return []
+                operations = retry
+            except ConnectionFailure as e:
+                logger.warning(f"Flushing {len(operations)} writes to {collection_name} failed "
+                               f"(attempt {attempt + 1}/{EMOTION_WRITE_RETRIES}): {str(e)}")
+                time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+            except Exception as e:
+                # Not a connection problem (a document that cannot be encoded, a rejected
+                # operation): retrying the batch cannot help. Write its operations one by one
+                # so only the offending ones are dropped
+                if len(operations) > 1:
+                    logger.warning(f"Flushing {len(operations)} writes to {collection_name} failed, "
+                                   f"writing them one at a time: {str(e)}")
+                    failed = []
+                    for operation in operations:
+                        failed.extend(self._write_batch(collection_name, [operation]))
+                    return failed
+                logger.error(f"Dropping write to {collection_name}: {str(e)}")
+                self._notify(self.on_dropped, collection_name, operations)
+                return []
+        return operations
+
+    def flush(self, collection_name=None, due_only=False):
+        """
+        Write pending operations now. With due_only, only collections whose
+        batch is full or old enough are written. Returns the number written.
+        """
+        written = 0
+        with self._flush_lock:
+            with self._lock:
+                now = time.monotonic()
+                names = [name for name, queue in self._pending.items() if queue and
+                         (collection_name is None or name == collection_name) and
+                         (not due_only or len(queue) >= self.batch_size or
+                          now - self._oldest.get(name, now) >= self.flush_seconds)]
+
+            for name in names:
+                while True:
+                    operations = self._take(name, self.batch_size)
+                    if not operations:
+                        break
+                    failed = self._write_batch(name, operations)
+                    written += len(operations) - len(failed)
+                    if failed:
+                        self._requeue(name, failed)
+                        break
+        return written
+
+    def flush_soon(self):
+        """ Have the background thread write everything pending now, without waiting for it """
+        with self._lock:
+            for name, queue in self._pending.items():
+                if queue:
+                    # Due on the thread's next check regardless of batch size
+                    self._oldest[name] = time.monotonic() - self.flush_seconds
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._pending.values())
+
+    # -- background thread --------------------------------------------------
+
+    def _ensure_thread(self):
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(timeout=min(1.0, self.flush_seconds))
+            self._wakeup.clear()
+            try:
+                self.flush(due_only=True)
+            except Exception as e:
+                logger.error(f"Error flushing {self.name}: {str(e)}")
+
+    def close(self):
+        """ Stop the background thread and write everything still pending """
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            written = self.flush()
+            if written:
+                logger.info(f"Flushed {written} buffered writes of {self.name} on shutdown")
+        except Exception as e:
+            logger.error(f"Could not flush {self.name} on shutdown: {str(e)}")
+
+
+emotion_write_buffer = WriteBehindBuffer()
+atexit.register(emotion_write_buffer.close)
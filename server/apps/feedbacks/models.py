@@ -5,10 +5,25 @@ import os
 # Import MongoDB connection
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 from database import db
+from apps.utils.pagination import keyset_page, ensure_keyset_index
 
 # Feedback collection
 feedback_collection = db["therapist_feedback"]
 
+ensure_keyset_index(feedback_collection, "therapist_id")
+ensure_keyset_index(feedback_collection, "user_id")
+
+# Fields returned by feedback listings
+FEEDBACK_SUMMARY_PROJECTION = {
+    "user_id": 1,
+    "therapist_id": 1,
+    "session_id": 1,
+    "rating": 1,
+    "comment": 1,
+    "is_anonymous": 1,
+    "created_at": 1
+}
+
 class Feedback:
     def __init__(self, user_id, therapist_id, session_id=None, rating=0, 
                  comment=None, is_anonymous=False):
@@ -31,18 +46,30 @@ class Feedback:
         return feedback_collection.find_one({"_id": ObjectId(feedback_id)})
         
     @staticmethod
-    def find_by_therapist(therapist_id, limit=10, skip=0):
+    def find_by_therapist(therapist_id, limit=10, skip=0, projection=None):
         """Get feedback for a specific therapist"""
         return list(feedback_collection.find(
-            {"therapist_id": therapist_id}
+            {"therapist_id": therapist_id}, projection
         ).sort("created_at", -1).skip(skip).limit(limit))
         
     @staticmethod
-    def find_by_user(user_id, limit=10, skip=0):
+    def find_by_user(user_id, limit=10, skip=0, projection=None):
         """Get feedback left by a specific user"""
         return list(feedback_collection.find(
-            {"user_id": user_id}
+            {"user_id": user_id}, projection
         ).sort("created_at", -1).skip(skip).limit(limit))
+
+    @staticmethod
+    def list_by_therapist(therapist_id, limit=10, cursor=None):
+        """Page of feedback for a therapist, newest first; returns (feedback, next_cursor)"""
+        return keyset_page(feedback_collection, {"therapist_id": therapist_id},
+                           FEEDBACK_SUMMARY_PROJECTION, limit, cursor)
+
+    @staticmethod
+    def list_by_user(user_id, limit=10, cursor=None):
+        """Page of feedback left by a user, newest first; returns (feedback, next_cursor)"""
+        return keyset_page(feedback_collection, {"user_id": user_id},
+                           FEEDBACK_SUMMARY_PROJECTION, limit, cursor)
         
     @staticmethod
     def calc_average_rating(therapist_id):
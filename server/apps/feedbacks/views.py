@@ -10,8 +10,9 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 from apps.users.models import User
 from apps.therapists.models import Therapist
-from apps.feedbacks.models import Feedback
+from apps.feedbacks.models import Feedback, FEEDBACK_SUMMARY_PROJECTION
 from apps.utils.auth import get_user_from_request
+from apps.utils.pagination import InvalidCursor
 
 # Helper function (reuse from therapist views)
 # def get_user_from_request(request):
@@ -89,8 +90,21 @@ def get_therapist_feedback(request, therapist_id):
     try:
         limit = int(request.GET.get("limit", 10))
         skip = int(request.GET.get("skip", 0))
+        next_cursor = None
         
-        feedback_list = Feedback.find_by_therapist(therapist_id, limit, skip)
+        # skip is kept for old clients, cursors page in constant time
+        if "skip" in request.GET:
+            feedback_list = Feedback.find_by_therapist(therapist_id, limit, skip,
+                                                       projection=FEEDBACK_SUMMARY_PROJECTION)
+        else:
+            try:
+                feedback_list, next_cursor = Feedback.list_by_therapist(
+                    therapist_id, limit, cursor=request.GET.get("cursor"))
+            except InvalidCursor as e:
+                return JsonResponse({
+                    "success": False,
+                    "message": str(e)
+                }, status=400)
         
         # Process feedback - hide user info if anonymous
         result = []
@@ -111,7 +125,8 @@ def get_therapist_feedback(request, therapist_id):
         return JsonResponse({
             "success": True,
             "count": len(result),
-            "feedback": result
+            "feedback": result,
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
@@ -375,9 +390,21 @@ def get_user_feedback_history(request):
         user_id = str(current_user.get("_id"))
         limit = int(request.GET.get("limit", 10))
         skip = int(request.GET.get("skip", 0))
+        next_cursor = None
         
-        # Get feedback left by this user
-        feedback_list = Feedback.find_by_user(user_id, limit, skip)
+        # Get feedback left by this user; skip is kept for old clients
+        if "skip" in request.GET:
+            feedback_list = Feedback.find_by_user(user_id, limit, skip,
+                                                  projection=FEEDBACK_SUMMARY_PROJECTION)
+        else:
+            try:
+                feedback_list, next_cursor = Feedback.list_by_user(
+                    user_id, limit, cursor=request.GET.get("cursor"))
+            except InvalidCursor as e:
+                return JsonResponse({
+                    "success": False,
+                    "message": str(e)
+                }, status=400)
         result = []
         
         # Process feedback and add related information
@@ -403,7 +430,8 @@ def get_user_feedback_history(request):
         return JsonResponse({
             "success": True,
             "count": len(result),
-            "feedback": result
+            "feedback": result,
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
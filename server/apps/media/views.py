@@ -9,9 +9,10 @@ import os
 # Import models
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 from apps.users.models import User
-from apps.utils.media_helper import MediaStorage
+from apps.utils.media_helper import MediaStorage, MEDIA_SUMMARY_PROJECTION
 from apps.utils.image_helper import delete_from_cloudinary
 from apps.utils.auth import get_user_from_request
+from apps.utils.pagination import InvalidCursor, MAX_PAGE_SIZE
 
 # Helper functions
 # def get_user_from_request(request):
@@ -53,20 +54,37 @@ def get_user_media_library(request):
         
         # Pagination and filtering
         page = int(request.GET.get("page", 1))
-        limit = int(request.GET.get("limit", 10))
+        limit = min(int(request.GET.get("limit", 10)), MAX_PAGE_SIZE)
         skip = (page - 1) * limit
+        next_cursor = None
         
         media_category = request.GET.get("category")  # Filter by category
         media_type = request.GET.get("type")  # Filter by media type
         
-        # Get user media
-        media_list = MediaStorage.find_by_user(
-            user_id, 
-            media_category=media_category,
-            media_type=media_type,
-            limit=limit, 
-            skip=skip
-        )
+        # Get user media; page numbers are kept for old clients, cursors page in constant time
+        if "page" in request.GET:
+            media_list = MediaStorage.find_by_user(
+                user_id, 
+                media_category=media_category,
+                media_type=media_type,
+                limit=limit, 
+                skip=skip,
+                projection=MEDIA_SUMMARY_PROJECTION
+            )
+        else:
+            try:
+                media_list, next_cursor = MediaStorage.list_by_user(
+                    user_id,
+                    media_category=media_category,
+                    media_type=media_type,
+                    limit=limit,
+                    cursor=request.GET.get("cursor")
+                )
+            except InvalidCursor as e:
+                return JsonResponse({
+                    "success": False,
+                    "message": str(e)
+                }, status=400)
         
         # Convert ObjectIds to strings
         media_list = convert_object_ids(media_list)
@@ -75,7 +93,8 @@ def get_user_media_library(request):
             "success": True,
             "page": page,
             "limit": limit,
-            "media": media_list
+            "media": media_list,
+            "next_cursor": next_cursor
         })
         
     except Exception as e:
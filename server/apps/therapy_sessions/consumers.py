@@ -13,6 +13,9 @@ from dotenv import load_dotenv
 from apps.utils.agora_token_helper import generate_rtc_token
 from apps.utils.emotion_analysis import analyze_image
 from apps.emotions.models import EmotionAnalysis
+from apps.emotions.live_points import make_point, queue_point, SOURCE_FRAME, SOURCE_CLIENT
+from apps.emotions.write_buffer import emotion_write_buffer
+from apps.chat_messages.models import Conversation, allocate_sequence
 from apps.utils.emotion_analysis.trend_analyzer import EmotionTrendAnalyzer
 from apps.utils.emotion_analysis.session_summary import SessionSummaryGenerator
 from PIL import Image
@@ -220,6 +223,9 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
                 else:
                     logger.warning(f"Unknown user_role during disconnect: {user_role}")
             
+            # Session end: have the buffer thread write the emotion points and snapshots now
+            emotion_write_buffer.flush_soon()
+            
             # Leave room group
             if hasattr(self, 'room_group_name') and hasattr(self, 'channel_name'):
                 await self.channel_layer.group_discard(
@@ -276,41 +282,19 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
             from database import db
             from bson import ObjectId
             
-            # Generate a unique conversation ID if needed
+            # Resolve the conversation once per connection (one upsert on its canonical key)
             if not hasattr(self, 'video_conversation_id'):
-                # Use consistent ID handling
-                user_id_obj = self.ensure_object_id(self.user_id)
-                other_user_id_obj = self.ensure_object_id(self.other_user_id)
-                session_id_obj = self.ensure_object_id(self.session_id)
-                
-                # CRITICAL FIX: Use synchronous operation first
-                conversations = await database_sync_to_async(list)(db.conversations.find({
-                    "participants": {"$all": [self.user_id, self.other_user_id]},
-                    "session_id": session_id_obj,
-                    "conversation_type": "video_session",
-                }))
-                
-                if conversations and len(conversations) > 0:
-                    self.video_conversation_id = str(conversations[0]["_id"])
-                else:
-                    # Create a new conversation with known serializable fields
-                    conversation_data = {
-                        "_id": ObjectId(),
-                        "participants": [self.user_id, self.other_user_id],
-                        "conversation_type": "video_session",
-                        "session_id": session_id_obj,
-                        "created_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow(),
-                        "metadata": {
-                            "is_video_chat": True,
-                            "video_session_key": f"video_{self.session_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}",
-                            "video_session_start": datetime.utcnow().isoformat()
-                        },
-                        "last_message": None
+                now = datetime.utcnow()
+                self.video_conversation_id = await database_sync_to_async(Conversation.get_or_create)(
+                    participants=[self.user_id, self.other_user_id],
+                    conversation_type="video_session",
+                    session_id=self.ensure_object_id(self.session_id),
+                    metadata={
+                        "is_video_chat": True,
+                        "video_session_key": f"video_{self.session_id}_{now.strftime('%Y%m%d%H%M%S')}",
+                        "video_session_start": now.isoformat()
                     }
-                    
-                    result = await database_sync_to_async(db.conversations.insert_one)(conversation_data)
-                    self.video_conversation_id = str(result.inserted_id)
+                )
             
             # Get the next sequence number - resolve it before creating message_data
             conversation_id_obj = self.ensure_object_id(self.video_conversation_id)
@@ -341,6 +325,15 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
             insert_result = await database_sync_to_async(lambda: db.messages.insert_one(message_data))()
             message_id = insert_result.inserted_id
             
+            # Keep the conversation's last message and unread counters current
+            await database_sync_to_async(Conversation.record_message)(conversation_id_obj, sender_id, {
+                "content": message[:100] if message else "",
+                "sender_id": sender_id,
+                "sent_at": message_data["sent_at"],
+                "message_type": message_type,
+                "sequence": next_sequence
+            })
+            
             # *** ADD THIS CODE - Broadcast message to all users in the channel ***
             await self.channel_layer.group_send(
                 self.room_group_name,
@@ -377,19 +370,8 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
     # Add this helper method for getting next sequence number
     @database_sync_to_async
     def get_next_sequence_number(self, conversation_id):
-        """Get the next sequence number for a message in this conversation"""
-        from database import db
-        
-        # Find the highest sequence number so far
-        last_message = db.messages.find_one(
-            {"conversation_id": conversation_id},
-            sort=[("sequence", -1)]
-        )
-        
-        # Start from 1 or increment from last
-        if last_message and "sequence" in last_message:
-            return last_message["sequence"] + 1
-        return 1
+        """Allocate the next sequence number for a message in this conversation"""
+        return allocate_sequence(conversation_id)
 
     # Add this method to handle chat_message events
     async def chat_message(self, event):
@@ -773,6 +755,13 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
                 
                 self.emotion_data.append(emotion_point)
                 
+                # Every analyzed frame goes to the time-series collection via the write buffer
+                queue_point(make_point(
+                    session_id, user_id, emotion_point["emotions"],
+                    emotion_point["valence"], emotion_point["engagement"],
+                    offset=timestamp, source=SOURCE_FRAME
+                ))
+                
                 # Every 10 frames, perform trend analysis and send updates to therapist
                 if len(self.emotion_data) % 10 == 0 and self.user_role == 'therapist':
                     # Analyze recent trends
@@ -818,8 +807,8 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
             results=analysis_results
         )
         
-        # Save to database asynchronously
-        await database_sync_to_async(analysis.save)()
+        # Queued on the write-behind buffer; written with the next batch
+        analysis.queue_save()
                 
     async def update_emotion_history(self, results):
         """Update emotion history for trend analysis"""
@@ -1047,8 +1036,8 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
             results=analysis_results
         )
         
-        # Save to database asynchronously
-        await database_sync_to_async(analysis.save)()
+        # Queued on the write-behind buffer; written with the next batch
+        analysis.queue_save()
         
     
     async def handle_session_end(self):
@@ -1346,25 +1335,15 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error updating recording status: {str(e)}")
     
-    @database_sync_to_async
-    def store_emotion_data(self, emotions):
-        """Store emotion detection data for analytics"""
+    async def store_emotion_data(self, emotions):
+        """Queue emotions detected by the client for the time-series collection"""
         try:
-            # Create a data point with emotions and metadata
-            emotion_data = {
-                "session_id": ObjectId(self.session_id),
-                "user_id": ObjectId(self.user_id),
-                "emotions": emotions,
-                "timestamp": datetime.utcnow()
-            }
-            
-            # Store in database - you may need to create an EmotionData model
-            # For now, we'll just log it
-            logger.info(f"Emotion data for session {self.session_id}: {emotions}")
-            
-            # If you have an emotions collection:
-            # from apps.emotions.models import EmotionData
-            # EmotionData.create(emotion_data)
+            offset = (datetime.utcnow() - self.session_start_time).total_seconds()
+            queue_point(make_point(
+                self.session_id, self.user_id, emotions,
+                emotions.get("valence", 0), emotions.get("engagement", 0),
+                offset=offset, source=SOURCE_CLIENT
+            ))
             
         except Exception as e:
             logger.error(f"Error storing emotion data: {str(e)}")
@@ -1442,19 +1421,8 @@ class VideoSessionConsumer(AsyncWebsocketConsumer):
         return id_value
         
     async def get_next_sequence_number_async(self, conversation_id):
-        """Get the next sequence number for a message in this conversation"""
-        from database import db
-        
-        # Find the highest sequence number so far
-        last_message = await database_sync_to_async(lambda: db.messages.find_one(
-            {"conversation_id": conversation_id},
-            sort=[("sequence", -1)]
-        ))()
-        
-        # Start from 1 or increment from last
-        if last_message and "sequence" in last_message:
-            return last_message["sequence"] + 1
-        return 1
+        """Allocate the next sequence number for a message in this conversation"""
+        return await database_sync_to_async(allocate_sequence)(conversation_id)
 
 # Add or update these settings for handling WebSocket connections through tunnels
 
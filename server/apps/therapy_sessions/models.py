@@ -19,6 +19,12 @@ sessions_collection = db["therapy_sessions"]
 availability_collection = db["therapist_availability"]
 bookings_collection = db["session_bookings"]
 
+try:
+    # Caseload lookups (distinct clients of a therapist)
+    sessions_collection.create_index([("therapist_id", 1), ("user_id", 1)])
+except Exception as e:
+    logger.warning(f"Could not create therapy session indexes: {str(e)}")
+
 
 class TherapistAvailability:
     def __init__(self, therapist_id, day_of_week, start_time, end_time, recurring=True):
@@ -689,6 +695,17 @@ class TherapySession:
             
         return list(sessions_collection.find(query).sort("start_time", -1).skip(skip).limit(limit))
 
+    @staticmethod
+    def find_client_ids(therapist_id):
+        """Distinct users who have booked sessions with a therapist"""
+        # therapist_id is stored as an ObjectId by most code paths, as a string by some
+        therapist_ids = [str(therapist_id)]
+        if ObjectId.is_valid(str(therapist_id)):
+            therapist_ids.append(ObjectId(str(therapist_id)))
+            
+        client_ids = sessions_collection.distinct("user_id", {"therapist_id": {"$in": therapist_ids}})
+        return list({ObjectId(str(client_id)) for client_id in client_ids if ObjectId.is_valid(str(client_id))})
+
     @staticmethod
     def setup_chat_for_session(session_id, user_id, therapist_id):
         """Creates a conversation for a therapy session after payment"""
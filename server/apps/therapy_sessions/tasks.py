@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
 from bson import ObjectId
 
@@ -69,4 +70,86 @@ def update_session_statuses():
         logger.info(f"Marked {missed_updates.modified_count} sessions as missed")
         
     except Exception as e:
-        logger.error(f"Error updating session statuses: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error updating session statuses: {str(e)}")
+
+
+def process_session_recording(job, progress):
+    """
+    Job handler for session recording uploads.
+
+    The recording is uploaded to Cloudinary while emotion analysis runs on
+    the spooled copy; the recording document is written once both finish.
+    """
+    from apps.utils.cloudinary_helper import upload_file_to_cloudinary
+    from apps.utils.emotion_analysis import analyze_video
+    from apps.emotions.checkpoints import AnalysisCheckpoint
+    from apps.emotions.result_cache import cached_analysis, video_analysis_params
+    from apps.utils.artifact_store import ARTIFACT_RESULT_FIELDS, externalize_artifacts
+
+    payload = job["payload"]
+    temp_path = payload["file_path"]
+    session_id = payload["session_id"]
+    timestamp = payload["timestamp"]
+    extension = payload["extension"]
+
+    progress.stage("processing", 2)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        upload_future = executor.submit(
+            upload_file_to_cloudinary,
+            temp_path,
+            folder=f"therapy_sessions/{session_id}/recordings",
+            public_id=f"rec_{timestamp}",
+            resource_type="video"
+        )
+
+        # Re-uploaded recordings are served from the result cache; long ones
+        # resume from the last checkpoint if a previous attempt died
+        analysis_results = cached_analysis(
+            payload.get("content_hash"),
+            video_analysis_params(render_video=False),
+            lambda: analyze_video(temp_path, progress_callback=progress.scaled(2, 90),
+                                  checkpoint=AnalysisCheckpoint(job["_id"]),
+                                  render_video=False)
+        )
+
+        progress.stage("uploading", 90)
+        cloudinary_upload = upload_future.result()
+
+    if not cloudinary_upload or not cloudinary_upload.get('secure_url'):
+        raise Exception("Failed to upload recording to Cloudinary")
+
+    # Create a thumbnail from the video
+    thumbnail_url = cloudinary_upload.get('thumbnail_url') or cloudinary_upload.get('secure_url').replace('/video/', '/image/').replace(extension, '.jpg')
+
+    progress.stage("saving", 95)
+
+    # Any rendered images go to the artifact store, never into the recording document
+    externalize_artifacts(analysis_results, ARTIFACT_RESULT_FIELDS)
+
+    recording_data = {
+        "session_id": session_id,
+        "media_url": cloudinary_upload.get('secure_url'),
+        "thumbnail_url": thumbnail_url,
+        "public_id": cloudinary_upload.get('public_id'),
+        "created_at": datetime.now(),
+        "duration": payload.get("duration", 0),
+        "filename": payload.get("filename"),
+        "uploaded_by": payload.get("uploaded_by"),
+        "analysis_results": analysis_results
+    }
+
+    recording_id = db.session_recordings.insert_one(recording_data).inserted_id
+
+    # Update session with reference to this recording
+    db.therapy_sessions.update_one(
+        {"_id": ObjectId(session_id)},
+        {"$push": {"recordings": recording_id}}
+    )
+
+    return {
+        "recording_id": str(recording_id),
+        "media_url": cloudinary_upload.get('secure_url'),
+        "thumbnail_url": thumbnail_url,
+        "duration": payload.get("duration", 0)
+    }
@@ -11,6 +11,8 @@ from datetime import datetime, timedelta, timezone
 import logging
 from apps.utils.emotion_analysis import analyze_image, analyze_video
 from apps.utils.cloudinary_helper import upload_file_to_cloudinary
+from apps.emotions.jobs import JobStatus, enqueue_job, spool_upload
+from apps.utils.artifact_store import ARTIFACT_RESULT_FIELDS, resolve_artifact_urls
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -838,72 +840,34 @@ def upload_session_recording(request, session_id):
                     "message": "File must be a video"
                 }, status=400)
             
-            # Create temp file for processing
-            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as temp_file:
-                for chunk in recording_file.chunks():
-                    temp_file.write(chunk)
-                temp_path = temp_file.name
+            # Format filename with session info for better organization
+            timestamp = request.POST.get('timestamp', str(int(time.time())))
+            duration = float(request.POST.get('duration', 0))
             
-            try:
-                # Format filename with session info for better organization
-                timestamp = request.POST.get('timestamp', str(int(time.time())))
-                duration = float(request.POST.get('duration', 0))
-                
-                # Create a recognizable filename pattern
-                filename = f"session_{session_id}_{timestamp}{extension}"
-                
-                # Upload to Cloudinary with proper folder structure
-                cloudinary_upload = upload_file_to_cloudinary(
-                    temp_path,
-                    folder=f"therapy_sessions/{session_id}/recordings",
-                    public_id=f"rec_{timestamp}",
-                    resource_type="video"
-                )
-                
-                if not cloudinary_upload or not cloudinary_upload.get('secure_url'):
-                    raise Exception("Failed to upload recording to Cloudinary")
-                
-                # Create a thumbnail from the video
-                thumbnail_url = cloudinary_upload.get('thumbnail_url') or cloudinary_upload.get('secure_url').replace('/video/', '/image/').replace(extension, '.jpg')
-                
-                # Run emotion analysis on the video
-                analysis_results = analyze_video(temp_path)
-                
-                # Create recording document
-                recording_data = {
-                    "session_id": session_id,
-                    "media_url": cloudinary_upload.get('secure_url'),
-                    "thumbnail_url": thumbnail_url,
-                    "public_id": cloudinary_upload.get('public_id'),
-                    "created_at": datetime.now(),
-                    "duration": duration,
-                    "filename": filename,
-                    "uploaded_by": user_id,
-                    "analysis_results": analysis_results
-                }
-                
-                # Save to database
-                recording_id = db.session_recordings.insert_one(recording_data).inserted_id
-                
-                # Update session with reference to this recording
-                db.therapy_sessions.update_one(
-                    {"_id": ObjectId(session_id)},
-                    {"$push": {"recordings": recording_id}}
-                )
-                
-                return JsonResponse({
-                    "success": True,
-                    "message": "Recording uploaded and processed successfully",
-                    "recording_id": str(recording_id),
-                    "media_url": cloudinary_upload.get('secure_url'),
-                    "thumbnail_url": thumbnail_url,
-                    "duration": duration
-                })
-                
-            finally:
-                # Clean up the temp file
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
+            # Create a recognizable filename pattern
+            filename = f"session_{session_id}_{timestamp}{extension}"
+            
+            # Upload and analysis run in a worker process; the client polls the job
+            spooled_path, content_hash = spool_upload(recording_file, suffix=extension)
+            job_id = enqueue_job("session_recording", ObjectId(user_id), {
+                "file_path": spooled_path,
+                "content_hash": content_hash,
+                "session_id": session_id,
+                "timestamp": timestamp,
+                "duration": duration,
+                "extension": extension,
+                "filename": filename,
+                "uploaded_by": user_id
+            })
+            
+            return JsonResponse({
+                "success": True,
+                "message": "Recording queued for processing",
+                "job_id": str(job_id),
+                "status": JobStatus.QUEUED,
+                "status_url": f"/api/emotions/jobs/{job_id}/",
+                "duration": duration
+            }, status=202)
         else:
             return JsonResponse({
                 "success": False,
@@ -2445,10 +2409,17 @@ def get_session_recordings(request, session_id):
         #     }, status=403)
         
         # Get recordings from the database
-        recordings = list(db.session_recordings.find({"session_id": session_id}))
+        # The full-resolution timeline stays server-side; analysis_results carries the display view
+        recordings = list(db.session_recordings.find(
+            {"session_id": session_id},
+            {"analysis_results.emotion_timeline_full": 0}
+        ))
         
         # Convert ObjectIds to strings
         recordings = [convert_object_ids(rec) for rec in recordings]
+        for rec in recordings:
+            rec["analysis_results"] = resolve_artifact_urls(rec.get("analysis_results"), request,
+                                                            ARTIFACT_RESULT_FIELDS)
         
         return JsonResponse({
             "success": True,
@@ -2508,6 +2479,8 @@ def get_recording_details(request, recording_id):
         
         # Convert ObjectIds to strings for JSON serialization
         recording = convert_object_ids(recording)
+        recording["analysis_results"] = resolve_artifact_urls(recording.get("analysis_results"), request,
+                                                              ARTIFACT_RESULT_FIELDS)
         
         return JsonResponse({
             "success": True,
@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import atexit
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne, ASCENDING
+
+# Ensure we can import database.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db  # Import MongoDB connection
+
+from apps.emotions.write_buffer import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps connections in this process (single node); "mongo" shares them between nodes
+PRESENCE_BACKEND = os.environ.get("PRESENCE_BACKEND", "memory").lower()
+
+# A connection not refreshed for this long counts as gone (crashed worker, lost disconnect)
+PRESENCE_TTL_SECONDS = int(os.environ.get("PRESENCE_TTL_SECONDS", 60))
+
+# How often each process refreshes the connections it holds; well under the TTL
+PRESENCE_HEARTBEAT_SECONDS = int(os.environ.get("PRESENCE_HEARTBEAT_SECONDS", 20))
+
+# last_seen updates are buffered and written to the users collection this often
+PRESENCE_LAST_SEEN_FLUSH_SECONDS = float(os.environ.get("PRESENCE_LAST_SEEN_FLUSH_SECONDS", 30))
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+class MemoryPresenceBackend:
+    """ Connections of this process only; enough when one process serves every websocket """
+
+    def __init__(self):
+        self._connections = {}   # user_id -> {connection_id: expires_at}
+        self._lock = threading.Lock()
+
+    def add(self, user_id, connection_id, expires_at):
+        with self._lock:
+            self._connections.setdefault(user_id, {})[connection_id] = expires_at
+
+    def refresh(self, connections, expires_at):
+        """ Extend the given (user_id, connection_id) pairs and forget expired connections """
+        now = time.time()
+        with self._lock:
+            for user_id, connection_id in connections:
+                self._connections.setdefault(user_id, {})[connection_id] = expires_at
+            for user_id in list(self._connections):
+                alive = {cid: expiry for cid, expiry in self._connections[user_id].items() if expiry > now}
+                if alive:
+                    self._connections[user_id] = alive
+                else:
+                    del self._connections[user_id]
+
+    def remove(self, user_id, connection_id):
+        with self._lock:
+            connections = self._connections.get(user_id, {})
+            connections.pop(connection_id, None)
+            if not connections:
+                self._connections.pop(user_id, None)
+
+    def online(self, user_ids, now):
+        """ The subset of user_ids with at least one live connection """
+        with self._lock:
+            return {user_id for user_id in user_ids
+                    if any(expiry > now for expiry in self._connections.get(user_id, {}).values())}
+
+
+class MongoPresenceBackend:
+    """
+    Connections of every node in a shared collection, one document per
+    connection. A TTL index removes documents whose heartbeats stopped;
+    reads also check expires_at since the TTL monitor only runs every minute.
+    """
+
+    def __init__(self, collection_name="presence_connections"):
+        self.collection = db[collection_name]
+        try:
+            self.collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+            self.collection.create_index([("user_id", ASCENDING), ("expires_at", ASCENDING)])
+        except Exception as e:
+            logger.warning(f"Could not create presence indexes: {str(e)}")
+
+    def add(self, user_id, connection_id, expires_at):
+        self.collection.replace_one(
+            {"_id": connection_id},
+            {"_id": connection_id, "user_id": user_id, "expires_at": datetime.utcfromtimestamp(expires_at)},
+            upsert=True
+        )
+
+    def refresh(self, connections, expires_at):
+        if not connections:
+            return
+        # Upserts: a connection the TTL monitor already removed (late heartbeat) comes back
+        expires_at = datetime.utcfromtimestamp(expires_at)
+        self.collection.bulk_write([
+            UpdateOne({"_id": connection_id},
+                      {"$set": {"user_id": user_id, "expires_at": expires_at}}, upsert=True)
+            for user_id, connection_id in connections
+        ], ordered=False)
+
+    def remove(self, user_id, connection_id):
+        self.collection.delete_one({"_id": connection_id})
+
+    def online(self, user_ids, now):
+        return set(self.collection.distinct("user_id", {
+            "user_id": {"$in": list(user_ids)},
+            "expires_at": {"$gt": datetime.utcfromtimestamp(now)}
+        }))
+
+
+PRESENCE_BACKENDS = {
+    "memory": MemoryPresenceBackend,
+    "mongo": MongoPresenceBackend
+}
+
+
+class PresenceRegistry:
+    """
+    Which users have live websocket connections, across worker processes.
+
+    Consumers register each connection on connect and remove it on
+    disconnect; a per-process heartbeat task keeps the connections this
+    process holds alive, so connections of a crashed worker expire after
+    the TTL. last_seen is written to the users collection lazily, in
+    batches, when a user's last connection goes away.
+    """
+
+    def __init__(self, backend=None, ttl=PRESENCE_TTL_SECONDS, heartbeat=PRESENCE_HEARTBEAT_SECONDS):
+        self.backend = backend or PRESENCE_BACKENDS[PRESENCE_BACKEND]()
+        self.ttl = ttl
+        self.heartbeat_seconds = heartbeat
+        self._local = set()   # (user_id, connection_id) held by this process
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self.last_seen = WriteBehindBuffer(
+            batch_size=500,
+            flush_seconds=PRESENCE_LAST_SEEN_FLUSH_SECONDS,
+            max_pending=20000,
+            name="presence-last-seen"
+        )
+
+    def connect(self, user_id, connection_id):
+        user_id = str(user_id)
+        with self._lock:
+            self._local.add((user_id, connection_id))
+        self.backend.add(user_id, connection_id, time.time() + self.ttl)
+
+    def disconnect(self, user_id, connection_id):
+        """ Remove a connection; returns True if it was the user's last one (now offline) """
+        user_id = str(user_id)
+        with self._lock:
+            self._local.discard((user_id, connection_id))
+        self.backend.remove(user_id, connection_id)
+
+        if self.is_online(user_id):
+            return False
+        self._record_last_seen(user_id)
+        return True
+
+    def get_status(self, user_ids):
+        """ {user_id: "online" | "offline"} for many users in one backend call """
+        user_ids = [str(user_id) for user_id in user_ids if user_id]
+        if not user_ids:
+            return {}
+        online = self.backend.online(set(user_ids), time.time())
+        return {user_id: ONLINE if user_id in online else OFFLINE for user_id in user_ids}
+
+    def is_online(self, user_id):
+        return self.get_status([user_id]).get(str(user_id)) == ONLINE
+
+    def _record_last_seen(self, user_id):
+        if not ObjectId.is_valid(user_id):
+            return
+        # $max keeps batches written out of order from moving last_seen backwards
+        self.last_seen.write("users", UpdateOne(
+            {"_id": ObjectId(user_id)},
+            {"$max": {"last_seen": datetime.utcnow()}}
+        ))
+
+    # -- heartbeats ---------------------------------------------------------
+
+    def refresh(self):
+        """ Extend every connection this process holds """
+        with self._lock:
+            connections = list(self._local)
+        self.backend.refresh(connections, time.time() + self.ttl)
+        return len(connections)
+
+    async def ensure_heartbeat(self):
+        """ Start this process's heartbeat task on the running loop, once """
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.ensure_future(self._beat())
+
+    async def _beat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await loop.run_in_executor(None, self.refresh)
+            except Exception as e:
+                logger.warning(f"Presence heartbeat failed: {str(e)}")
+
+    def close(self):
+        """ Drop this process's connections (clean shutdown) and write pending last_seen values """
+        with self._lock:
+            connections = list(self._local)
+            self._local.clear()
+        for user_id, connection_id in connections:
+            try:
+                self.backend.remove(user_id, connection_id)
+                self._record_last_seen(user_id)
+            except Exception as e:
+                logger.warning(f"Could not remove presence of {user_id}: {str(e)}")
+        self.last_seen.close()
+
+
+presence_registry = PresenceRegistry()
+atexit.register(presence_registry.close)
@@ -0,0 +1,223 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+
+import gridfs
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Import MongoDB connection
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# "gridfs" (default) or "local"
+ARTIFACT_STORE = os.environ.get("ARTIFACT_STORE", "gridfs")
+
+# Directory used by the local store
+ARTIFACT_DIR = os.environ.get(
+    "ARTIFACT_DIR",
+    os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")), "artifacts")
+)
+
+# Signed artifact URLs stay identical for this long, so browsers can cache them
+ARTIFACT_URL_TTL = int(os.environ.get("ARTIFACT_URL_TTL", 24 * 3600))
+
+# Result fields that may hold rendered images (base64 data URIs in older documents)
+ARTIFACT_RESULT_FIELDS = ("visualization", "graph", "timeline_graph", "frame_visualization", "emotion_heatmap")
+
+
+class Artifact:
+    """ An opened artifact: a readable stream plus the metadata needed for HTTP caching """
+
+    def __init__(self, stream, content_type, length, etag):
+        self.stream = stream
+        self.content_type = content_type
+        self.length = length
+        self.etag = etag
+
+
+class GridFSArtifactStore:
+    """ Artifacts as GridFS files in the "artifacts" bucket """
+
+    def __init__(self, bucket_name="artifacts"):
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket_name)
+
+    def put(self, data, content_type):
+        file_id = self.bucket.upload_from_stream(
+            uuid.uuid4().hex, data,
+            metadata={"content_type": content_type, "sha256": hashlib.sha256(data).hexdigest()}
+        )
+        return str(file_id)
+
+    def open(self, artifact_id):
+        try:
+            grid_out = self.bucket.open_download_stream(ObjectId(artifact_id))
+        except (gridfs.errors.NoFile, InvalidId):
+            return None
+        metadata = grid_out.metadata or {}
+        return Artifact(grid_out, metadata.get("content_type", "application/octet-stream"),
+                        grid_out.length, metadata.get("sha256", artifact_id))
+
+    def delete(self, artifact_id):
+        try:
+            self.bucket.delete(ObjectId(artifact_id))
+        except (gridfs.errors.NoFile, InvalidId):
+            pass
+
+
+class LocalArtifactStore:
+    """ Artifacts as files under ARTIFACT_DIR with a JSON sidecar for metadata """
+
+    def __init__(self, directory=ARTIFACT_DIR):
+        self.directory = directory
+
+    def _path(self, artifact_id):
+        # Ids are generated here; refuse anything that could escape the directory
+        if not artifact_id.isalnum():
+            return None
+        return os.path.join(self.directory, artifact_id[:2], artifact_id)
+
+    def put(self, data, content_type):
+        artifact_id = uuid.uuid4().hex
+        path = self._path(artifact_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        with open(f"{path}.json", "w") as f:
+            json.dump({"content_type": content_type, "sha256": hashlib.sha256(data).hexdigest()}, f)
+        return artifact_id
+
+    def open(self, artifact_id):
+        path = self._path(artifact_id)
+        if not path or not os.path.exists(path):
+            return None
+        with open(f"{path}.json") as f:
+            metadata = json.load(f)
+        return Artifact(open(path, "rb"), metadata["content_type"], os.path.getsize(path), metadata["sha256"])
+
+    def delete(self, artifact_id):
+        path = self._path(artifact_id)
+        if not path:
+            return
+        for file_path in (path, f"{path}.json"):
+            if os.path.exists(file_path):
+                os.unlink(file_path)
+
+
+_store = None
+
+
+def get_artifact_store():
+    """ The configured artifact store (GridFS unless ARTIFACT_STORE=local) """
+    global _store
+    if _store is None:
+        _store = LocalArtifactStore() if ARTIFACT_STORE == "local" else GridFSArtifactStore()
+    return _store
+
+
+# ---------------------------------------------------------------------------
+# References stored in documents
+# ---------------------------------------------------------------------------
+
+def is_artifact_ref(value):
+    return isinstance(value, dict) and "artifact_id" in value
+
+
+def is_data_uri(value):
+    return isinstance(value, str) and value.startswith("data:") and ";base64," in value
+
+
+def store_data_uri(data_uri):
+    """ Move a base64 data URI into the artifact store and return the reference to keep instead """
+    header, encoded = data_uri.split(",", 1)
+    content_type = header[len("data:"):].split(";")[0] or "application/octet-stream"
+    data = base64.b64decode(encoded)
+    artifact_id = get_artifact_store().put(data, content_type)
+    return {"artifact_id": artifact_id, "content_type": content_type, "size": len(data)}
+
+
+def externalize_artifacts(container, fields):
+    """
+    Replace data URIs in container[field] with artifact references, in place.
+    Identical images (e.g. the annotated image kept both in results and in
+    visualizations) are stored once. Returns the number of artifacts written.
+    """
+    stored = {}
+    for field in fields:
+        value = container.get(field)
+        if not is_data_uri(value):
+            continue
+        if value not in stored:
+            stored[value] = store_data_uri(value)
+        container[field] = stored[value]
+    return len(stored)
+
+
+def collect_artifact_ids(*containers):
+    """ Artifact ids referenced anywhere in the given dicts (one level deep) """
+    return {value["artifact_id"] for container in containers if container
+            for value in container.values() if is_artifact_ref(value)}
+
+
+def delete_artifacts(artifact_ids):
+    store = get_artifact_store()
+    for artifact_id in artifact_ids:
+        try:
+            store.delete(artifact_id)
+        except Exception as e:
+            logger.warning(f"Could not delete artifact {artifact_id}: {str(e)}")
+
+
+# ---------------------------------------------------------------------------
+# Signed URLs
+# ---------------------------------------------------------------------------
+
+def _signature(artifact_id, expires):
+    from django.conf import settings
+    message = f"{artifact_id}:{expires}".encode("utf-8")
+    return hmac.new(settings.SECRET_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()[:32]
+
+
+def sign_artifact(artifact_id, now=None):
+    """ (expires, signature) for an artifact; stable within an ARTIFACT_URL_TTL window """
+    now = int(now or time.time())
+    # Valid for at least one full TTL; the same URL is handed out for the whole window
+    expires = (now // ARTIFACT_URL_TTL + 2) * ARTIFACT_URL_TTL
+    return expires, _signature(artifact_id, expires)
+
+
+def verify_artifact_signature(artifact_id, expires, signature):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_signature(artifact_id, expires), signature or "")
+
+
+def artifact_url(ref, request=None):
+    """ Signed URL of the streaming endpoint for a reference """
+    artifact_id = ref["artifact_id"]
+    expires, signature = sign_artifact(artifact_id)
+    path = f"/api/emotions/artifacts/{artifact_id}/?expires={expires}&sig={signature}"
+    return request.build_absolute_uri(path) if request is not None else path
+
+
+def resolve_artifact_urls(container, request=None, fields=None):
+    """ Copy of container with artifact references replaced by signed URLs """
+    if not container:
+        return container
+    resolved = dict(container)
+    for field in (fields or list(resolved)):
+        if is_artifact_ref(resolved.get(field)):
+            resolved[field] = artifact_url(resolved[field], request)
+    return resolved
@@ -8,6 +8,7 @@ sys.path.append(parent_dir)
 from .analyzer import (
     analyze_image,
     analyze_video,
+    get_model_version,
     CLASS_LABELS,
     VALENCE_WEIGHTS,
     ENGAGEMENT_WEIGHTS
@@ -3,21 +3,19 @@ import sys
 import torch
 import logging
 import cv2
-import uuid
-import base64
-from io import BytesIO
 from datetime import datetime
 from torchvision import transforms
 import numpy as np
 
 # Import specialized processors
 from .image_processor import (
-    load_image, detect_faces, analyze_face, generate_visualization, 
-    generate_emotion_graph, enhance_face_quality
+    load_image, detect_faces, analyze_face, generate_visualization, enhance_face_quality
 )
+from .video_renderer import AnnotatedVideoRenderer, estimate_output_fps
+from .timeline import compact_timeline, decimate_timeline, key_frames, TIMELINE_DISPLAY_POINTS
 from .video_processor import (
-    extract_frames, apply_temporal_smoothing, generate_timeline_graph,
-    get_optimal_sampling_rate, detect_emotion_changes, create_framewise_visualization
+    extract_frames, extract_frames_adaptive, apply_temporal_smoothing,
+    get_optimal_sampling_rate, detect_emotion_changes, ADAPTIVE_FRAMES_PER_MINUTE
 )
 
 # Add parent directory to path to allow importing ResEmoteNet
@@ -35,9 +33,32 @@ CLASS_LABELS = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise
 VALENCE_WEIGHTS = [-0.8, -0.7, -0.6, 0.8, 0, -0.5, 0.7]  # Approximate Valence Scores
 ENGAGEMENT_WEIGHTS = [0.6, 0.8, 0.7, 1.0, 0.3, 0.5, 0.9]  # Expressiveness Scores
 
+# Seconds of video analyzed between checkpoints for resumable analysis
+CHECKPOINT_INTERVAL_SECONDS = 30
+
 # Model path
 MODEL_PATH = os.path.join(parent_dir, 'best_finetuned_ResEmoteNet.pth')
 
+_model_version_cache = {}
+
+def get_model_version():
+    """Fingerprint of the model artifact; changes whenever the weights file is replaced"""
+    try:
+        stat = os.stat(MODEL_PATH)
+    except OSError:
+        return "missing"
+    
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if _model_version_cache.get("stamp") != stamp:
+        import hashlib
+        digest = hashlib.sha256()
+        with open(MODEL_PATH, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _model_version_cache["stamp"] = stamp
+        _model_version_cache["version"] = digest.hexdigest()[:16]
+    return _model_version_cache["version"]
+
 # Image transformations
 def get_transform():
     """Get image transformations for model input"""
@@ -153,14 +174,10 @@ def analyze_image(image_path_or_obj, return_visualization=False):
             results["overall"]["dominant_emotion"] = max(emotion_counts, key=emotion_counts.get)
         
         # Generate visualization if requested
+        # (charts are rendered on demand by visualization_generator)
         if return_visualization:
             results["visualization"] = generate_visualization(image, results["faces"])
         
-        # Generate emotion graph
-        if results["faces"]:
-            graph_data = results["faces"][0]  # Use first face for graph
-            results["graph"] = generate_emotion_graph(graph_data)
-        
         return results
         
     except Exception as e:
@@ -170,31 +187,56 @@ def analyze_image(image_path_or_obj, return_visualization=False):
         return {"error": f"Error analyzing image: {str(e)}"}
 
 # Video analysis
-def analyze_video(video_path, sample_rate=None):
+def analyze_video(video_path, sample_rate=None, progress_callback=None,
+                  checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL_SECONDS,
+                  frames_per_minute=ADAPTIVE_FRAMES_PER_MINUTE, render_video=True):
     """
     Enhanced analysis of emotions in a video with improved face detection
+    
+    Args:
+        video_path: Path to the video file
+        sample_rate: Fraction of frames to analyze at fixed intervals; if None, frames
+            are picked by the adaptive scene-change sampler
+        frames_per_minute: Frame budget of the adaptive sampler
+        progress_callback: Optional callable(done, total) invoked after each sampled frame
+        checkpoint: Optional store with ``load(signature)`` and
+            ``save_segment(signature, segment)``; partial results are saved every
+            ``checkpoint_interval`` seconds of video and a later call with the same
+            store resumes after the last saved segment
+        checkpoint_interval: Seconds of video covered by each checkpoint segment
+        render_video: Stream an annotated preview video while analyzing; its path is
+            returned as ``annotated_video_path``. Pass False when the caller
+            does not need the video.
     """
     model, device = load_model()
     if model is None:
         return {"error": "Failed to load emotion model"}
     
     transform = get_transform()
+    renderer = None
     
     try:
         # Extract video information and frames
-        video_info, frames = extract_frames(video_path, sample_rate or 0.2)
+        if sample_rate:
+            video_info, frames = extract_frames(video_path, sample_rate)
+            sampling = f"rate={sample_rate}"
+        else:
+            # Dense around scene/expression changes, sparse in static stretches
+            video_info, frames = extract_frames_adaptive(video_path, frames_per_minute=frames_per_minute)
+            sampling = f"adaptive={frames_per_minute}"
+            if not frames:
+                # OpenCV cannot decode some browser recordings; use fixed-rate extraction
+                duration = video_info["duration"] if video_info else 0
+                fallback_rate = get_optimal_sampling_rate(duration)
+                video_info, frames = extract_frames(video_path, fallback_rate)
+                sampling = f"rate={fallback_rate}"
+        
         if not video_info:
             return {"error": "Failed to open video file"}
         
         if not frames:
             return {"error": "No frames could be extracted from video"}
         
-        # Optimize sampling rate based on video length
-        if not sample_rate:
-            sample_rate = get_optimal_sampling_rate(video_info["duration"])
-            # Re-extract frames with optimal rate if not specified
-            video_info, frames = extract_frames(video_path, sample_rate)
-        
         logger.info(f"Processing video: {len(frames)} frames extracted, duration: {video_info['duration']:.2f}s")
         
         # Initialize results
@@ -221,6 +263,30 @@ def analyze_video(video_path, sample_rate=None):
         # Store recent emotions for smoothing
         recent_emotions = []
         
+        # Resume from the last saved segment when a checkpoint exists
+        signature = f"{os.path.basename(video_path)}:{sampling}:{len(frames)}"
+        resume_after = 0
+        segment_start = frames[0][1]
+        if checkpoint is not None:
+            saved = checkpoint.load(signature)
+            if saved:
+                results["frames"] = saved["frames"]
+                for emotion in CLASS_LABELS:
+                    results["overall"]["emotion_timeline"][emotion] = saved["timeline"].get(emotion, [])
+                    all_emotions[emotion] = saved["emotion_samples"].get(emotion, [])
+                all_valences = saved["valences"]
+                all_engagements = saved["engagements"]
+                face_count_total = saved["face_count_total"]
+                frames_with_faces = saved["frames_with_faces"]
+                recent_emotions = saved["recent_emotions"]
+                resume_after = saved["processed"]
+                segment_start = saved["last_timestamp"]
+                logger.info(f"Resuming video analysis after {resume_after} frames "
+                            f"({segment_start:.2f}s) from checkpoint")
+        
+        # Lengths already covered by saved segments; each segment stores only what follows
+        saved_marks = _checkpoint_marks(results, all_emotions, all_valences, all_engagements)
+        
         # Use MTCNN for better face detection if available
         try:
             from facenet_pytorch import MTCNN
@@ -231,7 +297,18 @@ def analyze_video(video_path, sample_rate=None):
             use_mtcnn = False
             logger.info("MTCNN not available, using OpenCV cascade classifier")
         
-        for frame_idx, timestamp, frame in frames:
+        # Annotated preview is encoded on a background thread while frames are analyzed
+        if render_video:
+            first_height, first_width = frames[0][2].shape[:2]
+            renderer = AnnotatedVideoRenderer(first_width, first_height, estimate_output_fps(frames))
+        
+        for processed, (frame_idx, timestamp, frame) in enumerate(frames, start=1):
+            if processed <= resume_after:
+                # Restored frames still need to appear in the rendered video
+                if renderer is not None:
+                    renderer.submit(frame, timestamp, results["frames"][processed - 1])
+                continue
+            
             # Detect faces with improved accuracy
             if use_mtcnn:
                 # Convert BGR to RGB for MTCNN
@@ -334,6 +411,44 @@ def analyze_video(video_path, sample_rate=None):
                         continue
             
             results["frames"].append(frame_result)
+            if renderer is not None:
+                renderer.submit(frame, timestamp, frame_result)
+            
+            # Persist a segment once enough video time has been analyzed
+            if checkpoint is not None and (timestamp - segment_start >= checkpoint_interval
+                                           or processed == len(frames)):
+                checkpoint.save_segment(signature, {
+                    "processed": processed,
+                    "last_timestamp": timestamp,
+                    "face_count_total": face_count_total,
+                    "frames_with_faces": frames_with_faces,
+                    "recent_emotions": list(recent_emotions),
+                    "frames": results["frames"][saved_marks["frames"]:],
+                    "timeline": {
+                        emotion: points[saved_marks["timeline"][emotion]:]
+                        for emotion, points in results["overall"]["emotion_timeline"].items()
+                    },
+                    "emotion_samples": {
+                        emotion: probs[saved_marks["emotion_samples"][emotion]:]
+                        for emotion, probs in all_emotions.items()
+                    },
+                    "valences": all_valences[saved_marks["valences"]:],
+                    "engagements": all_engagements[saved_marks["engagements"]:]
+                })
+                saved_marks = _checkpoint_marks(results, all_emotions, all_valences, all_engagements)
+                segment_start = timestamp
+            
+            if progress_callback:
+                progress_callback(processed, len(frames))
+        
+        if renderer is not None:
+            annotated_video_path = renderer.finish()
+            renderer = None
+            if annotated_video_path:
+                if frames_with_faces > 0:
+                    results["annotated_video_path"] = annotated_video_path
+                elif os.path.exists(annotated_video_path):
+                    os.unlink(annotated_video_path)
         
         # Calculate overall metrics if any faces were detected
         results["face_detected"] = frames_with_faces > 0
@@ -370,12 +485,20 @@ def analyze_video(video_path, sample_rate=None):
             
             # Detect significant emotion changes
             results["emotion_changes"] = detect_emotion_changes(results["overall"]["emotion_timeline"])
+            
+            # Keep the full-resolution timeline columnar; the inline timeline becomes an LTTB view
+            results["emotion_timeline_full"] = compact_timeline(results["frames"], CLASS_LABELS)
+            results["overall"]["emotion_timeline"] = decimate_timeline(
+                results["emotion_timeline_full"], TIMELINE_DISPLAY_POINTS
+            )
         else:
             logger.warning("No faces detected in any video frames")
             results["error"] = "No faces detected in video frames"
         
-        # Generate enhanced visualization
-        results = _generate_enhanced_visualizations(results, frames)
+        # Per-frame results are only kept as key frames; the timelines above carry the rest
+        results["frames_analyzed"] = len(results["frames"])
+        results["frames_with_faces"] = frames_with_faces
+        results["key_frames"] = key_frames(results.pop("frames"))
         
         return results
         
@@ -384,50 +507,27 @@ def analyze_video(video_path, sample_rate=None):
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
         return {"error": f"Error analyzing video: {str(e)}"}
+    finally:
+        # Reached with a live renderer only on errors or cancellation
+        if renderer is not None:
+            renderer.abort()
+            if os.path.exists(renderer.output_path):
+                os.unlink(renderer.output_path)
+
+def _checkpoint_marks(results, all_emotions, all_valences, all_engagements):
+    """Current lengths of every list that checkpoint segments append to"""
+    return {
+        "frames": len(results["frames"]),
+        "timeline": {emotion: len(points) for emotion, points in results["overall"]["emotion_timeline"].items()},
+        "emotion_samples": {emotion: len(probs) for emotion, probs in all_emotions.items()},
+        "valences": len(all_valences),
+        "engagements": len(all_engagements)
+    }
 
-def _generate_enhanced_visualizations(results, frames):
-    """Generate all visualizations for video analysis"""
-    try:
-        # Generate timeline graph showing emotion changes over time
-        if results["overall"]["emotion_timeline"]:
-            timeline_graph = generate_timeline_graph(results["overall"]["emotion_timeline"])
-            if timeline_graph:
-                results["timeline_graph"] = timeline_graph
-        
-        # Generate frame visualization showing detected faces and emotions
-        if frames and results["frames"]:
-            frame_viz = create_framewise_visualization(frames, results["frames"])
-            if frame_viz:
-                results["frame_visualization"] = frame_viz
-        
-        # Generate emotional intensity heatmap
-        if results.get("overall", {}).get("emotions"):
-            results["emotion_heatmap"] = generate_emotion_heatmap(results["overall"]["emotions"])
-        
-        # Generate annotated video preview - REMOVE MAX_DURATION PARAMETER
-        if frames and results["face_detected"]:
-            try:
-                # This is the key change - no max_duration parameter!
-                annotated_video_path = create_annotated_video_preview(
-                    frames, results["frames"]
-                )
-                
-                # Store the path for later processing
-                if annotated_video_path:
-                    results["annotated_video_path"] = annotated_video_path
-                    
-            except Exception as viz_err:
-                logger.warning(f"Error creating annotated video: {str(viz_err)}")
-        
-        return results
-        
-    except Exception as e:
-        logger.error(f"Error generating visualizations: {str(e)}")
-        return results
 def create_annotated_video_preview(frames, frame_results, max_duration=None):
     """
     Create an annotated video preview showing emotions in real-time
-    Now preserves original video length and framerate
+    Preserves original video length and framerate
     
     Args:
         frames: List of (frame_idx, timestamp, frame) tuples
@@ -441,251 +541,26 @@ def create_annotated_video_preview(frames, frame_results, max_duration=None):
         if not frames or not frame_results:
             return None
         
-        # Get dimensions of first frame
-        _, _, first_frame = frames[0]
-        height, width, _ = first_frame.shape
-        
-        # Get the original video framerate (estimated from timestamps)
-        if len(frames) > 1:
-            timestamps = [timestamp for _, timestamp, _ in frames]
-            avg_time_diff = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
-            original_fps = 1.0 / avg_time_diff if avg_time_diff > 0 else 30.0
-        else:
-            original_fps = 30.0  # Default if can't calculate
-            
-        logger.info(f"Original video estimated at {original_fps:.2f} fps")
-        
-        # Calculate video duration for logging
+        selected_frames = list(zip(frames, frame_results))
         video_duration = frames[-1][1] - frames[0][1] if len(frames) > 1 else 0
-        logger.info(f"Original video duration: {video_duration:.2f} seconds")
-        
-        # Use all frames by default, or limit if max_duration is specified
-        if max_duration and len(frames) > 1:
-            if video_duration > max_duration:
-                # Keep fps but reduce frames
-                sample_ratio = max_duration / video_duration
-                step = max(1, int(1.0 / sample_ratio))
-                selected_indices = range(0, len(frames), step)
-                selected_frames = []
-                for i in selected_indices:
-                    if i < len(frame_results):
-                        selected_frames.append((frames[i], frame_results[i]))
-                logger.info(f"Limiting video from {video_duration:.2f}s to {max_duration:.2f}s, keeping {len(selected_frames)} of {len(frames)} frames")
-            else:
-                selected_frames = list(zip(frames, frame_results))
-        else:
-            # Use all frames for full duration
-            selected_frames = list(zip(frames, frame_results))
-            
-        logger.info(f"Creating annotated video with {len(selected_frames)} frames at {original_fps:.2f} fps")
-            
-        # Create output video file with temporary path
-        temp_path = f"/tmp/annotated_video_{uuid.uuid4().hex}.mp4"
-        
-        # Use H.264 codec which is better supported by Cloudinary
-        fourcc = cv2.VideoWriter_fourcc(*'avc1')
         
-        # Use original fps (capped between 15-60 fps for compatibility)
-        output_fps = max(15, min(60, original_fps))
+        # Keep fps but reduce frames if max_duration is specified
+        if max_duration and video_duration > max_duration:
+            step = max(1, int(video_duration / max_duration))
+            selected_frames = selected_frames[::step]
+            logger.info(f"Limiting video from {video_duration:.2f}s to {max_duration:.2f}s, keeping {len(selected_frames)} of {len(frames)} frames")
         
-        # Create video writer
-        out = cv2.VideoWriter(temp_path, fourcc, output_fps, (width, height))
-        if not out.isOpened():
-            # Fallback to other codecs if H.264 is not available
-            logger.warning("Failed to create video with avc1 codec, trying mp4v")
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(temp_path, fourcc, output_fps, (width, height))
-        
-        if not out.isOpened():
-            raise Exception("Could not create video writer")
+        _, _, first_frame = frames[0]
+        height, width = first_frame.shape[:2]
+        renderer = AnnotatedVideoRenderer(width, height, estimate_output_fps(frames))
         
-        # Process each frame with annotations
         for (frame_idx, timestamp, frame), frame_result in selected_frames:
-            # Create a copy to avoid modifying original
-            annotated = frame.copy()
-            
-            # Add timestamp
-            cv2.putText(annotated, f"Time: {timestamp:.2f}s", (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            
-            # Add faces and emotions
-            for face_data in frame_result.get("faces", []):
-                # Get face position
-                x = face_data["position"]["x"]
-                y = face_data["position"]["y"]
-                w = face_data["position"]["width"]
-                h = face_data["position"]["height"]
-                
-                # Draw face rectangle
-                emotion = face_data["dominant_emotion"]
-                confidence = face_data["confidence"]
-                
-                # Choose color based on emotion
-                color = get_emotion_color(emotion)
-                
-                # Draw rectangle around face
-                cv2.rectangle(annotated, (x, y), (x+w, y+h), color, 2)
-                
-                # Add emotion label
-                label = f"{emotion} ({confidence:.0%})"
-                cv2.putText(annotated, label, (x, y-10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                
-                # Add valence and engagement meters
-                valence = face_data["valence"]
-                engagement = face_data["engagement"]
-                
-                # Valence meter (negative to positive)
-                meter_width = 60
-                meter_height = 10
-                meter_x = x + w + 10
-                meter_y = y
-                
-                # Draw valence background
-                cv2.rectangle(annotated, 
-                             (meter_x, meter_y), 
-                             (meter_x + meter_width, meter_y + meter_height),
-                             (100, 100, 100), -1)
-                
-                # Calculate valence position (map from -1,1 to 0,meter_width)
-                val_pos = int((valence + 1) / 2 * meter_width)
-                val_color = (0, 0, 255) if valence < 0 else (0, 255, 0)  # Red for negative, green for positive
-                
-                # Draw valence indicator
-                cv2.rectangle(annotated,
-                             (meter_x, meter_y),
-                             (meter_x + val_pos, meter_y + meter_height),
-                             val_color, -1)
-                
-                # Label
-                cv2.putText(annotated, "Valence", (meter_x, meter_y - 5),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-                
-                # Engagement meter
-                eng_meter_y = meter_y + meter_height + 15
-                
-                # Draw engagement background
-                cv2.rectangle(annotated,
-                             (meter_x, eng_meter_y),
-                             (meter_x + meter_width, eng_meter_y + meter_height),
-                             (100, 100, 100), -1)
-                
-                # Draw engagement indicator
-                eng_pos = int(engagement * meter_width)
-                cv2.rectangle(annotated,
-                             (meter_x, eng_meter_y),
-                             (meter_x + eng_pos, eng_meter_y + meter_height),
-                             (255, 165, 0), -1)  # Orange for engagement
-                
-                # Label
-                cv2.putText(annotated, "Engagement", (meter_x, eng_meter_y - 5),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-                
-                # Add emotion bars at the bottom for the primary face
-                if face_data.get("face_id", -1) == 0:
-                    # Draw emotion bars at the bottom
-                    emotions = face_data.get("emotions", {})
-                    if emotions:
-                        emotion_bar_height = 30
-                        emotion_bar_y = height - emotion_bar_height - 10
-                        emotion_bar_width = width // len(emotions)
-                        
-                        for i, (emotion_name, value) in enumerate(emotions.items()):
-                            # Calculate position
-                            bar_x = i * emotion_bar_width
-                            bar_height = int(value * emotion_bar_height)
-                            
-                            # Draw bar background
-                            cv2.rectangle(annotated,
-                                        (bar_x, emotion_bar_y),
-                                        (bar_x + emotion_bar_width, height - 10),
-                                        (30, 30, 30), -1)
-                            
-                            # Draw emotion value
-                            cv2.rectangle(annotated,
-                                        (bar_x, height - 10 - bar_height),
-                                        (bar_x + emotion_bar_width, height - 10),
-                                        get_emotion_color(emotion_name), -1)
-                            
-                            # Add label
-                            cv2.putText(annotated, f"{emotion_name}",
-                                       (bar_x + 5, height - 15),
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-            
-            # Write frame to output video
-            out.write(annotated)
-        
-        # Release video writer
-        out.release()
+            renderer.submit(frame, timestamp, frame_result)
         
-        # IMPORTANT: Return the path to the file (don't convert to base64)
-        logger.info(f"Created annotated video at {temp_path}")
-        return temp_path
+        return renderer.finish()
         
     except Exception as e:
         logger.error(f"Error creating annotated video: {str(e)}")
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
         return None
-
-def get_emotion_color(emotion):
-    """Get color for emotion visualization"""
-    colors = {
-        'happy': (0, 255, 0),     # Green
-        'sad': (255, 0, 0),       # Blue (BGR)
-        'angry': (0, 0, 255),     # Red
-        'fear': (0, 0, 128),      # Dark Red
-        'neutral': (128, 128, 128), # Gray
-        'surprise': (0, 255, 255),  # Yellow
-        'disgust': (128, 0, 128)    # Purple
-    }
-    return colors.get(emotion, (200, 200, 200))  # Default gray
-
-def generate_emotion_heatmap(emotions):
-    """Generate a heatmap visualization of emotions"""
-    try:
-        import matplotlib
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
-        import seaborn as sns
-        
-        # Create figure
-        fig, ax = plt.subplots(figsize=(10, 6), dpi=100)
-        
-        # Prepare data
-        emotions_sorted = sorted(emotions.items(), key=lambda x: x[1], reverse=True)
-        labels = [e[0].capitalize() for e in emotions_sorted]
-        values = [e[1] for e in emotions_sorted]
-        
-        # Create heatmap-style bar chart
-        cmap = plt.cm.get_cmap('viridis')
-        bars = ax.barh(labels, values, color=[cmap(v) for v in values])
-        
-        # Add value labels
-        for i, v in enumerate(values):
-            ax.text(v + 0.01, i, f'{v:.2f}', va='center')
-        
-        # Customize chart
-        ax.set_title('Emotion Distribution', fontsize=14)
-        ax.set_xlim(0, max(values) * 1.1)
-        
-        # Add color bar
-        sm = plt.cm.ScalarMappable(cmap=cmap)
-        sm.set_array([])
-        cbar = fig.colorbar(sm)
-        cbar.set_label('Intensity')
-        
-        # Convert to image
-        buf = BytesIO()
-        fig.tight_layout()
-        plt.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        
-        # Convert to base64 for embedding in HTML
-        graph_img = base64.b64encode(buf.getvalue()).decode('utf-8')
-        return f"data:image/png;base64,{graph_img}"
-        
-    except Exception as e:
-        logger.error(f"Error generating emotion heatmap: {str(e)}")
-        return None
\ No newline at end of file
@@ -0,0 +1,306 @@
+import os
+import base64
+import logging
+import threading
+import multiprocessing
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Chart render processes; matplotlib is neither thread-safe nor GIL-free
+CHART_RENDER_WORKERS = int(os.environ.get("CHART_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Seconds a request waits for its chart before giving up
+CHART_RENDER_TIMEOUT = float(os.environ.get("CHART_RENDER_TIMEOUT", 30))
+
+# Figure templates kept alive per worker process
+MAX_TEMPLATES = 32
+
+# Colors used by generate_emotion_graph (valence based)
+POSITIVE_EMOTIONS = ('happy', 'surprise')
+NEGATIVE_EMOTIONS = ('angry', 'fear', 'disgust', 'sad')
+
+
+# ---------------------------------------------------------------------------
+# Worker side: figure templates
+# ---------------------------------------------------------------------------
+
+def _figure_to_data_uri(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format='png')
+    return f"data:image/png;base64,{base64.b64encode(buf.getvalue()).decode('utf-8')}"
+
+
+class _BarTemplate:
+    """
+    Horizontal bar chart (bar chart, emotion graph, heatmap) with one bar per
+    emotion. Rendering only moves bars and value labels; the layout is computed
+    once on the first render.
+    """
+
+    def __init__(self, width, height, title, count, title_size=None, colorbar=False):
+        import matplotlib.pyplot as plt
+
+        self.fig, self.ax = plt.subplots(figsize=(width/100, height/100), dpi=100)
+        self.bars = self.ax.barh(range(count), [0] * count)
+        self.texts = [self.ax.text(0, i, '', va='center') for i in range(count)]
+        self.ax.set_yticks(range(count))
+        self.ax.set_title(title, fontsize=title_size)
+        self.ax.set_xlim(0, 1.0)
+        if colorbar:
+            sm = plt.cm.ScalarMappable(cmap=plt.get_cmap('viridis'))
+            sm.set_array([])
+            self.fig.colorbar(sm, ax=self.ax).set_label('Intensity')
+        self.laid_out = False
+
+    def render(self, labels, values, colors, xlim=1.0):
+        for i, (value, color) in enumerate(zip(values, colors)):
+            self.bars[i].set_width(value)
+            self.bars[i].set_color(color)
+            self.texts[i].set_position((value + 0.01, i))
+            self.texts[i].set_text(f'{value:.2f}')
+        self.ax.set_yticklabels(labels)
+        self.ax.set_xlim(0, xlim)
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+        return _figure_to_data_uri(self.fig)
+
+
+class _TimelineTemplate:
+    """Line per emotion over time; rendering swaps line data and rebuilds the legend"""
+
+    def __init__(self, width, height, title, emotions):
+        import matplotlib.pyplot as plt
+
+        self.fig, self.ax = plt.subplots(figsize=(width/100, height/100), dpi=100)
+        self.lines = {
+            emotion: self.ax.plot([], [], label=emotion, marker='o', markersize=3)[0]
+            for emotion in emotions
+        }
+        self.ax.set_xlabel('Time (seconds)')
+        self.ax.set_ylabel('Emotion Probability')
+        self.ax.set_title(title)
+        self.ax.grid(True, alpha=0.3)
+        self.ax.set_ylim(0, 1.0)
+        self.laid_out = False
+
+    def render(self, emotion_timeline, colors=None):
+        visible = []
+        for emotion, line in self.lines.items():
+            data_points = emotion_timeline.get(emotion) or []
+            line.set_visible(bool(data_points))
+            if not data_points:
+                continue
+            line.set_data([point["timestamp"] for point in data_points],
+                          [point["value"] for point in data_points])
+            # Without explicit colors, follow the default cycle like a fresh figure would
+            line.set_color(colors.get(emotion, '#9E9E9E') if colors else f"C{len(visible)}")
+            visible.append(line)
+
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view(scaley=False)
+        if visible:
+            self.ax.legend(handles=visible, loc='upper right')
+        elif self.ax.get_legend():
+            self.ax.get_legend().remove()
+
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+        return _figure_to_data_uri(self.fig)
+
+
+_templates = OrderedDict()
+
+
+def _get_template(key, factory):
+    template = _templates.get(key)
+    if template is None:
+        import matplotlib.pyplot as plt
+
+        template = _templates[key] = factory()
+        if len(_templates) > MAX_TEMPLATES:
+            _, evicted = _templates.popitem(last=False)
+            plt.close(evicted.fig)
+    else:
+        _templates.move_to_end(key)
+    return template
+
+
+def _render_bar_chart(emotion_data, title="Emotion Analysis", width=800, height=500):
+    from .visualization_generator import EMOTION_COLORS
+
+    sorted_emotions = sorted(emotion_data.get("emotions", {}).items(), key=lambda x: x[1], reverse=True)
+    labels, values = zip(*sorted_emotions)
+    template = _get_template(("bar_chart", width, height, title, frozenset(labels)),
+                             lambda: _BarTemplate(width, height, title, len(labels)))
+    return template.render(labels, values, [EMOTION_COLORS.get(emotion, '#9E9E9E') for emotion in labels])
+
+
+def _render_emotion_graph(emotion_data, width=800, height=500):
+    sorted_emotions = sorted(emotion_data["emotions"].items(), key=lambda x: x[1], reverse=True)
+    labels, values = zip(*sorted_emotions)
+    colors = ['green' if emotion in POSITIVE_EMOTIONS else 'red' if emotion in NEGATIVE_EMOTIONS else 'gray'
+              for emotion in labels]
+    template = _get_template(("emotion_graph", width, height, frozenset(labels)),
+                             lambda: _BarTemplate(width, height, 'Emotion Analysis Results', len(labels)))
+    return template.render(labels, values, colors)
+
+
+def _render_emotion_heatmap(emotions, width=1000, height=600):
+    import matplotlib.pyplot as plt
+
+    emotions_sorted = sorted(emotions.items(), key=lambda x: x[1], reverse=True)
+    labels = [e[0].capitalize() for e in emotions_sorted]
+    values = [e[1] for e in emotions_sorted]
+    cmap = plt.get_cmap('viridis')
+    template = _get_template(("emotion_heatmap", width, height, frozenset(labels)),
+                             lambda: _BarTemplate(width, height, 'Emotion Distribution', len(labels),
+                                                  title_size=14, colorbar=True))
+    return template.render(labels, values, [cmap(v) for v in values], xlim=max(values) * 1.1)
+
+
+def _render_timeline_chart(emotion_timeline, title="Emotion Timeline", width=900, height=500):
+    from .visualization_generator import EMOTION_COLORS
+
+    template = _get_template(("timeline", width, height, title, tuple(emotion_timeline)),
+                             lambda: _TimelineTemplate(width, height, title, list(emotion_timeline)))
+    return template.render(emotion_timeline, colors=EMOTION_COLORS)
+
+
+def _render_timeline_graph(emotion_timeline, width=800, height=500):
+    template = _get_template(("timeline", width, height, 'Emotion Timeline', tuple(emotion_timeline)),
+                             lambda: _TimelineTemplate(width, height, 'Emotion Timeline', list(emotion_timeline)))
+    return template.render(emotion_timeline)
+
+
+# Charts with a reusable figure template; the rest are rendered from scratch
+TEMPLATE_RENDERERS = {
+    'bar_chart': _render_bar_chart,
+    'emotion_graph': _render_emotion_graph,
+    'emotion_heatmap': _render_emotion_heatmap,
+    'timeline_chart': _render_timeline_chart,
+    'timeline_graph': _render_timeline_graph
+}
+
+
+def render_chart(chart_name, kwargs):
+    """Render a chart in the current process (runs inside the pool workers)"""
+    renderer = TEMPLATE_RENDERERS.get(chart_name)
+    if renderer is not None:
+        try:
+            return renderer(**kwargs)
+        except Exception as e:
+            logger.warning(f"Template render of {chart_name} failed, drawing a new figure: {str(e)}")
+
+    from .visualization_generator import get_chart_function
+    return get_chart_function(chart_name)(**kwargs)
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# ---------------------------------------------------------------------------
+# Web tier: pool management and submission
+# ---------------------------------------------------------------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+# Serializes the in-process fallback; pyplot state is global
+_fallback_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=CHART_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+            logger.info(f"Started chart render pool with {CHART_RENDER_WORKERS} workers")
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_chart(chart_name, kwargs):
+    """Queue a chart on the render pool and return a Future of its data URI"""
+    pool = _get_pool()
+    try:
+        return pool.submit(render_chart, chart_name, kwargs)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM); start a fresh pool once
+        logger.warning("Chart render pool broken, restarting")
+        _reset_pool(pool)
+        return _get_pool().submit(render_chart, chart_name, kwargs)
+
+
+def wait_for_chart(future, chart_name, kwargs, timeout=CHART_RENDER_TIMEOUT, cancel_on_timeout=True):
+    """
+    Result of a submitted chart; renders in-process if the pool failed.
+    Pass cancel_on_timeout=False for futures other requests share, so a
+    caller that gives up does not cancel the render for the others.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        logger.error(f"Rendering {chart_name} timed out after {timeout}s")
+        if cancel_on_timeout:
+            future.cancel()
+        return None
+    except BrokenProcessPool:
+        logger.warning(f"Chart render pool failed while rendering {chart_name}, rendering in-process")
+        with _fallback_lock:
+            return render_chart(chart_name, kwargs)
+    except Exception as e:
+        logger.error(f"Error rendering {chart_name}: {str(e)}")
+        return None
+
+
+def render_chart_async(chart_name, kwargs, timeout=CHART_RENDER_TIMEOUT):
+    """Render one chart on the pool and wait for it"""
+    try:
+        future = submit_chart(chart_name, kwargs)
+    except Exception as e:
+        logger.warning(f"Chart render pool unavailable ({str(e)}), rendering in-process")
+        with _fallback_lock:
+            return render_chart(chart_name, kwargs)
+    return wait_for_chart(future, chart_name, kwargs, timeout)
+
+
+def render_visualization(analysis, viz_type, size=None, timeout=CHART_RENDER_TIMEOUT):
+    """Pool-backed counterpart of visualization_generator.generate_visualization"""
+    from .visualization_generator import get_chart_spec, get_stored_chart
+
+    stored = get_stored_chart(analysis, viz_type, size)
+    if stored:
+        return stored
+
+    spec = get_chart_spec(analysis, viz_type, size)
+    if not spec:
+        return None
+
+    chart_name, kwargs = spec
+    return render_chart_async(chart_name, kwargs, timeout)
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
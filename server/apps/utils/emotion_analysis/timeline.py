@@ -0,0 +1,158 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Decimal places kept in stored timelines
+TIMELINE_PRECISION = 4
+
+# Points per emotion in the view stored inline as overall.emotion_timeline
+TIMELINE_DISPLAY_POINTS = 200
+
+# Fixed view sizes offered to API clients
+TIMELINE_VIEW_POINTS = (200, 1000)
+
+# Points per emotion handed to server-rendered timeline charts
+TIMELINE_CHART_POINTS = 600
+
+# Frames with faces kept as key frames in place of the per-frame results
+KEY_FRAME_COUNT = 24
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of at most ``threshold`` points that preserve the
+    visual shape of the series (peaks and dips survive, flat runs collapse).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    every = (n - 2) / (threshold - 2)
+
+    indices = np.empty(threshold, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+
+        # Average of the next bucket is the third corner of the triangle
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+
+def lttb(x, y, threshold):
+    """Downsample paired lists with LTTB, returning (x, y) lists"""
+    indices = lttb_indices(x, y, threshold)
+    return [x[i] for i in indices], [y[i] for i in indices]
+
+
+def _rounded(values):
+    return [round(float(v), TIMELINE_PRECISION) for v in values]
+
+
+def compact_timeline(frames, emotion_labels):
+    """
+    Full-resolution columnar timeline of the primary face.
+
+    One shared timestamp column plus one value column per emotion (and for
+    valence/engagement), instead of a {timestamp, value} dict per point per
+    emotion.
+    """
+    timeline = {
+        "timestamps": [],
+        "emotions": {emotion: [] for emotion in emotion_labels},
+        "valence": [],
+        "engagement": []
+    }
+
+    for frame in frames:
+        faces = frame.get("faces") or []
+        # overall.emotion_timeline only follows face 0, mirror that here
+        if not faces or faces[0].get("face_id", 0) != 0:
+            continue
+        face = faces[0]
+        timeline["timestamps"].append(round(float(frame["timestamp"]), TIMELINE_PRECISION))
+        for emotion in emotion_labels:
+            timeline["emotions"][emotion].append(face["emotions"].get(emotion, 0))
+        timeline["valence"].append(face.get("valence", 0))
+        timeline["engagement"].append(face.get("engagement", 0))
+
+    for emotion, values in timeline["emotions"].items():
+        timeline["emotions"][emotion] = _rounded(values)
+    timeline["valence"] = _rounded(timeline["valence"])
+    timeline["engagement"] = _rounded(timeline["engagement"])
+    return timeline
+
+
+def key_frames(frames, max_frames=KEY_FRAME_COUNT):
+    """
+    Compact, evenly spaced selection of the frames with faces: timestamp and
+    the primary face's dominant emotion, confidence, valence and engagement.
+    Stored instead of the per-frame results, which hold every face of every
+    frame and dominate the size of a video analysis.
+    """
+    with_faces = [frame for frame in frames if frame.get("faces")]
+    if len(with_faces) > max_frames:
+        step = (len(with_faces) - 1) / (max_frames - 1)
+        with_faces = [with_faces[round(i * step)] for i in range(max_frames)]
+
+    selection = []
+    for frame in with_faces:
+        face = frame["faces"][0]
+        selection.append({
+            "frame_idx": frame.get("frame_idx"),
+            "timestamp": round(float(frame.get("timestamp", 0)), TIMELINE_PRECISION),
+            "face_count": frame.get("face_count", len(frame["faces"])),
+            "dominant_emotion": face.get("dominant_emotion"),
+            "confidence": round(float(face.get("confidence", 0)), TIMELINE_PRECISION),
+            "valence": round(float(face.get("valence", 0)), TIMELINE_PRECISION),
+            "engagement": round(float(face.get("engagement", 0)), TIMELINE_PRECISION)
+        })
+    return selection
+
+
+def decimate_timeline(timeline, max_points):
+    """
+    LTTB view of a timeline in the {emotion: [{timestamp, value}]} shape the
+    charts and clients use. Accepts the columnar form or the legacy point lists.
+    """
+    view = {}
+    if "timestamps" in timeline:
+        timestamps = timeline["timestamps"]
+        for emotion, values in timeline.get("emotions", {}).items():
+            xs, ys = lttb(timestamps, values, max_points)
+            view[emotion] = [{"timestamp": t, "value": v} for t, v in zip(xs, ys)]
+        return view
+
+    for emotion, data_points in timeline.items():
+        if len(data_points) <= max_points:
+            view[emotion] = data_points
+            continue
+        indices = lttb_indices([p["timestamp"] for p in data_points],
+                               [p["value"] for p in data_points], max_points)
+        view[emotion] = [data_points[i] for i in indices]
+    return view
+
+
+def get_timeline_view(results, max_points=TIMELINE_DISPLAY_POINTS):
+    """Timeline of an analysis decimated to max_points per emotion"""
+    full = results.get("emotion_timeline_full")
+    if full:
+        return decimate_timeline(full, max_points)
+    return decimate_timeline(results.get("overall", {}).get("emotion_timeline") or {}, max_points)
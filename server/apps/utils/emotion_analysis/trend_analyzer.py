@@ -122,7 +122,8 @@ class EmotionTrendAnalyzer:
         Analyze long-term emotional trends across multiple sessions
         
         Args:
-            historical_data: List of emotion analyses from multiple sessions/days
+            historical_data: Daily rollup documents (see apps.emotions.rollups),
+                or emotion analyses from multiple sessions/days
             days: Number of days to analyze
             
         Returns:
@@ -137,57 +138,52 @@ class EmotionTrendAnalyzer:
                 "engagement_trend": "stable"
             }
         
-        # Group data by date
-        data_by_date = defaultdict(list)
-        all_dates = set()
+        # Per-date sums and counts; a rollup already carries a whole day
+        data_by_date = defaultdict(lambda: {
+            "count": 0,
+            "emotions": defaultdict(float),
+            "valence": 0,
+            "engagement": 0
+        })
         
         for entry in historical_data:
+            if "day" in entry:
+                day = data_by_date[entry["day"].strftime("%Y-%m-%d")]
+                day["count"] += entry.get("count", 0)
+                for emotion, metric in entry.get("emotions", {}).items():
+                    day["emotions"][emotion] += metric.get("sum", 0)
+                day["valence"] += entry.get("valence", {}).get("sum", 0)
+                day["engagement"] += entry.get("engagement", {}).get("sum", 0)
+                continue
+            
             if "created_at" not in entry:
                 continue
                 
-            date_str = entry["created_at"].strftime("%Y-%m-%d")
-            all_dates.add(date_str)
-            data_by_date[date_str].append(entry)
+            day = data_by_date[entry["created_at"].strftime("%Y-%m-%d")]
+            results = entry.get("results", {})
+            day["count"] += 1
+            for emotion, value in results.get("emotions", {}).items():
+                day["emotions"][emotion] += value
+            day["valence"] += results.get("valence", 0)
+            day["engagement"] += results.get("engagement", 0)
         
         # Get daily averages for each emotion
         emotion_trends = {emotion: [] for emotion in self.emotion_labels}
         valence_by_day = []
         engagement_by_day = []
-        dates = sorted(all_dates)
+        dates = sorted(date for date, day in data_by_date.items() if day["count"])
         
         for date in dates:
-            day_data = data_by_date.get(date, [])
-            if not day_data:
-                continue
-            
-            # Calculate daily emotion averages
-            daily_emotions = {emotion: [] for emotion in self.emotion_labels}
-            daily_valence = []
-            daily_engagement = []
-            
-            for entry in day_data:
-                results = entry.get("results", {})
-                emotions = results.get("emotions", {})
-                
-                for emotion, value in emotions.items():
-                    if emotion in daily_emotions:
-                        daily_emotions[emotion].append(value)
-                
-                valence = results.get("valence", 0)
-                engagement = results.get("engagement", 0)
-                daily_valence.append(valence)
-                daily_engagement.append(engagement)
+            day = data_by_date[date]
+            count = day["count"]
             
             # Store daily averages
-            for emotion, values in daily_emotions.items():
-                if values:
-                    emotion_trends[emotion].append(sum(values) / len(values))
-                else:
-                    emotion_trends[emotion].append(0)
+            for emotion in self.emotion_labels:
+                emotion_trends[emotion].append(day["emotions"].get(emotion, 0) / count)
             
             # Store daily valence and engagement
-            valence_by_day.append(sum(daily_valence) / len(daily_valence) if daily_valence else 0)
-            engagement_by_day.append(sum(daily_engagement) / len(daily_engagement) if daily_engagement else 0)
+            valence_by_day.append(day["valence"] / count)
+            engagement_by_day.append(day["engagement"] / count)
         
         # Calculate trends
         stability_trend = "stable"
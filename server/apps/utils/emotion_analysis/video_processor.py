@@ -1,3 +1,4 @@
+import os
 import json
 import cv2
 import numpy as np
@@ -10,6 +11,9 @@ from collections import deque
 
 logger = logging.getLogger(__name__)
 
+# Default frame budget of the adaptive sampler
+ADAPTIVE_FRAMES_PER_MINUTE = int(os.environ.get("ADAPTIVE_FRAMES_PER_MINUTE", 60))
+
 def get_optimal_sampling_rate(video_duration):
     """Determine best sampling rate based on video length"""
     if video_duration < 30:  # Short video
@@ -136,9 +140,16 @@ def extract_frames(video_path, sample_rate=1.0):
         cap.release()
         return video_info, frames
     
+    video_info = {
+        "duration": duration,
+        "fps": fps,
+        "frame_count": frame_count,
+        "resolution": f"{width}x{height}"
+    }
+    
     # For longer videos, improve sampling based on content analysis
     if duration > 60:  # Videos longer than 1 minute
-        # Analyze first few frames to detect face density
+        # Sample frames across the video to detect face density
         face_density = _analyze_face_density(cap)
         
         # Adjust sample rate based on face density
@@ -191,32 +202,137 @@ def extract_frames(video_path, sample_rate=1.0):
         
     return video_info, frames
 
-def _analyze_face_density(cap):
-    """Analyze first few frames to determine face density"""
+_face_cascade = None
+
+def _get_face_cascade():
+    """Load the Haar cascade once per process"""
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _face_cascade
+
+def _has_face(frame, max_width=320):
+    """Cheap face-presence check on a downscaled grayscale copy"""
+    height, width = frame.shape[:2]
+    if width > max_width:
+        frame = cv2.resize(frame, (max_width, int(height * max_width / width)))
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    faces = _get_face_cascade().detectMultiScale(gray, 1.1, 4)
+    return len(faces) > 0
+
+def _analyze_face_density(cap, sample_count=10):
+    """Estimate face density from frames spread across the whole video"""
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_count <= 0:
+        return 0
+    
+    positions = np.linspace(0, frame_count - 1, num=min(sample_count, frame_count), dtype=int)
     face_frames = 0
-    total_frames = 10  # Check first 10 frames
+    checked = 0
     
-    for i in range(total_frames):
+    for position in positions:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
         ret, frame = cap.read()
         if not ret or frame is None:
             continue
-            
-        # Reset position after reading
-        if i == 0:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            
-        # Detect faces
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        if len(faces) > 0:
+        checked += 1
+        if _has_face(frame):
             face_frames += 1
     
-    # Reset position again
+    # Reset position for the caller
     cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
     
-    return face_frames / total_frames
+    return face_frames / checked if checked else 0
+
+def _change_signature(frame, size=(64, 36)):
+    """Tiny blurred grayscale thumbnail used to score visual change between frames"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(small, (3, 3), 0).astype(np.float32)
+
+def extract_frames_adaptive(video_path, frames_per_minute=ADAPTIVE_FRAMES_PER_MINUTE,
+                            change_threshold=0.03, min_interval=0.25, max_interval=5.0):
+    """
+    Decode a video once and keep frames where the picture changes.
+    
+    Every decoded frame gets a change score: the mean absolute difference between
+    its low-resolution thumbnail and that of the last kept frame (0-1). Frames are
+    kept when the score passes ``change_threshold`` and the frame budget allows it,
+    so scene cuts and expression changes are sampled densely while static stretches
+    only get a frame every ``max_interval`` seconds (doubled while no face is
+    visible). The budget is a token bucket refilled at ``frames_per_minute``.
+    
+    Returns:
+        (video_info, frames) in the same format as ``extract_frames``
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logger.error(f"Failed to open video file: {video_path}")
+        return None, []
+    
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if fps <= 0:
+        fps = 30.0
+    
+    tokens_per_second = frames_per_minute / 60.0
+    burst = max(1.0, frames_per_minute / 6.0)  # up to 10 seconds of budget saved for bursts
+    tokens = burst
+    
+    frames = []
+    reference = None
+    last_kept_time = None
+    last_time = 0.0
+    face_visible = True
+    frame_idx = 0
+    
+    while True:
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            break
+        
+        timestamp = frame_idx / fps
+        tokens = min(burst, tokens + (timestamp - last_time) * tokens_per_second)
+        last_time = timestamp
+        
+        signature = _change_signature(frame)
+        if reference is None:
+            keep = True
+        else:
+            gap = timestamp - last_kept_time
+            idle_interval = max_interval if face_visible else max_interval * 2
+            score = float(np.mean(np.abs(signature - reference))) / 255.0
+            keep = (gap >= idle_interval or
+                    (gap >= min_interval and score >= change_threshold and tokens >= 1.0))
+        
+        if keep:
+            tokens = max(0.0, tokens - 1.0)
+            reference = signature
+            last_kept_time = timestamp
+            
+            if width > 1280:
+                frame = cv2.resize(frame, (1280, int(height * 1280 / width)))
+            face_visible = _has_face(frame)
+            frames.append((frame_idx, timestamp, _enhance_frame_for_detection(frame)))
+        
+        frame_idx += 1
+    
+    cap.release()
+    
+    # Container headers from browser recordings often lack a frame count
+    frame_count = max(frame_count, frame_idx)
+    video_info = {
+        "duration": frame_count / fps,
+        "fps": fps,
+        "frame_count": frame_count,
+        "resolution": f"{width}x{height}"
+    }
+    
+    logger.info(f"Adaptive sampling kept {len(frames)} of {frame_idx} frames "
+                f"({video_info['duration']:.1f}s, budget {frames_per_minute}/min)")
+    return video_info, frames
 
 def apply_temporal_smoothing(frame_emotions, window_size=5):
     """Smooth emotion predictions across frames to reduce fluctuation"""
@@ -0,0 +1,301 @@
+import uuid
+import queue
+import shutil
+import logging
+import threading
+import subprocess
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Meter geometry (relative to the top-left corner of the valence bar)
+METER_WIDTH = 60
+METER_HEIGHT = 10
+ENGAGEMENT_OFFSET = METER_HEIGHT + 15
+
+EMOTION_BAR_HEIGHT = 30
+
+# x264 preset used for annotated previews; quality matters less than turnaround
+FFMPEG_PRESET = "veryfast"
+
+
+def get_emotion_color(emotion):
+    """Get color for emotion visualization"""
+    colors = {
+        'happy': (0, 255, 0),     # Green
+        'sad': (255, 0, 0),       # Blue (BGR)
+        'angry': (0, 0, 255),     # Red
+        'fear': (0, 0, 128),      # Dark Red
+        'neutral': (128, 128, 128), # Gray
+        'surprise': (0, 255, 255),  # Yellow
+        'disgust': (128, 0, 128)    # Purple
+    }
+    return colors.get(emotion, (200, 200, 200))  # Default gray
+
+
+class _Layer:
+    """Pre-rendered pixels plus the mask of pixels that were drawn"""
+
+    def __init__(self, height, width):
+        self.pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        self._mask = None
+
+    def freeze(self, drawn):
+        self._mask = drawn[:, :, None]
+        return self
+
+    def blit(self, frame, x, y):
+        """Copy the drawn pixels onto frame at (x, y), clipped to the frame bounds"""
+        height, width = self.pixels.shape[:2]
+        frame_h, frame_w = frame.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, frame_w), min(y + height, frame_h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        np.copyto(frame[y0:y1, x0:x1], self.pixels[src], where=self._mask[src])
+
+
+def _draw_layer(height, width, draw):
+    """Render a layer and work out which pixels the drawing touched"""
+    layer = _Layer(height, width)
+    # Draw on a black and a white canvas: touched pixels come out identical on both
+    dark = np.zeros((height, width, 3), dtype=np.uint8)
+    light = np.full((height, width, 3), 255, dtype=np.uint8)
+    draw(dark)
+    draw(light)
+    layer.pixels = dark
+    return layer.freeze(np.all(dark == light, axis=2))
+
+
+class OverlayCache:
+    """
+    Static overlay layers, built once per output resolution.
+
+    The meter sprite (bar backgrounds and "Valence"/"Engagement" labels) is
+    independent of resolution and shared; the emotion bar strip depends on the
+    frame width and the number of emotions.
+    """
+
+    _meter_sprite = None
+    _strips = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def meter_sprite(cls):
+        """Sprite anchored 15px above the valence bar"""
+        with cls._lock:
+            if cls._meter_sprite is None:
+                top = 15
+                sprite_w = METER_WIDTH + 20
+                sprite_h = top + ENGAGEMENT_OFFSET + METER_HEIGHT
+
+                def draw(canvas):
+                    cv2.rectangle(canvas, (0, top), (METER_WIDTH, top + METER_HEIGHT), (100, 100, 100), -1)
+                    cv2.putText(canvas, "Valence", (0, top - 5), FONT, 0.4, (255, 255, 255), 1)
+                    eng_y = top + ENGAGEMENT_OFFSET
+                    cv2.rectangle(canvas, (0, eng_y), (METER_WIDTH, eng_y + METER_HEIGHT), (100, 100, 100), -1)
+                    cv2.putText(canvas, "Engagement", (0, eng_y - 5), FONT, 0.4, (255, 255, 255), 1)
+
+                cls._meter_sprite = (_draw_layer(sprite_h, sprite_w, draw), top)
+            return cls._meter_sprite
+
+    @classmethod
+    def emotion_strip(cls, width, height, emotion_names):
+        """(background layer, label layer) for the emotion bars at the bottom of the frame"""
+        key = (width, height, tuple(emotion_names))
+        with cls._lock:
+            if key not in cls._strips:
+                strip_h = EMOTION_BAR_HEIGHT + 10
+                bar_width = width // len(emotion_names)
+
+                def draw_background(canvas):
+                    for i in range(len(emotion_names)):
+                        bar_x = i * bar_width
+                        cv2.rectangle(canvas, (bar_x, 0), (bar_x + bar_width, EMOTION_BAR_HEIGHT), (30, 30, 30), -1)
+
+                def draw_labels(canvas):
+                    for i, emotion_name in enumerate(emotion_names):
+                        cv2.putText(canvas, f"{emotion_name}", (i * bar_width + 5, EMOTION_BAR_HEIGHT - 5),
+                                    FONT, 0.4, (255, 255, 255), 1)
+
+                cls._strips[key] = (
+                    _draw_layer(strip_h, width, draw_background),
+                    _draw_layer(strip_h, width, draw_labels)
+                )
+            return cls._strips[key]
+
+
+def annotate_frame(frame, timestamp, frame_result):
+    """Draw the emotion overlay for one frame in place"""
+    height, width = frame.shape[:2]
+
+    cv2.putText(frame, f"Time: {timestamp:.2f}s", (10, 30), FONT, 0.7, (255, 255, 255), 2)
+
+    meter_sprite, sprite_top = OverlayCache.meter_sprite()
+
+    for face_data in frame_result.get("faces", []):
+        x = face_data["position"]["x"]
+        y = face_data["position"]["y"]
+        w = face_data["position"]["width"]
+        h = face_data["position"]["height"]
+        emotion = face_data["dominant_emotion"]
+        color = get_emotion_color(emotion)
+
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(frame, f"{emotion} ({face_data['confidence']:.0%})", (x, y - 10), FONT, 0.6, color, 2)
+
+        # Static meter backgrounds and labels, then the values on top
+        meter_x = x + w + 10
+        meter_y = y
+        meter_sprite.blit(frame, meter_x, meter_y - sprite_top)
+
+        valence = face_data["valence"]
+        val_pos = int((valence + 1) / 2 * METER_WIDTH)
+        val_color = (0, 0, 255) if valence < 0 else (0, 255, 0)
+        cv2.rectangle(frame, (meter_x, meter_y), (meter_x + val_pos, meter_y + METER_HEIGHT), val_color, -1)
+
+        eng_meter_y = meter_y + ENGAGEMENT_OFFSET
+        eng_pos = int(face_data["engagement"] * METER_WIDTH)
+        cv2.rectangle(frame, (meter_x, eng_meter_y), (meter_x + eng_pos, eng_meter_y + METER_HEIGHT),
+                      (255, 165, 0), -1)
+
+        # Emotion bars at the bottom for the primary face
+        emotions = face_data.get("emotions", {}) if face_data.get("face_id", -1) == 0 else {}
+        if emotions:
+            names = list(emotions.keys())
+            background, labels = OverlayCache.emotion_strip(width, height, names)
+            strip_y = height - EMOTION_BAR_HEIGHT - 10
+            background.blit(frame, 0, strip_y)
+
+            bar_width = width // len(names)
+            for i, (emotion_name, value) in enumerate(emotions.items()):
+                bar_x = i * bar_width
+                bar_height = int(value * EMOTION_BAR_HEIGHT)
+                cv2.rectangle(frame, (bar_x, height - 10 - bar_height), (bar_x + bar_width, height - 10),
+                              get_emotion_color(emotion_name), -1)
+
+            labels.blit(frame, 0, strip_y)
+
+    return frame
+
+
+class AnnotatedVideoRenderer:
+    """
+    Streams annotated frames into an encoder on a background thread.
+
+    Frames are submitted as analysis produces them, so rendering overlaps
+    with inference. Encoding goes through an ffmpeg pipe (libx264) when ffmpeg
+    is installed, falling back to cv2.VideoWriter otherwise.
+    """
+
+    def __init__(self, width, height, fps, output_path=None, max_pending=64):
+        self.width = width
+        self.height = height
+        self.fps = max(15, min(60, fps))  # capped for compatibility
+        self.output_path = output_path or f"/tmp/annotated_video_{uuid.uuid4().hex}.mp4"
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._encoder = None
+        self._writer = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, timestamp, frame_result):
+        """Queue a frame for annotation; blocks when the encoder falls behind"""
+        if self._error is None:
+            self._queue.put((frame, timestamp, frame_result))
+
+    def finish(self):
+        """Flush remaining frames and return the output path, or None on failure"""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            logger.error(f"Error creating annotated video: {self._error}")
+            return None
+        logger.info(f"Created annotated video at {self.output_path} ({self.frames_written} frames)")
+        return self.output_path
+
+    def abort(self):
+        """Stop without producing output"""
+        self._error = self._error or "aborted"
+        self._queue.put(None)
+        self._thread.join()
+
+    def _open(self):
+        if shutil.which("ffmpeg"):
+            self._encoder = subprocess.Popen([
+                'ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                '-s', f'{self.width}x{self.height}', '-r', f'{self.fps:.3f}',
+                '-i', '-',
+                # libx264 with yuv420p needs even dimensions
+                '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                '-c:v', 'libx264', '-preset', FFMPEG_PRESET, '-crf', '23',
+                '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+                self.output_path
+            ], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            return
+
+        logger.warning("ffmpeg not found, encoding annotated video with OpenCV")
+        fourcc = cv2.VideoWriter_fourcc(*'avc1')
+        self._writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, (self.width, self.height))
+        if not self._writer.isOpened():
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self._writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, (self.width, self.height))
+        if not self._writer.isOpened():
+            raise Exception("Could not create video writer")
+
+    def _write(self, frame):
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            frame = cv2.resize(frame, (self.width, self.height))
+        if self._encoder is not None:
+            self._encoder.stdin.write(np.ascontiguousarray(frame).tobytes())
+        else:
+            self._writer.write(frame)
+        self.frames_written += 1
+
+    def _close(self):
+        if self._encoder is not None:
+            self._encoder.stdin.close()
+            stderr = self._encoder.stderr.read()
+            if self._encoder.wait() != 0:
+                raise Exception(f"ffmpeg exited with {self._encoder.returncode}: {stderr.decode(errors='ignore')}")
+        elif self._writer is not None:
+            self._writer.release()
+
+    def _run(self):
+        try:
+            self._open()
+        except Exception as e:
+            self._error = str(e)
+
+        # Keep consuming until the sentinel so producers never block on a failed renderer
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            frame, timestamp, frame_result = item
+            try:
+                self._write(annotate_frame(frame.copy(), timestamp, frame_result))
+            except Exception as e:
+                self._error = str(e)
+
+        try:
+            self._close()
+        except Exception as e:
+            self._error = self._error or str(e)
+
+
+def estimate_output_fps(frames):
+    """Estimate playback fps from the timestamps of the sampled frames"""
+    if len(frames) > 1:
+        avg_time_diff = (frames[-1][1] - frames[0][1]) / (len(frames) - 1)
+        return 1.0 / avg_time_diff if avg_time_diff > 0 else 30.0
+    return 30.0
@@ -6,6 +6,7 @@ import logging
 from datetime import datetime, timedelta
 import seaborn as sns
 from matplotlib.colors import LinearSegmentedColormap
+from .timeline import lttb_indices, get_timeline_view, TIMELINE_CHART_POINTS
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +21,11 @@ EMOTION_COLORS = {
     'surprise': '#00BFA5'   # Teal
 }
 
+# Points kept per series in format='data' responses
+DATA_MAX_POINTS = 200
+# Decimal places kept for values in format='data' responses
+DATA_PRECISION = 3
+
 def generate_bar_chart(emotion_data, title="Emotion Analysis", width=800, height=500):
     """Generate horizontal bar chart of emotions"""
     try:
@@ -183,8 +189,16 @@ def get_emotion_label(valence, arousal):
     else:
         return "Mixed"
 
-def generate_session_summary_chart(session_data, width=1000, height=600):
-    """Generate comprehensive session summary visualization"""
+def generate_session_summary_chart(session_data, width=1000, height=600, format='png'):
+    """
+    Generate comprehensive session summary visualization
+    
+    With format='data' returns the panel data (downsampled timelines) and
+    layout hints for client-side rendering instead of a PNG.
+    """
+    if format == 'data':
+        return session_summary_data(session_data, width, height)
+    
     try:
         # Create figure with 2x2 subplots
         fig, axs = plt.subplots(2, 2, figsize=(width/100, height/100), dpi=100)
@@ -299,8 +313,16 @@ def generate_session_summary_chart(session_data, width=1000, height=600):
         logger.error(f"Error generating session summary chart: {str(e)}")
         return None
 
-def generate_trend_chart(trend_data, width=1000, height=500):
-    """Generate chart showing emotional trends over time (days/weeks)"""
+def generate_trend_chart(trend_data, width=1000, height=500, format='png'):
+    """
+    Generate chart showing emotional trends over time (days/weeks)
+    
+    With format='data' returns the downsampled series and layout hints for
+    client-side rendering instead of a PNG.
+    """
+    if format == 'data':
+        return trend_chart_data(trend_data, width, height)
+    
     try:
         # Create figure
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(width/100, height/100), dpi=100, 
@@ -368,37 +390,359 @@ def generate_trend_chart(trend_data, width=1000, height=500):
         logger.error(f"Error generating trend chart: {str(e)}")
         return None
 
+def generate_emotion_heatmap(emotions, width=1000, height=600):
+    """Generate a heatmap visualization of emotions"""
+    try:
+        # Create figure
+        fig, ax = plt.subplots(figsize=(width/100, height/100), dpi=100)
+        
+        # Prepare data
+        emotions_sorted = sorted(emotions.items(), key=lambda x: x[1], reverse=True)
+        labels = [e[0].capitalize() for e in emotions_sorted]
+        values = [e[1] for e in emotions_sorted]
+        
+        # Create heatmap-style bar chart
+        cmap = plt.get_cmap('viridis')
+        bars = ax.barh(labels, values, color=[cmap(v) for v in values])
+        
+        # Add value labels
+        for i, v in enumerate(values):
+            ax.text(v + 0.01, i, f'{v:.2f}', va='center')
+        
+        # Customize chart
+        ax.set_title('Emotion Distribution', fontsize=14)
+        ax.set_xlim(0, max(values) * 1.1)
+        
+        # Add color bar
+        sm = plt.cm.ScalarMappable(cmap=cmap)
+        sm.set_array([])
+        cbar = fig.colorbar(sm, ax=ax)
+        cbar.set_label('Intensity')
+        
+        # Convert to image
+        buf = BytesIO()
+        fig.tight_layout()
+        plt.savefig(buf, format='png')
+        plt.close(fig)
+        buf.seek(0)
+        
+        # Convert to base64 for embedding in HTML
+        graph_img = base64.b64encode(buf.getvalue()).decode('utf-8')
+        return f"data:image/png;base64,{graph_img}"
+        
+    except Exception as e:
+        logger.error(f"Error generating emotion heatmap: {str(e)}")
+        return None
+
+def sample_indices(count, max_points=DATA_MAX_POINTS):
+    """Evenly spaced indices thinning a series to at most max_points, keeping both ends"""
+    if count <= max_points:
+        return list(range(count))
+    return sorted(set(np.linspace(0, count - 1, max_points).round().astype(int).tolist()))
+
+def downsample_series(xs, ys, max_points=DATA_MAX_POINTS):
+    """Thin paired x/y values for client-side plotting (LTTB keeps peaks and dips)"""
+    indices = lttb_indices(xs, ys, max_points)
+    return [_compact(xs[i]) for i in indices], [_compact(ys[i]) for i in indices]
+
+def _compact(value):
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), DATA_PRECISION)
+    return value
+
+def _bar_data(labels, values, colors, title, width, height, x_range=(0, 1.0), **layout):
+    return {
+        "type": "bar",
+        "title": title,
+        "labels": list(labels),
+        "values": [_compact(v) for v in values],
+        "colors": list(colors),
+        "layout": dict(orientation="horizontal", x_range=list(x_range), width=width, height=height, **layout)
+    }
+
+def _timeline_data(emotion_timeline, title, width, height, colors=None, max_points=DATA_MAX_POINTS):
+    series = []
+    for emotion, data_points in emotion_timeline.items():
+        if not data_points:
+            continue
+        x, y = downsample_series([point["timestamp"] for point in data_points],
+                                 [point["value"] for point in data_points], max_points)
+        series.append({
+            "name": emotion,
+            "color": colors.get(emotion, '#9E9E9E') if colors else None,
+            "x": x,
+            "y": y
+        })
+    return {
+        "type": "line",
+        "title": title,
+        "series": series,
+        "layout": {
+            "x_label": "Time (seconds)",
+            "y_label": "Emotion Probability",
+            "y_range": [0, 1.0],
+            "legend": "upper right",
+            "width": width,
+            "height": height
+        }
+    }
+
+def session_summary_data(session_data, width=1000, height=600, max_points=DATA_MAX_POINTS):
+    """Data behind generate_session_summary_chart for client-side rendering"""
+    emotions = session_data.get('emotions', {})
+    emotions_sorted = sorted(emotions.items(), key=lambda x: x[1]['average'], reverse=True)
+    labels = [e[0] for e in emotions_sorted]
+    
+    panels = {
+        "emotions": _bar_data(labels, [e[1]['average'] for e in emotions_sorted],
+                              [EMOTION_COLORS.get(emotion, '#9E9E9E') for emotion in labels],
+                              'Dominant Emotions', width // 2, height // 2)
+    }
+    
+    for key, title, y_label, y_range, color in (
+        ('valence_timeline', 'Emotional Valence Timeline', 'Negative ← → Positive', [-1.0, 1.0], 'blue'),
+        ('engagement_timeline', 'Engagement Level', 'Engagement %', [0, 100], 'green')
+    ):
+        if key in session_data:
+            times, values = downsample_series(session_data[key]['times'], session_data[key]['values'], max_points)
+            panels[key] = {
+                "type": "line",
+                "title": title,
+                "series": [{"name": key, "color": color, "x": times, "y": values}],
+                "layout": {"y_label": y_label, "y_range": y_range, "width": width // 2, "height": height // 2}
+            }
+    
+    if 'emotional_shifts' in session_data:
+        panels["stability"] = {
+            "type": "gauge",
+            "title": 'Emotional Stability',
+            "value": _compact(session_data.get('emotional_stability', 0.5)),
+            "shifts": session_data['emotional_shifts'],
+            "regions": ["Unstable", "Moderate", "Stable"]
+        }
+    
+    duration = session_data.get('duration', 0)
+    minutes, seconds = divmod(int(duration), 60)
+    return {
+        "type": "session_summary",
+        "title": f"Therapy Session Emotional Summary ({minutes}m {seconds}s)",
+        "panels": panels,
+        "layout": {"grid": [2, 2], "width": width, "height": height}
+    }
+
+def trend_chart_data(trend_data, width=1000, height=500, max_points=DATA_MAX_POINTS):
+    """Data behind generate_trend_chart for client-side rendering"""
+    dates = trend_data.get('dates', [])
+    indices = sample_indices(len(dates), max_points)
+    
+    def pick(values):
+        return [_compact(values[i]) for i in indices if i < len(values)]
+    
+    valence = pick(trend_data.get('valence', []))
+    return {
+        "type": "trend",
+        "title": 'Emotional Trends Over Time',
+        "dates": [dates[i].isoformat() if hasattr(dates[i], 'isoformat') else dates[i] for i in indices],
+        "series": [
+            {"name": emotion, "color": EMOTION_COLORS.get(emotion, '#9E9E9E'), "values": pick(values)}
+            for emotion, values in trend_data.get('emotions', {}).items() if len(values) > 0
+        ],
+        "valence": {
+            "values": valence,
+            "colors": ['#4CAF50' if v > 0.2 else '#F44336' if v < -0.2 else '#9E9E9E' for v in valence]
+        },
+        "engagement": pick(trend_data.get('engagement', [])),
+        "layout": {
+            "panels": [
+                {"series": "emotions", "y_label": 'Emotion Intensity', "height_ratio": 3},
+                {"series": "valence", "y_label": 'Emotional Valence', "height_ratio": 2}
+            ],
+            "x_label": 'Date',
+            "legend": "upper right",
+            "width": width,
+            "height": height
+        }
+    }
+
+def get_chart_data(chart_name, kwargs, max_points=DATA_MAX_POINTS):
+    """Compact data and layout hints for a chart from get_chart_spec (format='data')"""
+    if chart_name == 'session_summary_chart':
+        return session_summary_data(kwargs['session_data'], kwargs.get('width', 1000),
+                                    kwargs.get('height', 600), max_points)
+    
+    if chart_name == 'trend_chart':
+        return trend_chart_data(kwargs['trend_data'], kwargs.get('width', 1000),
+                                kwargs.get('height', 500), max_points)
+    
+    if chart_name in ('timeline_chart', 'timeline_graph'):
+        colored = chart_name == 'timeline_chart'
+        return _timeline_data(kwargs['emotion_timeline'], kwargs.get('title', 'Emotion Timeline'),
+                              kwargs.get('width', 900 if colored else 800), kwargs.get('height', 500),
+                              colors=EMOTION_COLORS if colored else None, max_points=max_points)
+    
+    if chart_name == 'valence_arousal_plot':
+        valence, arousal = kwargs['valence'], kwargs['arousal']
+        return {
+            "type": "circumplex",
+            "title": kwargs.get('title', "Emotional State"),
+            "point": {"valence": _compact(valence), "arousal": _compact(arousal)},
+            "label": get_emotion_label(valence, arousal),
+            "color": get_emotion_color(valence, arousal),
+            "layout": {
+                "x_label": 'Valence (Negative → Positive)',
+                "y_label": 'Arousal (Calm → Excited)',
+                "x_range": [-1.1, 1.1],
+                "y_range": [-1.1, 1.1],
+                "quadrants": {"top_right": "EXCITED", "top_left": "STRESSED",
+                              "bottom_left": "DEPRESSED", "bottom_right": "CALM"},
+                "width": kwargs.get('width', 600),
+                "height": kwargs.get('height', 600)
+            }
+        }
+    
+    if chart_name == 'bar_chart':
+        emotions = sorted(kwargs['emotion_data'].get('emotions', {}).items(), key=lambda x: x[1], reverse=True)
+        labels = [e[0] for e in emotions]
+        return _bar_data(labels, [e[1] for e in emotions],
+                         [EMOTION_COLORS.get(emotion, '#9E9E9E') for emotion in labels],
+                         kwargs.get('title', "Emotion Analysis"), kwargs.get('width', 800), kwargs.get('height', 500))
+    
+    if chart_name == 'emotion_graph':
+        emotions = sorted(kwargs['emotion_data']['emotions'].items(), key=lambda x: x[1], reverse=True)
+        labels = [e[0] for e in emotions]
+        colors = ['green' if e in ('happy', 'surprise') else 'red' if e in ('angry', 'fear', 'disgust', 'sad')
+                  else 'gray' for e in labels]
+        return _bar_data(labels, [e[1] for e in emotions], colors, 'Emotion Analysis Results',
+                         kwargs.get('width', 800), kwargs.get('height', 500))
+    
+    if chart_name == 'emotion_heatmap':
+        emotions = sorted(kwargs['emotions'].items(), key=lambda x: x[1], reverse=True)
+        values = [e[1] for e in emotions]
+        # Client maps values through the named colormap
+        return _bar_data([e[0].capitalize() for e in emotions], values, [], 'Emotion Distribution',
+                         kwargs.get('width', 1000), kwargs.get('height', 600),
+                         x_range=(0, max(values) * 1.1 if values else 1.0), colormap='viridis')
+    
+    raise ValueError(f"No data mode for chart '{chart_name}'")
+
+# Charts that analysis used to render eagerly; older documents still carry them
+STORED_CHARTS = {
+    'emotion_graph': 'graph',
+    'timeline_graph': 'timeline_graph',
+    'emotion_heatmap': 'emotion_heatmap'
+}
+
+VISUALIZATION_TYPES = (
+    'emotions', 'timeline', 'valence_arousal', 'session_summary', 'trends'
+) + tuple(STORED_CHARTS)
+
+def get_chart_function(chart_name):
+    """Resolve a chart name from get_chart_spec to its rendering function"""
+    if chart_name == 'emotion_graph':
+        from .image_processor import generate_emotion_graph
+        return generate_emotion_graph
+    if chart_name == 'timeline_graph':
+        from .video_processor import generate_timeline_graph
+        return generate_timeline_graph
+    return {
+        'bar_chart': generate_bar_chart,
+        'timeline_chart': generate_timeline_chart,
+        'valence_arousal_plot': generate_valence_arousal_plot,
+        'session_summary_chart': generate_session_summary_chart,
+        'trend_chart': generate_trend_chart,
+        'emotion_heatmap': generate_emotion_heatmap
+    }[chart_name]
+
+def get_stored_chart(analysis, viz_type, size=None):
+    """Chart rendered at analysis time by older versions, served as-is at its default size"""
+    if size or viz_type not in STORED_CHARTS:
+        return None
+    return analysis.get('results', {}).get(STORED_CHARTS[viz_type])
+
+def get_chart_spec(analysis, viz_type, size=None):
+    """
+    Work out which chart renders a visualization and with which arguments
+    
+    Returns:
+        tuple: (chart name, kwargs), or None if the analysis has no data for it
+    """
+    results = analysis.get('results', {})
+    dimensions = {'width': size[0], 'height': size[1]} if size else {}
+    
+    if viz_type == 'emotions':
+        emotions = results.get('emotions', {})
+        return 'bar_chart', dict(emotion_data={'emotions': emotions}, title="Emotion Analysis", **dimensions)
+        
+    elif viz_type == 'timeline':
+        timeline = get_timeline_view(results, TIMELINE_CHART_POINTS)
+        return 'timeline_chart', dict(emotion_timeline=timeline, title="Emotion Timeline", **dimensions)
+        
+    elif viz_type == 'valence_arousal':
+        valence = results.get('valence', 0)
+        # Calculate arousal from engagement (scaled from 0-100 to -1 to 1)
+        engagement = results.get('engagement', 50)
+        arousal = (engagement / 50) - 1
+        return 'valence_arousal_plot', dict(valence=valence, arousal=arousal, **dimensions)
+        
+    elif viz_type == 'session_summary':
+        # For session summary, we need to prepare the data
+        session_data = prepare_session_summary_data(analysis)
+        return 'session_summary_chart', dict(session_data=session_data, **dimensions)
+        
+    elif viz_type == 'trends':
+        # This would be called with trend data from EmotionAnalysis.get_emotion_trends
+        return 'trend_chart', dict(trend_data=analysis, **dimensions)
+    
+    elif viz_type == 'emotion_graph':
+        faces = results.get('faces', [])
+        if not faces:
+            return None
+        return 'emotion_graph', dict(emotion_data=faces[0], **dimensions)
+    
+    elif viz_type == 'timeline_graph':
+        timeline = get_timeline_view(results, TIMELINE_CHART_POINTS)
+        if not any(timeline.values()):
+            return None
+        return 'timeline_graph', dict(emotion_timeline=timeline, **dimensions)
+    
+    elif viz_type == 'emotion_heatmap':
+        emotions = results.get('overall', {}).get('emotions') or results.get('emotions', {})
+        if not emotions:
+            return None
+        return 'emotion_heatmap', dict(emotions=emotions, **dimensions)
+    
+    logger.warning(f"Unsupported visualization type: {viz_type}")
+    return None
+
 # Main function that other modules can call
-def generate_visualization(analysis, viz_type):
-    """Generate appropriate visualization based on the requested type"""
+def generate_visualization(analysis, viz_type, size=None, format='png'):
+    """
+    Generate appropriate visualization based on the requested type
+    
+    Renders in the calling process; web requests go through
+    render_pool.render_visualization instead.
+    
+    Args:
+        analysis: EmotionAnalysis document
+        viz_type: Chart to render
+        size: Optional (width, height) in pixels; each chart has its own default
+        format: 'png' for a base64 data URI, 'data' for compact chart data
+    """
     try:
-        if viz_type == 'emotions':
-            emotions = analysis.get('results', {}).get('emotions', {})
-            return generate_bar_chart({'emotions': emotions}, "Emotion Analysis")
-            
-        elif viz_type == 'timeline':
-            timeline = analysis.get('results', {}).get('overall', {}).get('emotion_timeline', {})
-            return generate_timeline_chart(timeline, "Emotion Timeline")
-            
-        elif viz_type == 'valence_arousal':
-            valence = analysis.get('results', {}).get('valence', 0)
-            # Calculate arousal from engagement (scaled from 0-100 to -1 to 1)
-            engagement = analysis.get('results', {}).get('engagement', 50)
-            arousal = (engagement / 50) - 1
-            return generate_valence_arousal_plot(valence, arousal)
-            
-        elif viz_type == 'session_summary':
-            # For session summary, we need to prepare the data
-            session_data = prepare_session_summary_data(analysis)
-            return generate_session_summary_chart(session_data)
-            
-        elif viz_type == 'trends':
-            # This would be called with trend data from EmotionAnalysis.get_emotion_trends
-            return generate_trend_chart(analysis)
-            
-        else:
-            logger.warning(f"Unsupported visualization type: {viz_type}")
+        if format == 'data':
+            spec = get_chart_spec(analysis, viz_type, size)
+            return get_chart_data(*spec) if spec else None
+        
+        stored = get_stored_chart(analysis, viz_type, size)
+        if stored:
+            return stored
+        
+        spec = get_chart_spec(analysis, viz_type, size)
+        if not spec:
             return None
+        
+        chart_name, kwargs = spec
+        return get_chart_function(chart_name)(**kwargs)
             
     except Exception as e:
         logger.error(f"Error generating visualization: {str(e)}")
@@ -437,13 +781,19 @@ def prepare_session_summary_data(analysis):
         }
     
     # Extract timeline data if available
-    frames = results.get('frames', [])
-    if frames:
-        # For video analysis, extract data from frames
+    full_timeline = results.get('emotion_timeline_full')
+    frames = results.get('frames', [])  # Per-frame results of analyses stored before key frames
+    if full_timeline or frames:
+        # For video analysis, extract data from the columnar timeline (or legacy frames)
         times = []
         valence_values = []
         engagement_values = []
         
+        if full_timeline:
+            times = list(full_timeline.get('timestamps', []))
+            valence_values = list(full_timeline.get('valence', []))
+            engagement_values = [value / 100 for value in full_timeline.get('engagement', [])]  # Convert to 0-1
+        
         for frame in frames:
             if 'timestamp' in frame and frame.get('faces', []):
                 times.append(frame['timestamp'])
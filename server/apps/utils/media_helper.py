@@ -5,10 +5,28 @@ import os
 # Import MongoDB connection
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 from database import db
+from apps.utils.pagination import keyset_page, ensure_keyset_index
 
 # Media storage collection
 media_storage_collection = db["media_storage"]
 
+ensure_keyset_index(media_storage_collection, "user_id")
+ensure_keyset_index(media_storage_collection, "user_id", "media_category")
+
+# Fields returned by media library listings
+MEDIA_SUMMARY_PROJECTION = {
+    "user_id": 1,
+    "media_type": 1,
+    "media_url": 1,
+    "public_id": 1,
+    "media_category": 1,
+    "filename": 1,
+    "metadata": 1,
+    "analysis_id": 1,
+    "session_id": 1,
+    "created_at": 1
+}
+
 class MediaStorage:
     def __init__(self, user_id, media_type, media_url, public_id, 
                  media_category, filename=None, metadata=None,
@@ -43,7 +61,7 @@ class MediaStorage:
         return media_storage_collection.find_one({"_id": ObjectId(media_id)})
         
     @staticmethod
-    def find_by_user(user_id, media_category=None, media_type=None, limit=10, skip=0):
+    def find_by_user(user_id, media_category=None, media_type=None, limit=10, skip=0, projection=None):
         """Find media for a specific user with optional filters"""
         from bson import ObjectId
         if isinstance(user_id, str):
@@ -55,10 +73,25 @@ class MediaStorage:
         if media_type:
             query["media_type"] = media_type
             
-        return list(media_storage_collection.find(query)
+        return list(media_storage_collection.find(query, projection)
                    .sort("created_at", -1)
                    .skip(skip)
                    .limit(limit))
+
+    @staticmethod
+    def list_by_user(user_id, media_category=None, media_type=None, limit=10, cursor=None):
+        """Page of a user's media, newest first; returns (media, next_cursor)"""
+        from bson import ObjectId
+        if isinstance(user_id, str):
+            user_id = ObjectId(user_id)
+
+        query = {"user_id": user_id}
+        if media_category:
+            query["media_category"] = media_category
+        if media_type:
+            query["media_type"] = media_type
+
+        return keyset_page(media_storage_collection, query, MEDIA_SUMMARY_PROJECTION, limit, cursor)
                    
     @staticmethod
     def find_by_session(session_id, limit=50, skip=0):
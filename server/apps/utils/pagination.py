@@ -0,0 +1,76 @@
+import json
+import base64
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+logger = logging.getLogger(__name__)
+
+# Newest first, with _id breaking ties between documents created in the same millisecond
+KEYSET_SORT = [("created_at", -1), ("_id", -1)]
+
+MAX_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    """ Raised when a continuation token cannot be decoded """
+
+
+def encode_cursor(document):
+    """ Opaque continuation token pointing just past the given document """
+    payload = json.dumps({
+        "t": document["created_at"].isoformat(),
+        "id": str(document["_id"])
+    }, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """ (created_at, _id) of a continuation token """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursor(f"Invalid cursor: {str(e)}")
+
+
+def keyset_page(collection, query, projection=None, limit=10, cursor=None):
+    """
+    One page of a (created_at, _id) descending listing.
+
+    Instead of skipping over earlier pages, the next page starts strictly after
+    the last document of the previous one, so every page costs the same index
+    seek no matter how deep it is. Callers need an index on the equality fields
+    of ``query`` followed by created_at and _id.
+
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    page_query = dict(query)
+
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        page_query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}}
+        ]
+
+    # One extra document tells us whether another page exists
+    documents = list(collection.find(page_query, projection).sort(KEYSET_SORT).limit(limit + 1))
+    if len(documents) <= limit:
+        return documents, None
+
+    documents = documents[:limit]
+    return documents, encode_cursor(documents[-1])
+
+
+def ensure_keyset_index(collection, *prefix):
+    """ Create the (prefix..., created_at, _id) index a keyset listing relies on """
+    keys = [(field, 1) for field in prefix] + KEYSET_SORT
+    try:
+        collection.create_index(keys)
+    except Exception as e:
+        logger.warning(f"Could not create index {keys} on {collection.name}: {str(e)}")